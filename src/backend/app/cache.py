@@ -0,0 +1,491 @@
+# Módulo de acesso ao Redis
+import asyncio
+import hashlib
+import json
+import math
+import os
+import random
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+
+import redis
+import redis.asyncio
+from opentelemetry import trace
+from starlette.concurrency import run_in_threadpool
+
+from database import IO_MODE
+from instrumentation import tracer, cache_tier_counter, register_cache_tiers
+
+
+class ThreadedRedis:
+    """Expõe o cliente síncrono com a interface awaitable do redis.asyncio.
+
+    Cada comando roda no threadpool do anyio, como aconteceria numa rota ``def``.
+    """
+
+    def __init__(self, client):
+        self.client = client
+
+    def __getattr__(self, name):
+        method = getattr(self.client, name)
+
+        async def call(*args, **kwargs):
+            return await run_in_threadpool(method, *args, **kwargs)
+
+        return call
+
+    def pubsub(self):
+        return ThreadedRedis(self.client.pubsub())
+
+    async def aclose(self):
+        await run_in_threadpool(self.client.close)
+
+
+def create_redis_client():
+    # Pool bloqueante: sob pico as requisições esperam por uma conexão em vez de falhar
+    options = {
+        "host": os.getenv("REDIS_HOST", "cache"),
+        "port": int(os.getenv("REDIS_PORT", "6379")),
+        "password": os.getenv("REDIS_PASSWORD") or None,
+        "db": int(os.getenv("REDIS_DB", "0")),
+        "decode_responses": True,
+        "max_connections": int(os.getenv("REDIS_MAX_CONNECTIONS", "50")),
+        "timeout": float(os.getenv("REDIS_POOL_TIMEOUT", "20")),
+    }
+    if IO_MODE == "async":
+        return redis.asyncio.Redis(connection_pool=redis.asyncio.BlockingConnectionPool(**options))
+    return ThreadedRedis(redis.Redis(connection_pool=redis.BlockingConnectionPool(**options)))
+
+
+redis_client = create_redis_client()
+
+
+class LuaScript:
+    """Script Lua executado via EVALSHA, com fallback para EVAL se não estiver carregado."""
+
+    def __init__(self, source):
+        self.source = source
+        self.sha = hashlib.sha1(source.encode()).hexdigest()
+
+    async def __call__(self, keys, args):
+        try:
+            return await redis_client.evalsha(self.sha, len(keys), *keys, *args)
+        except redis.exceptions.NoScriptError:
+            return await redis_client.eval(self.source, len(keys), *keys, *args)
+
+
+# --- Cache local (L1) em frente ao Redis ---
+# Cada worker guarda por alguns segundos os valores lidos do Redis. Escritas
+# publicam a chave em CACHE_INVALIDATION_CHANNEL e todos os workers a descartam;
+# o TTL local limita o tempo de uma cópia desatualizada se uma mensagem se perder.
+LOCAL_CACHE_TTL = float(os.getenv("LOCAL_CACHE_TTL", "5"))
+LOCAL_CACHE_MAX_ENTRIES = int(os.getenv("LOCAL_CACHE_MAX_ENTRIES", "1024"))
+CACHE_INVALIDATION_CHANNEL = "fintelli:cache:invalidate"
+# Identifica as mensagens deste worker, que já invalidou a própria cópia ao publicar
+_WORKER_ID = uuid.uuid4().hex
+
+
+class LocalCache:
+    """LRU limitado com TTL por entrada, local ao processo."""
+
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        # Incrementada a cada invalidação; set() com uma época antiga é ignorado
+        self.epoch = 0
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] > time.monotonic():
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+        if entry is not None:
+            del self._entries[key]
+        self.misses += 1
+        return None
+
+    def set(self, key, value, epoch):
+        """Guarda ``value`` se nenhuma invalidação ocorreu desde ``epoch``."""
+        if self.ttl <= 0 or epoch != self.epoch:
+            return False
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        return True
+
+    def invalidate(self, key):
+        self.epoch += 1
+        self._entries.pop(key, None)
+
+    def clear(self):
+        self.epoch += 1
+        self._entries.clear()
+
+
+local_cache = LocalCache(LOCAL_CACHE_MAX_ENTRIES, LOCAL_CACHE_TTL)
+_redis_tier = {"hits": 0, "misses": 0}
+
+register_cache_tiers(lambda: {
+    "local": (local_cache.hits, local_cache.misses),
+    "redis": (_redis_tier["hits"], _redis_tier["misses"]),
+})
+
+
+def _record_tier(tier, hit):
+    cache_tier_counter.add(1, {"tier": tier, "result": "hit" if hit else "miss"})
+    if tier == "redis":
+        _redis_tier["hits" if hit else "misses"] += 1
+
+
+def _invalidate_local(key):
+    local_cache.invalidate(key)
+    # A versão dos dados (ETags) só muda nas escritas, que sempre invalidam o resumo
+    if key == SUMMARY_CACHE_KEY:
+        local_cache.invalidate(DATA_VERSION_LOCAL_KEY)
+
+
+async def invalidate(key):
+    """Descarta ``key`` do cache local deste e dos demais workers."""
+    _invalidate_local(key)
+    try:
+        await redis_client.publish(CACHE_INVALIDATION_CHANNEL, f"{_WORKER_ID} {key}")
+    except redis.RedisError as e:
+        # Os outros workers ficam com a cópia antiga no máximo por LOCAL_CACHE_TTL
+        print(f"Falha ao publicar invalidação de cache: {e}")
+
+
+async def run_cache_invalidation():
+    """Escuta as invalidações publicadas pelos workers e as aplica no cache local."""
+    while True:
+        pubsub = redis_client.pubsub()
+        try:
+            await pubsub.subscribe(CACHE_INVALIDATION_CHANNEL)
+            # Mensagens perdidas enquanto desconectado: começa do zero
+            local_cache.clear()
+            while True:
+                message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+                if message is not None:
+                    sender, _, key = message["data"].partition(" ")
+                    if sender != _WORKER_ID:
+                        _invalidate_local(key)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Falha na escuta de invalidações de cache: {e}")
+            local_cache.clear()
+            await asyncio.sleep(1)
+        finally:
+            try:
+                await pubsub.aclose()
+            except Exception:
+                pass
+
+
+# --- Cache write-through do resumo financeiro ---
+# O resumo fica num hash (income, expense) atualizado a cada escrita. Cada escrita
+# se registra em SUMMARY_PENDING_KEY antes de tocar o banco e incrementa a geração
+# ao começar e ao terminar; um recálculo só é gravado se nenhuma escrita estiver
+# em andamento e a geração não mudou desde antes da consulta ao banco.
+SUMMARY_CACHE_KEY = "financial_summary"
+SUMMARY_GENERATION_KEY = "financial_summary:generation"
+SUMMARY_PENDING_KEY = "financial_summary:pending"
+# Instante do fim da última escrita e época sorteada que, com a geração, formam a versão
+SUMMARY_WRITTEN_AT_KEY = "financial_summary:written_at"
+SUMMARY_EPOCH_KEY = "financial_summary:epoch"
+# Chave só do cache local: a versão lida do Redis, descartada junto com o resumo
+DATA_VERSION_LOCAL_KEY = "financial_summary:data_version"
+SUMMARY_CACHE_TTL = int(os.getenv("SUMMARY_CACHE_TTL", "3600"))
+# Escritas pendentes há mais tempo que isso são consideradas abandonadas (worker morto)
+SUMMARY_PENDING_TIMEOUT = 60
+
+# --- Proteção contra stampede ---
+# "none": cada miss consulta o banco; "local": um recálculo por worker (single-flight);
+# "redis": além do local, um lock no Redis coordena os workers
+SUMMARY_STAMPEDE_PROTECTION = os.getenv("SUMMARY_STAMPEDE_PROTECTION", "local").lower()
+# Janela (s) após a expiração em que o valor antigo ainda é servido enquanto um
+# único worker o recalcula em segundo plano; 0 desativa
+SUMMARY_STALE_WHILE_REVALIDATE = int(os.getenv("SUMMARY_STALE_WHILE_REVALIDATE", "0"))
+# Expiração antecipada probabilística (XFetch); 0 desativa, 1 é o valor recomendado
+SUMMARY_EARLY_EXPIRATION_BETA = float(os.getenv("SUMMARY_EARLY_EXPIRATION_BETA", "0"))
+SUMMARY_LOCK_KEY = "financial_summary:lock"
+SUMMARY_LOCK_TIMEOUT = float(os.getenv("SUMMARY_LOCK_TIMEOUT", "10"))
+
+_begin_summary_write = LuaScript("""
+redis.call('INCR', KEYS[2])
+redis.call('ZADD', KEYS[3], ARGV[1], ARGV[2])
+return 1
+""")
+
+_finish_summary_write = LuaScript("""
+redis.call('INCR', KEYS[2])
+redis.call('ZREM', KEYS[3], ARGV[1])
+redis.call('SET', KEYS[4], ARGV[4])
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    redis.call('HINCRBYFLOAT', KEYS[1], 'income', ARGV[2])
+    redis.call('HINCRBYFLOAT', KEYS[1], 'expense', ARGV[3])
+    return 1
+end
+return 0
+""")
+
+_store_summary = LuaScript("""
+redis.call('ZREMRANGEBYSCORE', KEYS[3], '-inf', ARGV[5])
+if redis.call('ZCARD', KEYS[3]) > 0 then
+    return 0
+end
+local generation = redis.call('GET', KEYS[2]) or '0'
+if generation ~= ARGV[1] then
+    return 0
+end
+redis.call('DEL', KEYS[1])
+redis.call('HSET', KEYS[1], 'income', ARGV[2], 'expense', ARGV[3], 'expires_at', ARGV[6], 'compute_time', ARGV[7])
+redis.call('EXPIRE', KEYS[1], ARGV[4])
+return 1
+""")
+
+_release_lock = LuaScript("""
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+""")
+
+_read_data_version = LuaScript("""
+local epoch = redis.call('GET', KEYS[1])
+if not epoch then
+    epoch = ARGV[1]
+    redis.call('SET', KEYS[1], epoch)
+end
+return {epoch, redis.call('GET', KEYS[2]) or '0', redis.call('GET', KEYS[3]) or '0'}
+""")
+
+_SUMMARY_KEYS = [SUMMARY_CACHE_KEY, SUMMARY_GENERATION_KEY, SUMMARY_PENDING_KEY]
+_SUMMARY_WRITE_KEYS = _SUMMARY_KEYS + [SUMMARY_WRITTEN_AT_KEY]
+
+
+def summary_from_hash(values):
+    income = float(values["income"])
+    expense = float(values["expense"])
+    return {"income": income, "expense": expense, "balance": income + expense}
+
+
+def summary_freshness(values, now=None):
+    """Classifica o valor em cache como "fresh", "stale" (expirado, na janela SWR) ou "early"."""
+    if "expires_at" not in values:
+        return "fresh"
+    now = time.time() if now is None else now
+    expires_at = float(values["expires_at"])
+    if now >= expires_at:
+        return "stale"
+    if SUMMARY_EARLY_EXPIRATION_BETA > 0:
+        # XFetch: quanto mais caro o recálculo e mais perto da expiração, maior a chance
+        compute_time = float(values.get("compute_time", 0))
+        if now - compute_time * SUMMARY_EARLY_EXPIRATION_BETA * math.log(1.0 - random.random()) >= expires_at:
+            return "early"
+    return "fresh"
+
+
+async def get_cached_summary():
+    """Retorna (resumo, frescor) ou (None, None) em caso de miss.
+
+    O frescor é recalculado a cada leitura, inclusive quando o hash vem do cache local.
+    """
+    values = local_cache.get(SUMMARY_CACHE_KEY)
+    _record_tier("local", values is not None)
+    if values is None:
+        epoch = local_cache.epoch
+        try:
+            values = await redis_client.hgetall(SUMMARY_CACHE_KEY)
+        except redis.exceptions.ResponseError:
+            # Chave no formato antigo (string JSON): trata como miss; store_summary a substitui
+            values = None
+        _record_tier("redis", bool(values))
+        if not values:
+            return None, None
+        local_cache.set(SUMMARY_CACHE_KEY, values, epoch)
+    return summary_from_hash(values), summary_freshness(values)
+
+
+async def summary_generation():
+    """Geração atual; deve ser lida antes de consultar o banco para um recálculo."""
+    return await redis_client.get(SUMMARY_GENERATION_KEY) or "0"
+
+
+async def data_version():
+    """Versão dos dados de transactions para ETags: (versão, instante da última escrita).
+
+    A geração muda no início e no fim de cada escrita; a época, sorteada quando não
+    existe, evita repetir versões se o Redis perder a geração. None se o Redis falhar.
+    Como o resumo, fica no cache local até a invalidação publicada no fim da escrita,
+    então leituras com o L1 quente não vão ao Redis.
+    """
+    version = local_cache.get(DATA_VERSION_LOCAL_KEY)
+    if version is not None:
+        return version
+    epoch = local_cache.epoch
+    try:
+        redis_epoch, generation, written_at = await _read_data_version(
+            [SUMMARY_EPOCH_KEY, SUMMARY_GENERATION_KEY, SUMMARY_WRITTEN_AT_KEY], [uuid.uuid4().hex[:12]]
+        )
+    except redis.RedisError as e:
+        trace.get_current_span().record_exception(e)
+        return None
+    version = f"{redis_epoch}.{generation}", float(written_at)
+    local_cache.set(DATA_VERSION_LOCAL_KEY, version, epoch)
+    return version
+
+
+async def store_summary(summary, generation, compute_time=0.0):
+    """Grava o resumo se nenhuma escrita ocorreu ou está em andamento desde ``generation``.
+
+    A chave vive no Redis por SUMMARY_CACHE_TTL + SUMMARY_STALE_WHILE_REVALIDATE;
+    ``expires_at`` marca o fim do período em que o valor é considerado fresco.
+    """
+    now = time.time()
+    stored = await _store_summary(
+        _SUMMARY_KEYS,
+        [generation, repr(summary["income"]), repr(summary["expense"]),
+         SUMMARY_CACHE_TTL + SUMMARY_STALE_WHILE_REVALIDATE,
+         now - SUMMARY_PENDING_TIMEOUT, repr(now + SUMMARY_CACHE_TTL), repr(compute_time)],
+    )
+    if stored == 1:
+        await invalidate(SUMMARY_CACHE_KEY)
+    return stored == 1
+
+
+# --- Resumos por período ---
+# Cada (granularidade, início, fim) tem a própria chave. A geração entra no nome:
+# toda escrita a incrementa, então leituras posteriores usam chaves novas e as
+# antigas apenas expiram pelo TTL, sem varrer nem apagar nada.
+PERIOD_SUMMARY_CACHE_TTL = int(os.getenv("PERIOD_SUMMARY_CACHE_TTL", "300"))
+
+
+def period_cache_key(generation, granularity, date_from, date_to):
+    return f"{SUMMARY_CACHE_KEY}:period:{generation}:{granularity}:{date_from}:{date_to}"
+
+
+async def get_cached_period(key):
+    """Resumo por período em cache (local ou Redis), ou None."""
+    value = local_cache.get(key)
+    _record_tier("local", value is not None)
+    if value is None:
+        epoch = local_cache.epoch
+        raw = await redis_client.get(key)
+        _record_tier("redis", raw is not None)
+        if raw is None:
+            return None
+        value = json.loads(raw)
+        local_cache.set(key, value, epoch)
+    return value
+
+
+async def store_period(key, value):
+    await redis_client.set(key, json.dumps(value), ex=PERIOD_SUMMARY_CACHE_TTL)
+    local_cache.set(key, value, local_cache.epoch)
+
+
+class SingleFlight:
+    """Coalesce chamadas concorrentes por chave: só a primeira executa, as demais aguardam o resultado."""
+
+    def __init__(self):
+        self._inflight = {}
+
+    def in_flight(self, key):
+        return key in self._inflight
+
+    async def run(self, key, func):
+        """Retorna (resultado, coalesced)."""
+        future = self._inflight.get(key)
+        if future is not None:
+            return await asyncio.shield(future), True
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            result = await func()
+            future.set_result(result)
+            return result, False
+        except BaseException as e:
+            future.set_exception(e)
+            # Evita o aviso de exceção não recuperada quando ninguém aguardava
+            future.exception()
+            raise
+        finally:
+            del self._inflight[key]
+
+
+@asynccontextmanager
+async def redis_lock(key, timeout):
+    """Lock distribuído simples (SET NX PX). Produz True se obtido, False caso contrário."""
+    token = uuid.uuid4().hex
+    acquired = await redis_client.set(key, token, nx=True, px=int(timeout * 1000))
+    try:
+        yield bool(acquired)
+    finally:
+        if acquired:
+            await _release_lock([key], [token])
+
+
+class SummaryWrite:
+    """Quantias inseridas e removidas por uma escrita em transactions."""
+
+    def __init__(self):
+        self.token = uuid.uuid4().hex
+        self.income = 0.0
+        self.expense = 0.0
+
+    def added(self, amounts):
+        for amount in amounts:
+            if amount > 0:
+                self.income += float(amount)
+            else:
+                self.expense += float(amount)
+
+    def removed(self, amounts):
+        for amount in amounts:
+            if amount > 0:
+                self.income -= float(amount)
+            else:
+                self.expense -= float(amount)
+
+
+@asynccontextmanager
+async def summary_write():
+    """Envolve uma escrita em transactions e aplica o delta no resumo em cache ao final.
+
+    O bloco deve registrar as quantias gravadas com ``added``/``removed`` somente
+    depois do commit no banco.
+    """
+    write = SummaryWrite()
+    await _begin_summary_write(_SUMMARY_KEYS, [time.time(), write.token])
+    try:
+        yield write
+    except BaseException:
+        await _finish_summary_write(_SUMMARY_WRITE_KEYS, [write.token, 0, 0, repr(time.time())])
+        raise
+    with tracer.start_as_current_span("cache.update") as span:
+        span.set_attribute("cache.key", SUMMARY_CACHE_KEY)
+        try:
+            applied = await _finish_summary_write(
+                _SUMMARY_WRITE_KEYS, [write.token, repr(write.income), repr(write.expense), repr(time.time())]
+            )
+            span.set_attribute("cache.operation", "hincrbyfloat")
+            span.set_attribute("cache.hit", applied == 1)
+        except redis.RedisError as e:
+            # Sem o delta o valor em cache ficaria errado; descarta para forçar recálculo
+            span.record_exception(e)
+            span.set_attribute("cache.operation", "delete")
+            try:
+                await redis_client.delete(SUMMARY_CACHE_KEY)
+            except redis.RedisError as e:
+                # A escrita no banco já foi confirmada: não pode falhar por causa do cache.
+                # O TTL e a reconciliação periódica corrigem o valor que ficou no Redis
+                span.record_exception(e)
+                print(f"Falha ao descartar o resumo em cache após escrita: {e}")
+        await invalidate(SUMMARY_CACHE_KEY)
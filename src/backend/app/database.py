@@ -0,0 +1,570 @@
+# Módulo de acesso ao PostgreSQL: pool de conexões compartilhado pelo processo
+import asyncio
+import csv
+import functools
+import io
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager, asynccontextmanager
+
+import psycopg2
+import psycopg2.extensions
+import psycopg2.extras
+import psycopg_pool
+from psycopg.rows import dict_row
+from starlette.concurrency import run_in_threadpool
+
+from instrumentation import tracer, register_connection_pool
+from query_metrics import TimedAsyncCursor, TimedConnection, configure_async_connection
+
+# "async" usa psycopg3 + redis.asyncio no event loop; "sync" mantém psycopg2 +
+# redis síncrono executados no threadpool, para comparação lado a lado
+IO_MODE = os.getenv("FINTELLI_IO_MODE", "async").lower()
+
+# Nome do alvo nos spans e métricas; réplicas usam "replica:host:porta"
+PRIMARY = "primary"
+
+
+class PoolTimeout(Exception):
+    """Nenhuma conexão ficou disponível dentro do tempo de checkout."""
+
+
+class ConnectionPool:
+    """Pool de conexões psycopg2 thread-safe.
+
+    Mantém entre ``min_size`` e ``max_size`` conexões, aguarda até ``timeout``
+    segundos por uma conexão livre, valida a conexão no checkout e descarta
+    conexões ociosas há mais de ``max_idle`` segundos.
+    """
+
+    def __init__(self, connect, min_size=1, max_size=10, timeout=30.0,
+                 max_idle=300.0, check_on_checkout=True):
+        if min_size < 0 or max_size < 1 or min_size > max_size:
+            raise ValueError("Tamanhos de pool inválidos: min=%s max=%s" % (min_size, max_size))
+        self._connect = connect
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self.check_on_checkout = check_on_checkout
+
+        self._cond = threading.Condition()
+        self._idle = deque()  # (conexão, instante em que voltou ao pool)
+        self._size = 0        # conexões abertas (ociosas + em uso)
+        self._in_use = 0
+        self._waiting = 0
+        self._closed = False
+
+    def stats(self):
+        with self._cond:
+            return {"in_use": self._in_use, "idle": len(self._idle), "waiting": self._waiting}
+
+    def getconn(self, timeout=None):
+        deadline = time.monotonic() + (self.timeout if timeout is None else timeout)
+        while True:
+            conn = self._acquire(deadline)
+            if conn is None:
+                # Slot reservado: abre a conexão fora do lock
+                try:
+                    conn = self._connect()
+                except Exception:
+                    self._release_slot()
+                    raise
+                return conn
+            if not self.check_on_checkout or self._is_healthy(conn):
+                return conn
+            self._discard(conn)
+
+    def putconn(self, conn):
+        if not conn.closed and conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            try:
+                conn.rollback()
+            except psycopg2.Error:
+                pass
+        with self._cond:
+            self._in_use -= 1
+            if self._closed or conn.closed:
+                self._size -= 1
+                self._close_quietly(conn)
+            else:
+                self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    def closeall(self):
+        with self._cond:
+            self._closed = True
+            while self._idle:
+                conn, _ = self._idle.popleft()
+                self._size -= 1
+                self._close_quietly(conn)
+            self._cond.notify_all()
+
+    def _acquire(self, deadline):
+        """Retorna uma conexão ociosa, ou None quando reservou um slot para uma nova."""
+        with self._cond:
+            self._waiting += 1
+            try:
+                while True:
+                    if self._closed:
+                        raise PoolTimeout("Pool de conexões encerrado")
+                    self._recycle_idle()
+                    if self._idle:
+                        conn, _ = self._idle.pop()
+                        self._in_use += 1
+                        return conn
+                    if self._size < self.max_size:
+                        self._size += 1
+                        self._in_use += 1
+                        return None
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise PoolTimeout(
+                            "Nenhuma conexão disponível após %.1fs (max_size=%d)" % (self.timeout, self.max_size)
+                        )
+                    self._cond.wait(remaining)
+            finally:
+                self._waiting -= 1
+
+    def _recycle_idle(self):
+        # As conexões mais antigas ficam à esquerda; mantém ao menos min_size abertas
+        now = time.monotonic()
+        while self._idle and self._size > self.min_size:
+            conn, released_at = self._idle[0]
+            if now - released_at < self.max_idle and not conn.closed:
+                break
+            self._idle.popleft()
+            self._size -= 1
+            self._close_quietly(conn)
+
+    def _is_healthy(self, conn):
+        if conn.closed:
+            return False
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _discard(self, conn):
+        self._close_quietly(conn)
+        self._release_slot()
+
+    def _release_slot(self):
+        with self._cond:
+            self._size -= 1
+            self._in_use -= 1
+            self._cond.notify()
+
+    @staticmethod
+    def _close_quietly(conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+
+def _connection_kwargs(host=None, port=None):
+    """Parâmetros de conexão; ``host``/``port`` sobrescrevem os do primário (réplicas)."""
+    return {
+        "dbname": os.getenv("POSTGRES_DB"),
+        "user": os.getenv("POSTGRES_USER"),
+        "password": os.getenv("POSTGRES_PASSWORD"),
+        "host": host or os.getenv("POSTGRES_HOST", "db"),
+        "port": port or os.getenv("POSTGRES_PORT", "5432"),
+    }
+
+
+def _connect(host=None, port=None, target=PRIMARY):
+    conn = psycopg2.connect(connection_factory=TimedConnection, **_connection_kwargs(host, port))
+    conn.db_target = target
+    return conn
+
+
+def _pool_settings():
+    return {
+        "min_size": int(os.getenv("DB_POOL_MIN_SIZE", "1")),
+        "max_size": int(os.getenv("DB_POOL_MAX_SIZE", "10")),
+        "timeout": float(os.getenv("DB_POOL_TIMEOUT", "30")),
+        "max_idle": float(os.getenv("DB_POOL_MAX_IDLE", "300")),
+        "check_on_checkout": os.getenv("DB_POOL_CHECK_ON_CHECKOUT", "true").lower() == "true",
+    }
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """Retorna o pool do processo, criando-o na primeira chamada."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(_connect, **_pool_settings())
+    return _pool
+
+
+def close_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.closeall()
+            _pool = None
+
+
+def _pool_stats():
+    return _pool.stats() if _pool is not None else {}
+
+
+register_connection_pool(_pool_stats)
+
+
+@contextmanager
+def _connect_span(pool_stats, target=PRIMARY):
+    with tracer.start_as_current_span("database.connect") as span:
+        span.set_attribute("db.system", "postgresql")
+        span.set_attribute("db.name", os.getenv("POSTGRES_DB") or "")
+        span.set_attribute("db.target", target)
+        try:
+            yield
+            span.set_attribute("db.connection.status", "success")
+        except Exception as e:
+            span.set_attribute("db.connection.status", "error")
+            span.record_exception(e)
+            raise
+        for state, value in pool_stats().items():
+            span.set_attribute(f"db.pool.{state}", value)
+
+
+@contextmanager
+def get_db_connection(pool=None, target=PRIMARY):
+    """Empresta uma conexão do pool (o do primário por padrão) e a devolve ao sair do bloco."""
+    pool = pool or get_pool()
+    with _connect_span(pool.stats, target):
+        conn = pool.getconn()
+    try:
+        yield conn
+    finally:
+        pool.putconn(conn)
+
+
+# --- Camada de acesso a dados ---
+# As duas implementações expõem a mesma interface awaitable:
+#   fetch_all / fetch_one / execute  -> cada chamada é uma transação própria
+#   stream_batches                   -> cursor nomeado no servidor, em lotes
+#   copy_rows                        -> COPY ... FROM STDIN de um lote de tuplas
+#   insert_rows                      -> INSERT de várias linhas, com RETURNING opcional
+#   transaction()                    -> várias instruções na mesma transação
+
+STREAM_BATCH_SIZE = int(os.getenv("DB_STREAM_BATCH_SIZE", "1000"))
+
+def _fetch_all(conn, query, params):
+    with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
+        cur.execute(query, params)
+        return cur.fetchall()
+
+
+def _fetch_one(conn, query, params):
+    with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
+        cur.execute(query, params)
+        return cur.fetchone()
+
+
+def _execute(conn, query, params):
+    with conn.cursor() as cur:
+        cur.execute(query, params)
+        return cur.rowcount
+
+
+def _copy_statement(table, columns):
+    # Identificadores vêm sempre do código, nunca da requisição
+    return f"COPY {table} ({', '.join(columns)}) FROM STDIN"
+
+
+def _returning_clause(returning):
+    return f" RETURNING {returning}" if returning else ""
+
+
+def _insert_rows(conn, table, columns, rows, returning):
+    # execute_values envia todas as linhas num único INSERT ... VALUES
+    query = f"INSERT INTO {table} ({', '.join(columns)}) VALUES %s" + _returning_clause(returning)
+    with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
+        result = psycopg2.extras.execute_values(cur, query, rows, page_size=max(len(rows), 1), fetch=bool(returning))
+        return result if returning else cur.rowcount
+
+
+def _copy_rows(conn, table, columns, rows):
+    # psycopg2 só aceita um arquivo: serializa o lote em CSV na memória
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    buffer.seek(0)
+    with conn.cursor() as cur:
+        cur.copy_expert(_copy_statement(table, columns) + " WITH (FORMAT csv)", buffer)
+        return cur.rowcount
+
+
+class SyncTransaction:
+    """Transação psycopg2; cada instrução roda no threadpool."""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    async def fetch_all(self, query, params=None):
+        return await run_in_threadpool(_fetch_all, self.conn, query, params)
+
+    async def fetch_one(self, query, params=None):
+        return await run_in_threadpool(_fetch_one, self.conn, query, params)
+
+    async def execute(self, query, params=None):
+        return await run_in_threadpool(_execute, self.conn, query, params)
+
+    async def copy_rows(self, table, columns, rows):
+        return await run_in_threadpool(_copy_rows, self.conn, table, columns, rows)
+
+    async def insert_rows(self, table, columns, rows, returning=None):
+        return await run_in_threadpool(_insert_rows, self.conn, table, columns, rows, returning)
+
+    async def stream_batches(self, query, params=None, batch_size=STREAM_BATCH_SIZE):
+        cur = self.conn.cursor(name=f"stream_{uuid.uuid4().hex}", cursor_factory=psycopg2.extras.RealDictCursor)
+        try:
+            await run_in_threadpool(cur.execute, query, params)
+            while True:
+                rows = await run_in_threadpool(cur.fetchmany, batch_size)
+                if not rows:
+                    break
+                yield rows
+        finally:
+            await run_in_threadpool(cur.close)
+
+
+class SyncDatabase:
+    """psycopg2 + ConnectionPool, com o I/O bloqueante no threadpool do anyio.
+
+    O primário usa o pool do processo (get_pool); cada réplica tem o seu.
+    """
+
+    mode = "sync"
+
+    def __init__(self, target=PRIMARY, host=None, port=None):
+        self.target = target
+        self._pool = None
+        if target != PRIMARY:
+            self._pool = ConnectionPool(functools.partial(_connect, host, port, target), **_pool_settings())
+            register_connection_pool(self._pool.stats, target)
+
+    def _connection(self):
+        return get_db_connection(self._pool, self.target)
+
+    async def open(self):
+        if self._pool is None:
+            await run_in_threadpool(get_pool)
+
+    async def close(self):
+        if self._pool is None:
+            await run_in_threadpool(close_pool)
+        else:
+            await run_in_threadpool(self._pool.closeall)
+
+    async def _run(self, operation, query, params):
+        def work():
+            with self._connection() as conn:
+                result = operation(conn, query, params)
+                conn.commit()
+                return result
+        return await run_in_threadpool(work)
+
+    async def fetch_all(self, query, params=None):
+        return await self._run(_fetch_all, query, params)
+
+    async def fetch_one(self, query, params=None):
+        return await self._run(_fetch_one, query, params)
+
+    async def execute(self, query, params=None):
+        return await self._run(_execute, query, params)
+
+    async def copy_rows(self, table, columns, rows):
+        def work():
+            with self._connection() as conn:
+                count = _copy_rows(conn, table, columns, rows)
+                conn.commit()
+                return count
+        return await run_in_threadpool(work)
+
+    async def insert_rows(self, table, columns, rows, returning=None):
+        async with self.transaction() as tx:
+            return await tx.insert_rows(table, columns, rows, returning)
+
+    async def stream_batches(self, query, params=None, batch_size=STREAM_BATCH_SIZE):
+        """Itera o resultado em lotes, com memória constante, via cursor no servidor."""
+        async with self.transaction() as tx:
+            async for rows in tx.stream_batches(query, params, batch_size):
+                yield rows
+
+    @asynccontextmanager
+    async def transaction(self):
+        connection = self._connection()
+        conn = await run_in_threadpool(connection.__enter__)
+        try:
+            yield SyncTransaction(conn)
+            await run_in_threadpool(conn.commit)
+        finally:
+            # Em caso de erro o pool faz o rollback ao receber a conexão
+            await run_in_threadpool(connection.__exit__, None, None, None)
+
+
+class AsyncTransaction:
+    """Transação psycopg3 executada diretamente no event loop."""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    async def fetch_all(self, query, params=None):
+        async with self.conn.cursor(row_factory=dict_row) as cur:
+            await cur.execute(query, params)
+            return await cur.fetchall()
+
+    async def fetch_one(self, query, params=None):
+        async with self.conn.cursor(row_factory=dict_row) as cur:
+            await cur.execute(query, params)
+            return await cur.fetchone()
+
+    async def execute(self, query, params=None):
+        async with self.conn.cursor() as cur:
+            await cur.execute(query, params)
+            return cur.rowcount
+
+    async def copy_rows(self, table, columns, rows):
+        async with self.conn.cursor() as cur:
+            async with cur.copy(_copy_statement(table, columns)) as copy:
+                for row in rows:
+                    await copy.write_row(row)
+            return cur.rowcount
+
+    async def insert_rows(self, table, columns, rows, returning=None):
+        # executemany usa o modo pipeline do psycopg3: uma ida e volta para o lote
+        placeholders = ", ".join(["%s"] * len(columns))
+        query = f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({placeholders})" + _returning_clause(returning)
+        async with self.conn.cursor(row_factory=dict_row) as cur:
+            await cur.executemany(query, rows, returning=bool(returning))
+            if not returning:
+                return cur.rowcount
+            results = []
+            while True:
+                results.extend(await cur.fetchall())
+                if not cur.nextset():
+                    return results
+
+    async def stream_batches(self, query, params=None, batch_size=STREAM_BATCH_SIZE):
+        async with self.conn.cursor(name=f"stream_{uuid.uuid4().hex}", row_factory=dict_row) as cur:
+            await cur.execute(query, params)
+            while True:
+                rows = await cur.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield rows
+
+
+class AsyncDatabase:
+    """psycopg3 AsyncConnectionPool configurado pelas mesmas variáveis DB_POOL_*."""
+
+    mode = "async"
+
+    def __init__(self, target=PRIMARY, host=None, port=None):
+        self.target = target
+        self.pool = None
+        self._host = host
+        self._port = port
+        self._open_lock = asyncio.Lock()
+        register_connection_pool(self.stats, target)
+
+    def stats(self):
+        if self.pool is None:
+            return {}
+        pool_stats = self.pool.get_stats()
+        available = pool_stats.get("pool_available", 0)
+        return {
+            "in_use": pool_stats.get("pool_size", 0) - available,
+            "idle": available,
+            "waiting": pool_stats.get("requests_waiting", 0),
+        }
+
+    async def open(self):
+        async with self._open_lock:
+            if self.pool is not None:
+                return
+            settings = _pool_settings()
+            pool = psycopg_pool.AsyncConnectionPool(
+                kwargs={**_connection_kwargs(self._host, self._port), "cursor_factory": TimedAsyncCursor},
+                configure=functools.partial(configure_async_connection, target=self.target),
+                min_size=settings["min_size"],
+                max_size=settings["max_size"],
+                timeout=settings["timeout"],
+                max_idle=settings["max_idle"],
+                check=psycopg_pool.AsyncConnectionPool.check_connection if settings["check_on_checkout"] else None,
+                open=False,
+            )
+            await pool.open()
+            self.pool = pool
+
+    async def close(self):
+        if self.pool is not None:
+            await self.pool.close()
+            self.pool = None
+
+    async def fetch_all(self, query, params=None):
+        async with self.transaction() as tx:
+            return await tx.fetch_all(query, params)
+
+    async def fetch_one(self, query, params=None):
+        async with self.transaction() as tx:
+            return await tx.fetch_one(query, params)
+
+    async def execute(self, query, params=None):
+        async with self.transaction() as tx:
+            return await tx.execute(query, params)
+
+    async def copy_rows(self, table, columns, rows):
+        async with self.transaction() as tx:
+            return await tx.copy_rows(table, columns, rows)
+
+    async def insert_rows(self, table, columns, rows, returning=None):
+        async with self.transaction() as tx:
+            return await tx.insert_rows(table, columns, rows, returning)
+
+    async def stream_batches(self, query, params=None, batch_size=STREAM_BATCH_SIZE):
+        """Itera o resultado em lotes, com memória constante, via cursor no servidor."""
+        async with self.transaction() as tx:
+            async for rows in tx.stream_batches(query, params, batch_size):
+                yield rows
+
+    @asynccontextmanager
+    async def transaction(self):
+        if self.pool is None:
+            await self.open()
+        with _connect_span(self.stats, self.target):
+            try:
+                conn = await self.pool.getconn()
+            except psycopg_pool.PoolTimeout as e:
+                raise PoolTimeout(str(e)) from e
+        try:
+            yield AsyncTransaction(conn)
+            await conn.commit()
+        except BaseException:
+            await conn.rollback()
+            raise
+        finally:
+            await self.pool.putconn(conn)
+
+
+def create_database(target=PRIMARY, host=None, port=None):
+    """Cria o acesso a um servidor no modo de I/O configurado."""
+    factory = AsyncDatabase if IO_MODE == "async" else SyncDatabase
+    return factory(target, host, port)
+
+
+db = create_database()
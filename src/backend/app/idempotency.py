@@ -0,0 +1,156 @@
+# Suporte ao cabeçalho Idempotency-Key nas rotas de escrita
+#
+# A primeira requisição com uma chave a reserva no Redis e, ao terminar, grava o status
+# e o corpo da resposta. Repetições com a mesma chave e o mesmo corpo recebem a resposta
+# gravada sem passar pelo banco; com outro corpo, 422; enquanto a primeira não termina,
+# 409. Se o Redis falhar a requisição segue sem proteção, como nas leituras de cache.
+import hashlib
+import json
+import os
+import uuid
+from contextlib import asynccontextmanager
+
+import redis
+from opentelemetry import trace
+
+from instrumentation import idempotency_counter
+from cache import LuaScript
+
+# Por quanto tempo (s) a resposta fica disponível para repetições da mesma chave
+IDEMPOTENCY_TTL = int(os.getenv("IDEMPOTENCY_TTL", "86400"))
+# Reserva da chave enquanto a primeira requisição roda; expira se o processo morrer
+IDEMPOTENCY_LOCK_TTL = int(os.getenv("IDEMPOTENCY_LOCK_TTL", "30"))
+
+IDEMPOTENCY_KEY_PREFIX = "idempotency:"
+_MAX_KEY_LENGTH = 255
+
+
+class IdempotencyError(Exception):
+    """Requisição recusada pela verificação de idempotência."""
+
+    status_code = 400
+    headers = None
+
+
+class IdempotencyInProgress(IdempotencyError):
+    """Outra requisição com a mesma chave ainda está em andamento."""
+
+    status_code = 409
+    headers = {"Retry-After": "1"}
+
+
+class IdempotencyMismatch(IdempotencyError):
+    """A chave já foi usada com outro corpo."""
+
+    status_code = 422
+
+
+# Reserva a chave, ou devolve o valor gravado por quem a reservou antes
+_claim_key = LuaScript("""
+local current = redis.call('GET', KEYS[1])
+if current then
+    return current
+end
+redis.call('SET', KEYS[1], ARGV[1], 'EX', ARGV[2])
+return false
+""")
+
+# Grava a resposta ou libera a chave, se a reserva ainda for desta requisição
+_finish_key = LuaScript("""
+if redis.call('GET', KEYS[1]) ~= ARGV[1] then
+    return 0
+end
+if ARGV[2] == '' then
+    redis.call('DEL', KEYS[1])
+else
+    redis.call('SET', KEYS[1], ARGV[2], 'EX', ARGV[3])
+end
+return 1
+""")
+
+
+def request_fingerprint(payload):
+    """Hash do corpo da requisição, independente da ordem dos campos."""
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
+
+
+class IdempotentRequest:
+    """Estado da chave para a requisição atual.
+
+    ``replay`` traz (status, corpo) gravados por uma requisição anterior; quando é
+    None a rota executa normalmente e chama ``save`` com a resposta.
+    """
+
+    def __init__(self, scope=None, redis_key=None, fingerprint=None, reservation=None):
+        self.scope = scope
+        self.replay = None
+        self._redis_key = redis_key
+        self._fingerprint = fingerprint
+        self._reservation = reservation
+
+    async def save(self, status_code, body):
+        if self._reservation is None:
+            return
+        value = json.dumps({"state": "done", "fingerprint": self._fingerprint,
+                            "status_code": status_code, "body": body})
+        try:
+            await _finish_key([self._redis_key], [self._reservation, value, IDEMPOTENCY_TTL])
+            idempotency_counter.add(1, {"scope": self.scope, "outcome": "stored"})
+        except redis.RedisError as e:
+            trace.get_current_span().record_exception(e)
+        self._reservation = None
+
+    async def release(self):
+        """Libera a chave sem resposta gravada: a próxima tentativa executa de novo."""
+        if self._reservation is None:
+            return
+        try:
+            await _finish_key([self._redis_key], [self._reservation, "", 0])
+        except redis.RedisError as e:
+            trace.get_current_span().record_exception(e)
+        self._reservation = None
+
+
+@asynccontextmanager
+async def idempotent_request(scope, key, payload):
+    """Verifica a Idempotency-Key de uma requisição de escrita em ``scope``.
+
+    Sem chave, ou com o Redis indisponível, a rota executa sem proteção. Se o bloco
+    terminar com erro a chave é liberada para o cliente tentar de novo.
+    """
+    if key is None:
+        yield IdempotentRequest()
+        return
+    if not key or len(key) > _MAX_KEY_LENGTH or not key.isprintable():
+        raise IdempotencyError(f"Idempotency-Key deve ter de 1 a {_MAX_KEY_LENGTH} caracteres visíveis.")
+
+    fingerprint = request_fingerprint(payload)
+    redis_key = f"{IDEMPOTENCY_KEY_PREFIX}{scope}:{key}"
+    reservation = json.dumps({"state": "pending", "fingerprint": fingerprint, "token": uuid.uuid4().hex})
+    try:
+        current = await _claim_key([redis_key], [reservation, IDEMPOTENCY_LOCK_TTL])
+    except redis.RedisError as e:
+        trace.get_current_span().record_exception(e)
+        idempotency_counter.add(1, {"scope": scope, "outcome": "unavailable"})
+        yield IdempotentRequest()
+        return
+
+    if current is not None:
+        stored = json.loads(current)
+        if stored["fingerprint"] != fingerprint:
+            idempotency_counter.add(1, {"scope": scope, "outcome": "mismatch"})
+            raise IdempotencyMismatch("Idempotency-Key já usada com outro corpo de requisição.")
+        if stored["state"] != "done":
+            idempotency_counter.add(1, {"scope": scope, "outcome": "in_progress"})
+            raise IdempotencyInProgress("Requisição com esta Idempotency-Key ainda em andamento.")
+        idempotency_counter.add(1, {"scope": scope, "outcome": "replayed"})
+        request = IdempotentRequest(scope)
+        request.replay = (stored["status_code"], stored["body"])
+        yield request
+        return
+
+    request = IdempotentRequest(scope, redis_key, fingerprint, reservation)
+    try:
+        yield request
+    finally:
+        await request.release()
@@ -5,17 +5,55 @@ from opentelemetry.exporter.otlp.proto.grpc.trace_exporter import OTLPSpanExport
 from opentelemetry.exporter.otlp.proto.grpc.metric_exporter import OTLPMetricExporter
 from opentelemetry.sdk.resources import Resource
 from opentelemetry.sdk.trace import TracerProvider
+from opentelemetry.sdk.trace.sampling import ParentBased
 from opentelemetry.sdk.trace.export import BatchSpanProcessor
 from opentelemetry.sdk.metrics import MeterProvider
+from opentelemetry.metrics import Observation
 from opentelemetry.sdk.metrics.export import PeriodicExportingMetricReader
 
 # Instrumentadores automáticos
 from opentelemetry.instrumentation.fastapi import FastAPIInstrumentor
 from opentelemetry.instrumentation.psycopg2 import Psycopg2Instrumentor
+from opentelemetry.instrumentation.psycopg import PsycopgInstrumentor
 from opentelemetry.instrumentation.redis import RedisInstrumentor
 
-def setup_opentelemetry(app):
-    """Configura o OpenTelemetry para a aplicação Fintelli."""
+from sampling import RouteRatioSampler, KeepErrorsAndSlow, TailSamplingProcessor, FoldedTracer, parse_route_rates
+
+# --- Amostragem de traces ---
+# Fração dos traces gravados, decidida na raiz; os spans filhos seguem o pai
+TRACE_SAMPLE_RATIO = float(os.getenv("TRACE_SAMPLE_RATIO", "1.0"))
+# Taxas por rota (http.route) que substituem a padrão, ex.: "/api/summary=0.01,/api/transactions=0.1"
+TRACE_ROUTE_SAMPLE_RATES = parse_route_rates(os.getenv("TRACE_ROUTE_SAMPLE_RATES", ""))
+# Exporta também os traces descartados pela amostragem que terminarem com erro ou
+# durarem ao menos TRACE_SLOW_THRESHOLD segundos (os spans continuam sendo criados)
+TRACE_KEEP_ERRORS_AND_SLOW = os.getenv("TRACE_KEEP_ERRORS_AND_SLOW", "false").lower() == "true"
+TRACE_SLOW_THRESHOLD = float(os.getenv("TRACE_SLOW_THRESHOLD", "0.5"))
+TRACE_TAIL_MAX_TRACES = int(os.getenv("TRACE_TAIL_MAX_TRACES", "1000"))
+# nested: spans customizados aninhados no span da requisição; folded: viram atributos
+# dele e os spans internos de envio/recebimento do ASGI deixam de ser criados
+TRACE_CUSTOM_SPANS = os.getenv("TRACE_CUSTOM_SPANS", "nested").lower()
+
+def create_sampler():
+    root = RouteRatioSampler(TRACE_SAMPLE_RATIO, TRACE_ROUTE_SAMPLE_RATES)
+    sampler = ParentBased(root)
+    return KeepErrorsAndSlow(sampler) if TRACE_KEEP_ERRORS_AND_SLOW else sampler
+
+def create_span_processor(exporter, meter_provider=None):
+    """BatchSpanProcessor com fila, lote e intervalos das variáveis OTEL_BSP_*.
+
+    Com OTEL_PYTHON_SDK_INTERNAL_METRICS_ENABLED=true o processador e o exportador OTLP
+    publicam no ``meter_provider`` os spans processados, descartados por fila cheia
+    (error.type=queue_full), o tamanho da fila e a duração de cada exportação.
+    """
+    processor = BatchSpanProcessor(exporter, meter_provider=meter_provider)
+    if TRACE_KEEP_ERRORS_AND_SLOW:
+        processor = TailSamplingProcessor(
+            processor, TRACE_SLOW_THRESHOLD, TRACE_TAIL_MAX_TRACES, trace_tail_sampling_counter
+        )
+    return processor
+
+def setup_opentelemetry(app=None):
+    """Configura o OpenTelemetry para a aplicação Fintelli (sem ``app`` nos workers)."""
     
     # Obtém o nome do serviço do ambiente, default para 'unknown_service'
     service_name = os.environ.get("OTEL_SERVICE_NAME", "fintelli-backend")
@@ -28,26 +66,36 @@ def setup_opentelemetry(app):
         "deployment.environment": os.environ.get("ENVIRONMENT", "development"),
     })
 
-    # --- Configuração de Traces ---
-    tracer_provider = TracerProvider(resource=resource)
-    trace_exporter = OTLPSpanExporter() # Usa o endpoint da variável de ambiente
-    tracer_provider.add_span_processor(BatchSpanProcessor(trace_exporter))
-    trace.set_tracer_provider(tracer_provider)
-
     # --- Configuração de Métricas ---
+    # Intervalo e timeout em OTEL_METRIC_EXPORT_*; compressão e temporalidade (cumulative
+    # ou delta) em OTEL_EXPORTER_OTLP_COMPRESSION e OTEL_EXPORTER_OTLP_METRICS_TEMPORALITY_PREFERENCE
     metric_reader = PeriodicExportingMetricReader(OTLPMetricExporter())
     meter_provider = MeterProvider(resource=resource, metric_readers=[metric_reader])
     metrics.set_meter_provider(meter_provider)
 
+    # --- Configuração de Traces ---
+    # Criado depois das métricas para que as métricas internas do pipeline de exportação
+    # vão para o MeterProvider acima
+    tracer_provider = TracerProvider(resource=resource, sampler=create_sampler())
+    trace_exporter = OTLPSpanExporter(meter_provider=meter_provider) # Usa o endpoint da variável de ambiente
+    tracer_provider.add_span_processor(create_span_processor(trace_exporter, meter_provider))
+    trace.set_tracer_provider(tracer_provider)
+
     # Instrumenta as bibliotecas
-    FastAPIInstrumentor.instrument_app(app)
+    if app is not None:
+        exclude_spans = ["receive", "send"] if TRACE_CUSTOM_SPANS == "folded" else None
+        FastAPIInstrumentor.instrument_app(app, exclude_spans=exclude_spans)
     Psycopg2Instrumentor().instrument()
+    PsycopgInstrumentor().instrument()
     RedisInstrumentor().instrument()
 
-    print(f"OpenTelemetry configurado para o serviço: {service_name}")
+    print(f"OpenTelemetry configurado para o serviço: {service_name} "
+          f"(amostragem {tracer_provider.sampler.get_description()}, spans customizados {TRACE_CUSTOM_SPANS})")
 
 # --- Tracer para spans customizados ---
 tracer = trace.get_tracer("fintelli.api.tracer")
+if TRACE_CUSTOM_SPANS == "folded":
+    tracer = FoldedTracer(tracer)
 
 # --- Métricas Customizadas ---
 # É uma boa prática criar um "medidor" para seu módulo
@@ -72,6 +120,66 @@ api_requests_counter = meter.create_counter(
     unit="1",
 )
 
+idempotency_counter = meter.create_counter(
+    name="idempotent_requests_total",
+    description="Requisições com Idempotency-Key por desfecho (stored, replayed, in_progress, mismatch, unavailable)",
+    unit="1",
+)
+
+conditional_request_counter = meter.create_counter(
+    name="conditional_requests_total",
+    description="GETs com ETag por rota e resultado (not_modified, modified, untagged)",
+    unit="1",
+)
+
+summary_cache_counter = meter.create_counter(
+    name="summary_cache_requests_total",
+    description="Leituras do resumo por resultado (hit, miss, coalesced, stale, early_refresh)",
+    unit="1",
+)
+
+cache_tier_counter = meter.create_counter(
+    name="cache_tier_requests_total",
+    description="Leituras de cache por camada (local, redis) e resultado (hit, miss)",
+    unit="1",
+)
+
+invoice_analysis_counter = meter.create_counter(
+    name="invoice_analysis_total",
+    description="Análises de fatura por origem do resultado (cache, local, model, coalesced)",
+    unit="1",
+)
+
+invoice_analysis_duration = meter.create_histogram(
+    name="invoice_analysis_duration_seconds",
+    description="Duração da análise de fatura por origem do resultado (cache, local, model, coalesced)",
+    unit="s",
+)
+
+invoice_local_parse_counter = meter.create_counter(
+    name="invoice_local_parse_total",
+    description="Tentativas de extração local por desfecho (parsed, no_text, no_match, too_many_pages, error)",
+    unit="1",
+)
+
+invoice_job_counter = meter.create_counter(
+    name="invoice_jobs_total",
+    description="Jobs de análise de fatura por desfecho (enqueued, done, retried, failed, reclaimed)",
+    unit="1",
+)
+
+trace_tail_sampling_counter = meter.create_counter(
+    name="trace_tail_sampling_total",
+    description="Traces não amostrados na raiz por decisão no fim (kept_error, kept_slow, dropped, evicted)",
+    unit="1",
+)
+
+db_read_route_counter = meter.create_counter(
+    name="db_read_routes_total",
+    description="Leituras roteadas por alvo (primary, replica:host:porta) e motivo",
+    unit="1",
+)
+
 # Histogramas
 transaction_amount_histogram = meter.create_histogram(
     name="transaction_amount",
@@ -79,15 +187,96 @@ transaction_amount_histogram = meter.create_histogram(
     unit="BRL",
 )
 
+# Medidos no cursor (query_metrics.py), por db.statement (impressão digital), db.operation e db.target
 database_query_duration = meter.create_histogram(
     name="database_query_duration_seconds",
     description="Duração das consultas ao banco de dados",
     unit="s",
 )
 
-# Gauges (via UpDownCounter)
-active_connections_gauge = meter.create_up_down_counter(
+database_rows_returned = meter.create_histogram(
+    name="database_rows_returned",
+    description="Linhas devolvidas por instrução",
+    unit="1",
+)
+
+database_bytes_returned = meter.create_histogram(
+    name="database_bytes_returned",
+    description="Bytes dos valores devolvidos por instrução (modo async com DB_QUERY_RESULT_BYTES)",
+    unit="By",
+)
+
+database_slow_queries_counter = meter.create_counter(
+    name="database_slow_queries_total",
+    description="Instruções acima de DB_SLOW_QUERY_THRESHOLD",
+    unit="1",
+)
+
+# Gauges (via callback observável)
+# Módulos com pools registram uma função que devolve {"in_use": n, "idle": n, "waiting": n}
+_connection_pool_providers = []
+
+def register_connection_pool(stats_provider, target="primary"):
+    """Registra um provedor de estado de pool para o gauge active_db_connections."""
+    _connection_pool_providers.append((stats_provider, target))
+
+def _observe_connection_pools(options):
+    for provider, target in _connection_pool_providers:
+        for state, value in provider().items():
+            yield Observation(value, {"state": state, "db.target": target})
+
+active_connections_gauge = meter.create_observable_up_down_counter(
     name="active_db_connections",
-    description="Número atual de conexões ativas com o banco",
+    callbacks=[_observe_connection_pools],
+    description="Conexões do pool com o banco por estado (in_use, idle, waiting)",
+    unit="1",
+)
+
+# Camadas de cache registram uma função que devolve {camada: (hits, misses)}
+_cache_tier_providers = []
+
+def register_cache_tiers(stats_provider):
+    """Registra um provedor de acertos por camada para o gauge cache_hit_ratio."""
+    _cache_tier_providers.append(stats_provider)
+
+def _observe_cache_hit_ratio(options):
+    for provider in _cache_tier_providers:
+        for tier, (hits, misses) in provider().items():
+            if hits + misses:
+                yield Observation(hits / (hits + misses), {"tier": tier})
+
+cache_hit_ratio_gauge = meter.create_observable_gauge(
+    name="cache_hit_ratio",
+    callbacks=[_observe_cache_hit_ratio],
+    description="Proporção de acertos acumulada por camada de cache (local, redis)",
     unit="1",
 )
+
+# Réplicas registram uma função que devolve {alvo: (atraso em s, latência em s)}
+_replica_providers = []
+
+def register_replicas(stats_provider):
+    """Registra um provedor de estado das réplicas para os gauges db_replica_*."""
+    _replica_providers.append(stats_provider)
+
+def _observe_replicas(index):
+    def observe(options):
+        for provider in _replica_providers:
+            for target, values in provider().items():
+                if values[index] is not None:
+                    yield Observation(values[index], {"db.target": target})
+    return observe
+
+replica_lag_gauge = meter.create_observable_gauge(
+    name="db_replica_lag_seconds",
+    callbacks=[_observe_replicas(0)],
+    description="Atraso de replicação medido na última verificação de cada réplica",
+    unit="s",
+)
+
+replica_latency_gauge = meter.create_observable_gauge(
+    name="db_replica_latency_seconds",
+    callbacks=[_observe_replicas(1)],
+    description="Latência média (EWMA) da verificação de cada réplica",
+    unit="s",
+)
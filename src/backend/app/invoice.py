@@ -0,0 +1,231 @@
+# Análise de faturas em PDF: extração local, modelo plugável e cache por hash do conteúdo
+import asyncio
+import hashlib
+import json
+import os
+import time
+
+import redis
+import google.generativeai as genai
+from opentelemetry import trace
+
+from instrumentation import tracer, invoice_analysis_counter, invoice_analysis_duration, invoice_local_parse_counter
+from cache import redis_client, LocalCache, SingleFlight
+from invoice_parser import parse_invoice_locally, INVOICE_LOCAL_PARSER
+from uploads import content_copy
+
+# "gemini" chama a API do Google; "fake" é um modelo local para testes e benchmarks offline
+INVOICE_MODEL_BACKEND = os.getenv("INVOICE_MODEL_BACKEND", "gemini").lower()
+INVOICE_MODEL_NAME = os.getenv("INVOICE_MODEL_NAME", "gemini-1.5-flash")
+# Tempo (s) de resposta simulado pelo modelo fake
+INVOICE_FAKE_LATENCY = float(os.getenv("INVOICE_FAKE_LATENCY", "0.5"))
+# Chamadas simultâneas ao modelo por worker; as demais aguardam a vez
+INVOICE_MAX_CONCURRENCY = int(os.getenv("INVOICE_MAX_CONCURRENCY", "4"))
+
+# Cache do resultado por hash do PDF: redis | memory | none
+INVOICE_CACHE_BACKEND = os.getenv("INVOICE_CACHE_BACKEND", "redis").lower()
+INVOICE_CACHE_TTL = int(os.getenv("INVOICE_CACHE_TTL", "604800"))
+INVOICE_CACHE_MAX_ENTRIES = int(os.getenv("INVOICE_CACHE_MAX_ENTRIES", "256"))
+
+INVOICE_PROMPT = "Analise o texto da fatura... (prompt completo omitido por brevidade)"
+
+
+class InvoiceModelNotConfigured(Exception):
+    """O backend do modelo escolhido não tem a configuração necessária."""
+
+
+def parse_model_response(text):
+    """Remove as cercas de código Markdown da resposta do modelo e decodifica o JSON."""
+    return json.loads(text.strip().replace("```json", "").replace("```", ""))
+
+
+# --- Modelos ---
+# Cada backend expõe ``version`` (entra na chave do cache) e ``generate(pdf) -> texto``.
+# O PDF chega como objeto bytes-like (bytes, memoryview ou mmap do upload). O backend
+# que precisar de uma cópia a registra com content_copy, para a memória de pico do upload.
+
+class GeminiModel:
+    """Cliente do Gemini criado uma única vez; usa a API assíncrona nativa."""
+
+    def __init__(self, api_key, model_name=INVOICE_MODEL_NAME):
+        genai.configure(api_key=api_key)
+        self.model = genai.GenerativeModel(model_name)
+        self.version = f"gemini:{model_name}"
+
+    async def generate(self, pdf_content):
+        # O cliente do Gemini só aceita bytes: o memoryview ou mmap do upload é copiado
+        copy = not isinstance(pdf_content, bytes)
+        with content_copy(len(pdf_content) if copy else 0):
+            data = bytes(pdf_content) if copy else pdf_content
+            response = await self.model.generate_content_async(
+                [INVOICE_PROMPT, {"mime_type": "application/pdf", "data": data}]
+            )
+        return response.text
+
+
+class FakeModel:
+    """Modelo local determinístico: o mesmo PDF gera sempre os mesmos lançamentos."""
+
+    version = "fake:1"
+
+    def __init__(self, latency=INVOICE_FAKE_LATENCY):
+        self.latency = latency
+
+    async def generate(self, pdf_content):
+        await asyncio.sleep(self.latency)
+        return self.response(pdf_content)
+
+    def response(self, pdf_content):
+        digest = hashlib.sha256(pdf_content).digest()
+        transactions = [
+            {
+                "description": f"Lançamento {index + 1}",
+                "amount": -round((digest[index] * 100 + digest[index + 1]) / 100, 2),
+                "transaction_date": f"2024-06-{digest[index] % 28 + 1:02d}",
+            }
+            for index in range(3)
+        ]
+        return "```json\n" + json.dumps({"transactions": transactions}) + "\n```"
+
+
+# --- Cache de resultados ---
+# Falhas do cache viram miss: a análise segue sem ele.
+
+class RedisResultCache:
+    """Compartilhado entre workers, com TTL."""
+
+    def __init__(self, ttl=INVOICE_CACHE_TTL):
+        self.ttl = ttl
+
+    async def get(self, key):
+        try:
+            raw = await redis_client.get(key)
+        except redis.RedisError as e:
+            trace.get_current_span().record_exception(e)
+            return None
+        return json.loads(raw) if raw is not None else None
+
+    async def set(self, key, value):
+        try:
+            await redis_client.set(key, json.dumps(value), ex=self.ttl)
+        except redis.RedisError as e:
+            trace.get_current_span().record_exception(e)
+
+
+class MemoryResultCache:
+    """LRU local ao processo."""
+
+    def __init__(self, max_entries=INVOICE_CACHE_MAX_ENTRIES, ttl=INVOICE_CACHE_TTL):
+        self._entries = LocalCache(max_entries, ttl)
+
+    async def get(self, key):
+        return self._entries.get(key)
+
+    async def set(self, key, value):
+        self._entries.set(key, value, self._entries.epoch)
+
+
+class NullResultCache:
+    async def get(self, key):
+        return None
+
+    async def set(self, key, value):
+        pass
+
+
+class InvoiceAnalyzer:
+    """Encadeia cache, coalescência de uploads idênticos, extração local e o modelo.
+
+    ``local_parser(pdf) -> (resultado ou None, desfecho)`` roda antes do modelo, que
+    só é chamado quando a extração local não reconhece o documento.
+    """
+
+    def __init__(self, model, cache, max_concurrency=INVOICE_MAX_CONCURRENCY, local_parser=None):
+        self.model = model
+        self.cache = cache
+        self.local_parser = local_parser
+        self._slots = asyncio.Semaphore(max_concurrency)
+        self._flight = SingleFlight()
+
+    def cache_key(self, pdf_content, digest=None):
+        return f"invoice_analysis:{self.model.version}:{digest or hashlib.sha256(pdf_content).hexdigest()}"
+
+    async def analyze(self, pdf_content, digest=None):
+        """Retorna (resultado, origem), com origem cache, local, model ou coalesced.
+
+        ``digest`` é o sha256 do PDF, quando já calculado durante o upload.
+        """
+        key = self.cache_key(pdf_content, digest)
+        with tracer.start_as_current_span("invoice.analyze") as span:
+            start = time.perf_counter()
+            span.set_attribute("invoice.size_bytes", len(pdf_content))
+            span.set_attribute("invoice.model", self.model.version)
+            result = await self.cache.get(key)
+            if result is not None:
+                source = "cache"
+            else:
+                (result, source), coalesced = await self._flight.run(key, lambda: self._analyze(key, pdf_content))
+                if coalesced:
+                    source = "coalesced"
+            span.set_attribute("invoice.source", source)
+            invoice_analysis_counter.add(1, {"source": source})
+            invoice_analysis_duration.record(time.perf_counter() - start, {"source": source})
+            return result, source
+
+    async def _analyze(self, key, pdf_content):
+        if self.local_parser is not None:
+            result = await self._parse_locally(pdf_content)
+            if result is not None:
+                # Não vai para o cache: refazer a extração custa milissegundos
+                return result, "local"
+        return await self._call_model(key, pdf_content), "model"
+
+    async def _parse_locally(self, pdf_content):
+        with tracer.start_as_current_span("invoice.local_parse") as span:
+            try:
+                result, outcome = await self.local_parser(pdf_content)
+            except Exception as e:
+                # PDF corrompido ou fora do padrão: o modelo ainda pode lê-lo
+                span.record_exception(e)
+                result, outcome = None, "error"
+            span.set_attribute("invoice.local_outcome", outcome)
+            if result is not None:
+                span.set_attribute("invoice.transactions", len(result["transactions"]))
+            invoice_local_parse_counter.add(1, {"outcome": outcome})
+            return result
+
+    async def _call_model(self, key, pdf_content):
+        async with self._slots:
+            with tracer.start_as_current_span("invoice.model_call") as span:
+                span.set_attribute("invoice.model", self.model.version)
+                text = await self.model.generate(pdf_content)
+        result = parse_model_response(text)
+        await self.cache.set(key, result)
+        return result
+
+
+def create_invoice_analyzer():
+    """Monta o analisador conforme INVOICE_MODEL_BACKEND, INVOICE_CACHE_BACKEND e INVOICE_LOCAL_PARSER."""
+    if INVOICE_MODEL_BACKEND == "fake":
+        model = FakeModel()
+    else:
+        api_key = os.getenv("GEMINI_API_KEY")
+        if not api_key:
+            raise InvoiceModelNotConfigured("Chave da API do Gemini não configurada.")
+        model = GeminiModel(api_key)
+    caches = {"redis": RedisResultCache, "memory": MemoryResultCache, "none": NullResultCache}
+    return InvoiceAnalyzer(
+        model, caches[INVOICE_CACHE_BACKEND](),
+        local_parser=parse_invoice_locally if INVOICE_LOCAL_PARSER else None,
+    )
+
+
+_analyzer = None
+
+
+def get_invoice_analyzer():
+    """Retorna o analisador do processo, criando-o na primeira chamada."""
+    global _analyzer
+    if _analyzer is None:
+        _analyzer = create_invoice_analyzer()
+    return _analyzer
@@ -0,0 +1,329 @@
+# Fila de análises de faturas no Redis, consumida por workers em processo separado
+#
+# Cada job é um hash (estado, tentativas, resultado) com o PDF numa chave à parte.
+# O worker move o id da fila para a lista de processamento (BLMOVE) e marca um prazo;
+# se o processo morrer, outro worker devolve o job à fila quando o prazo vence.
+# Falhas voltam à fila depois de um backoff, até INVOICE_JOB_MAX_ATTEMPTS tentativas.
+import asyncio
+import base64
+import json
+import os
+import time
+import uuid
+
+import redis
+from opentelemetry import propagate
+
+from instrumentation import tracer, invoice_job_counter
+from cache import redis_client, LuaScript
+from uploads import content_copy
+
+# Jobs aguardando além deste limite fazem o upload assíncrono responder 503
+INVOICE_JOB_MAX_QUEUE = int(os.getenv("INVOICE_JOB_MAX_QUEUE", "100"))
+# Por quanto tempo (s) o estado e o resultado de um job ficam disponíveis
+INVOICE_JOB_TTL = int(os.getenv("INVOICE_JOB_TTL", "86400"))
+INVOICE_JOB_MAX_ATTEMPTS = int(os.getenv("INVOICE_JOB_MAX_ATTEMPTS", "3"))
+# Espera (s) antes da segunda tentativa; dobra a cada nova falha
+INVOICE_JOB_RETRY_BACKOFF = float(os.getenv("INVOICE_JOB_RETRY_BACKOFF", "2"))
+# Tempo máximo de uma tentativa; um job parado além disso (worker morto) volta à fila
+INVOICE_JOB_TIMEOUT = float(os.getenv("INVOICE_JOB_TIMEOUT", "120"))
+# Jobs processados ao mesmo tempo por processo worker
+INVOICE_WORKER_CONCURRENCY = int(os.getenv("INVOICE_WORKER_CONCURRENCY", "4"))
+# Intervalo (s) entre consultas ao estado do job no stream SSE
+INVOICE_JOB_EVENTS_INTERVAL = float(os.getenv("INVOICE_JOB_EVENTS_INTERVAL", "0.5"))
+
+QUEUE_KEY = "invoice_jobs:queue"
+PROCESSING_KEY = "invoice_jobs:processing"
+# Retentativas agendadas: sorted set com o instante de retorno à fila
+DELAYED_KEY = "invoice_jobs:delayed"
+JOB_KEY_PREFIX = "invoice_job:"
+
+FINAL_STATUSES = ("done", "failed")
+
+# Espera máxima do BLMOVE; limita o tempo até um worker síncrono perceber o desligamento
+_BLOCK_TIMEOUT = 5
+# Folga do prazo sobre INVOICE_JOB_TIMEOUT antes de considerar o worker morto
+_LEASE_MARGIN = 10
+_MAINTENANCE_INTERVAL = 1
+# Comentário SSE enviado quando o estado não muda, para o proxy não fechar a conexão
+_SSE_KEEPALIVE = 15
+
+
+class InvoiceQueueUnavailable(Exception):
+    """Não foi possível enfileirar a análise."""
+
+
+class InvoiceQueueFull(InvoiceQueueUnavailable):
+    """A fila atingiu INVOICE_JOB_MAX_QUEUE jobs aguardando."""
+
+
+class InvoiceJobPayloadMissing(Exception):
+    """O PDF do job expirou antes de ser processado."""
+
+
+def job_key(job_id):
+    return f"{JOB_KEY_PREFIX}{job_id}"
+
+
+def payload_key(job_id):
+    return f"{JOB_KEY_PREFIX}{job_id}:pdf"
+
+
+def _now():
+    return f"{time.time():.3f}"
+
+
+def _lease_deadline():
+    return f"{time.time() + INVOICE_JOB_TIMEOUT + _LEASE_MARGIN:.3f}"
+
+
+# --- Scripts Lua: cada transição de estado é atômica ---
+# As transições de um job em execução conferem o número da tentativa: um worker cujo
+# prazo venceu não sobrescreve o estado de quem assumiu o job depois dele.
+
+_enqueue_job = LuaScript("""
+if redis.call('LLEN', KEYS[1]) >= tonumber(ARGV[1]) then
+    return 0
+end
+redis.call('SET', KEYS[3], ARGV[3], 'EX', ARGV[4])
+redis.call('HSET', KEYS[2], 'status', 'queued', 'attempts', 0, 'size', ARGV[6], 'filename', ARGV[7],
+           'traceparent', ARGV[8], 'created_at', ARGV[5], 'updated_at', ARGV[5])
+redis.call('EXPIRE', KEYS[2], ARGV[4])
+redis.call('LPUSH', KEYS[1], ARGV[2])
+return 1
+""")
+
+_start_job = LuaScript("""
+local status = redis.call('HGET', KEYS[2], 'status')
+if not status or status == 'done' or status == 'failed' then
+    redis.call('LREM', KEYS[1], 0, ARGV[1])
+    return -1
+end
+local attempts = redis.call('HINCRBY', KEYS[2], 'attempts', 1)
+if attempts > tonumber(ARGV[4]) then
+    redis.call('LREM', KEYS[1], 0, ARGV[1])
+    redis.call('HDEL', KEYS[2], 'lease_until')
+    redis.call('HSET', KEYS[2], 'status', 'failed', 'updated_at', ARGV[2], 'error', ARGV[5])
+    redis.call('DEL', KEYS[3])
+    return 0
+end
+redis.call('HSET', KEYS[2], 'status', 'running', 'updated_at', ARGV[2], 'lease_until', ARGV[3])
+return attempts
+""")
+
+_finish_job = LuaScript("""
+if redis.call('HGET', KEYS[2], 'attempts') ~= ARGV[7] then
+    return 0
+end
+redis.call('LREM', KEYS[1], 0, ARGV[1])
+redis.call('HDEL', KEYS[2], 'lease_until', 'retry_at')
+redis.call('HSET', KEYS[2], 'status', ARGV[3], 'updated_at', ARGV[2], ARGV[4], ARGV[5])
+redis.call('EXPIRE', KEYS[2], ARGV[6])
+redis.call('DEL', KEYS[3])
+return 1
+""")
+
+_retry_job = LuaScript("""
+if redis.call('HGET', KEYS[2], 'attempts') ~= ARGV[5] then
+    return 0
+end
+redis.call('LREM', KEYS[1], 0, ARGV[1])
+redis.call('HDEL', KEYS[2], 'lease_until')
+redis.call('HSET', KEYS[2], 'status', 'retrying', 'updated_at', ARGV[2], 'retry_at', ARGV[3], 'error', ARGV[4])
+redis.call('ZADD', KEYS[3], ARGV[3], ARGV[1])
+return 1
+""")
+
+_promote_jobs = LuaScript("""
+local due = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1])
+for _, id in ipairs(due) do
+    redis.call('ZREM', KEYS[1], id)
+    local key = ARGV[2] .. id
+    if redis.call('EXISTS', key) == 1 then
+        redis.call('HDEL', key, 'retry_at')
+        redis.call('HSET', key, 'status', 'queued', 'updated_at', ARGV[1])
+        redis.call('LPUSH', KEYS[2], id)
+    end
+end
+return #due
+""")
+
+_reclaim_jobs = LuaScript("""
+local reclaimed = 0
+for _, id in ipairs(redis.call('LRANGE', KEYS[1], 0, -1)) do
+    local key = ARGV[3] .. id
+    if redis.call('EXISTS', key) == 0 then
+        redis.call('LREM', KEYS[1], 0, id)
+    else
+        -- Retirado da fila e ainda sem prazo: o worker tem um prazo inteiro para marcá-lo
+        redis.call('HSETNX', key, 'lease_until', ARGV[2])
+        if tonumber(redis.call('HGET', key, 'lease_until')) < tonumber(ARGV[1]) then
+            redis.call('LREM', KEYS[1], 0, id)
+            redis.call('HDEL', key, 'lease_until')
+            redis.call('HSET', key, 'status', 'queued', 'updated_at', ARGV[1])
+            redis.call('RPUSH', KEYS[2], id)
+            reclaimed = reclaimed + 1
+        end
+    end
+end
+return reclaimed
+""")
+
+
+# --- API: enfileirar e consultar ---
+
+async def enqueue_invoice_job(pdf_content, filename=None):
+    """Grava o PDF e coloca o job na fila; retorna o id do job."""
+    job_id = uuid.uuid4().hex
+    carrier = {}
+    propagate.inject(carrier)
+    # O base64 em bytes e o str decodificado coexistem por um instante; o str vai até o Redis
+    encoded_size = (len(pdf_content) + 2) // 3 * 4
+    try:
+        with content_copy(2 * encoded_size):
+            accepted = await _enqueue_job(
+                [QUEUE_KEY, job_key(job_id), payload_key(job_id)],
+                [INVOICE_JOB_MAX_QUEUE, job_id, base64.b64encode(pdf_content).decode(), INVOICE_JOB_TTL,
+                 _now(), len(pdf_content), filename or "", carrier.get("traceparent", "")],
+            )
+    except redis.RedisError as e:
+        raise InvoiceQueueUnavailable(f"Fila de análises indisponível: {e}")
+    if not accepted:
+        raise InvoiceQueueFull("Fila de análises cheia, tente novamente em instantes.")
+    invoice_job_counter.add(1, {"outcome": "enqueued"})
+    return job_id
+
+
+def job_view(job_id, values):
+    """Converte o hash do job no formato da API."""
+    view = {
+        "job_id": job_id,
+        "status": values["status"],
+        "attempts": int(values.get("attempts", 0)),
+        "created_at": float(values["created_at"]),
+        "updated_at": float(values["updated_at"]),
+    }
+    if "retry_at" in values:
+        view["retry_at"] = float(values["retry_at"])
+    if "error" in values:
+        view["error"] = values["error"]
+    if "result" in values:
+        view["result"] = json.loads(values["result"])
+    return view
+
+
+async def get_invoice_job(job_id):
+    """Estado atual do job, ou None se não existe ou já expirou."""
+    values = await redis_client.hgetall(job_key(job_id))
+    return job_view(job_id, values) if values.get("status") else None
+
+
+async def invoice_job_events(job_id, interval=INVOICE_JOB_EVENTS_INTERVAL):
+    """Eventos SSE a cada mudança de estado, até o job terminar ou expirar."""
+    last = None
+    idle = 0.0
+    while True:
+        job = await get_invoice_job(job_id)
+        if job is None:
+            return
+        state = (job["status"], job["attempts"])
+        if state != last:
+            last, idle = state, 0.0
+            yield f"event: {job['status']}\ndata: {json.dumps(job)}\n\n"
+            if job["status"] in FINAL_STATUSES:
+                return
+        elif idle >= _SSE_KEEPALIVE:
+            idle = 0.0
+            yield ": keepalive\n\n"
+        await asyncio.sleep(interval)
+        idle += interval
+
+
+# --- Worker ---
+
+class InvoiceWorker:
+    """Consome a fila com até ``concurrency`` jobs simultâneos."""
+
+    def __init__(self, analyzer, concurrency=INVOICE_WORKER_CONCURRENCY):
+        self.analyzer = analyzer
+        self.concurrency = concurrency
+
+    async def run(self):
+        await asyncio.gather(self._maintain(), *(self._consume() for _ in range(self.concurrency)))
+
+    async def _consume(self):
+        while True:
+            try:
+                job_id = await redis_client.blmove(QUEUE_KEY, PROCESSING_KEY, _BLOCK_TIMEOUT, "RIGHT", "LEFT")
+                if job_id is not None:
+                    await self.process(job_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Falha no consumo da fila de faturas: {e}")
+                await asyncio.sleep(1)
+
+    async def _maintain(self):
+        while True:
+            try:
+                await self.maintain()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Falha na manutenção da fila de faturas: {e}")
+            await asyncio.sleep(_MAINTENANCE_INTERVAL)
+
+    async def maintain(self):
+        """Devolve à fila as retentativas vencidas e os jobs de workers que pararam."""
+        now = _now()
+        promoted = await _promote_jobs([DELAYED_KEY, QUEUE_KEY], [now, JOB_KEY_PREFIX])
+        reclaimed = await _reclaim_jobs([PROCESSING_KEY, QUEUE_KEY], [now, _lease_deadline(), JOB_KEY_PREFIX])
+        if reclaimed:
+            invoice_job_counter.add(reclaimed, {"outcome": "reclaimed"})
+        return promoted, reclaimed
+
+    async def process(self, job_id):
+        """Executa uma tentativa de um job já movido para a lista de processamento."""
+        keys = [PROCESSING_KEY, job_key(job_id), payload_key(job_id)]
+        attempt = await _start_job(keys, [job_id, _now(), _lease_deadline(), INVOICE_JOB_MAX_ATTEMPTS,
+                                          "Tentativas esgotadas: o worker parou durante a análise."])
+        if attempt == 0:
+            invoice_job_counter.add(1, {"outcome": "failed"})
+        if attempt <= 0:
+            return
+
+        # Continua o trace da requisição que enfileirou o job
+        traceparent = await redis_client.hget(job_key(job_id), "traceparent")
+        context = propagate.extract({"traceparent": traceparent}) if traceparent else None
+        with tracer.start_as_current_span("invoice.job", context=context) as span:
+            span.set_attribute("invoice.job_id", job_id)
+            span.set_attribute("invoice.job_attempt", attempt)
+            try:
+                payload = await redis_client.get(payload_key(job_id))
+                if payload is None:
+                    raise InvoiceJobPayloadMissing("O PDF do job expirou antes da análise.")
+                result, source = await asyncio.wait_for(
+                    self.analyzer.analyze(base64.b64decode(payload)), INVOICE_JOB_TIMEOUT
+                )
+            except Exception as e:
+                span.record_exception(e)
+                outcome = await self._fail(keys, job_id, attempt, e)
+                span.set_attribute("invoice.job_outcome", outcome)
+                return
+            span.set_attribute("invoice.source", source)
+            await _finish_job(keys, [job_id, _now(), "done", "result", json.dumps(result), INVOICE_JOB_TTL, attempt])
+            span.set_attribute("invoice.job_outcome", "done")
+            invoice_job_counter.add(1, {"outcome": "done"})
+
+    async def _fail(self, keys, job_id, attempt, error):
+        message = f"Erro ao analisar o PDF: {str(error) or type(error).__name__}"
+        if attempt < INVOICE_JOB_MAX_ATTEMPTS and not isinstance(error, InvoiceJobPayloadMissing):
+            retry_at = time.time() + INVOICE_JOB_RETRY_BACKOFF * 2 ** (attempt - 1)
+            await _retry_job([PROCESSING_KEY, job_key(job_id), DELAYED_KEY],
+                             [job_id, _now(), f"{retry_at:.3f}", message, attempt])
+            outcome = "retried"
+        else:
+            await _finish_job(keys, [job_id, _now(), "failed", "error", message, INVOICE_JOB_TTL, attempt])
+            outcome = "failed"
+        invoice_job_counter.add(1, {"outcome": outcome})
+        return outcome
@@ -0,0 +1,218 @@
+# Extração local de faturas e extratos em PDF com camada de texto, sem chamar o modelo
+#
+# O texto de cada página é extraído com o pypdf (modo layout, que preserva as colunas
+# das tabelas) e cada linha passa por regras para os layouts comuns de bancos e cartões:
+# data no início (dd/mm, dd/mm/aaaa ou "dd MMM"), descrição e valor no fim, com um
+# saldo opcional depois do valor nos extratos. PDFs escaneados, layouts desconhecidos
+# ou linhas com valor que as regras não reconhecem ficam para o modelo.
+import datetime
+import io
+import mmap
+import os
+import re
+from decimal import Decimal
+
+from pypdf import PdfReader
+from starlette.concurrency import run_in_threadpool
+
+# Liga a extração local antes do modelo
+INVOICE_LOCAL_PARSER = os.getenv("INVOICE_LOCAL_PARSER", "true").lower() == "true"
+# PDFs com mais páginas vão direto para o modelo
+INVOICE_EXTRACT_MAX_PAGES = int(os.getenv("INVOICE_EXTRACT_MAX_PAGES", "30"))
+# Fração mínima das linhas com valor reconhecidas como lançamento para dispensar o modelo
+INVOICE_LOCAL_MIN_COVERAGE = float(os.getenv("INVOICE_LOCAL_MIN_COVERAGE", "0.8"))
+
+# Abaixo disso a página não tem camada de texto (PDF escaneado)
+_MIN_TEXT_CHARS = 20
+_MAX_DESCRIPTION = 255
+_CENTS = Decimal("0.01")
+
+_MONTHS = {"jan": 1, "fev": 2, "mar": 3, "abr": 4, "mai": 5, "jun": 6,
+           "jul": 7, "ago": 8, "set": 9, "out": 10, "nov": 11, "dez": 12}
+
+_DATE = re.compile(
+    r"^\s*(?P<day>\d{1,2})(?:/(?P<month>\d{1,2})(?:/(?P<year>\d{4}|\d{2}))?"
+    r"|\s+(?P<month_name>jan|fev|mar|abr|mai|jun|jul|ago|set|out|nov|dez)[a-zç]*\.?)(?=\s)",
+    re.IGNORECASE,
+)
+_FULL_DATE = re.compile(r"(?<!\d)(\d{2})/(\d{2})/(\d{4})(?!\d)")
+# Valor em reais: 1.234,56 | -1.234,56 | R$ 1.234,56 | 1.234,56- | 1.234,56 D/C
+_AMOUNT = re.compile(
+    r"(?<![\d.,])(?P<minus>[-−]\s*)?(?:R\$\s*)?(?P<value>\d{1,3}(?:\.\d{3})+,\d{2}|\d+,\d{2})"
+    r"(?:(?P<trailing_minus>-)|\s*(?P<dc>[DC])\b)?(?![\d,])"
+)
+# Rótulos de linhas com valor que não são lançamentos; só valem no início da descrição
+# (depois da data, se houver) e como palavra inteira: "POSTO TOTAL" e "TOTALPASS" são compras
+_SKIP = re.compile(
+    r"(?:saldo|total|subtotal|limite|pagamento m[ií]nimo|fatura anterior|pagamento (?:recebido|efetuado))\b",
+    re.IGNORECASE,
+)
+# Fatura de cartão: compras sem sinal. Extratos citam "fatura" em linhas como "PAGTO FATURA"
+_CARD_HINTS = re.compile(r"vencimento|total (?:da|desta) fatura", re.IGNORECASE)
+_STATEMENT_HINTS = re.compile(r"extrato", re.IGNORECASE)
+
+
+class _MemoryReader(io.RawIOBase):
+    """Arquivo somente leitura sobre um bytes-like, sem copiá-lo (o BytesIO copiaria o memoryview)."""
+
+    def __init__(self, content):
+        self._view = memoryview(content).cast("B")
+        self._position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self._position, io.SEEK_END: len(self._view)}[whence]
+        self._position = max(base + offset, 0)
+        return self._position
+
+    def read(self, size=-1):
+        end = len(self._view) if size is None or size < 0 else self._position + size
+        data = bytes(self._view[self._position:end])
+        self._position += len(data)
+        return data
+
+    def readinto(self, buffer):
+        data = self.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+    def close(self):
+        self._view.release()
+        super().close()
+
+
+def extract_text(pdf_content, max_pages=INVOICE_EXTRACT_MAX_PAGES):
+    """Texto do PDF página a página; None se passar de ``max_pages``."""
+    # O mmap do upload já é um arquivo; o memoryview é lido no lugar
+    if isinstance(pdf_content, mmap.mmap):
+        return _extract_pages(pdf_content, max_pages)
+    with _MemoryReader(pdf_content) as stream:
+        return _extract_pages(stream, max_pages)
+
+
+def _extract_pages(stream, max_pages):
+    reader = PdfReader(stream)
+    if reader.is_encrypted:
+        reader.decrypt("")
+    if len(reader.pages) > max_pages:
+        return None
+    return "\n".join(page.extract_text(extraction_mode="layout") for page in reader.pages)
+
+
+def reference_date(text, today=None):
+    """Data mais recente escrita por extenso no documento (vencimento, fim do período)."""
+    dates = []
+    for day, month, year in _FULL_DATE.findall(text):
+        try:
+            dates.append(datetime.date(int(year), int(month), int(day)))
+        except ValueError:
+            pass
+    return max(dates) if dates else (today or datetime.date.today())
+
+
+def _trailing_amounts(line):
+    """Valores no fim da linha (o lançamento e, nos extratos, o saldo) e onde começam."""
+    matches = list(_AMOUNT.finditer(line))
+    trailing = []
+    end = len(line.rstrip())
+    for match in reversed(matches):
+        if match.end() != end or len(trailing) == 2:
+            break
+        trailing.insert(0, match)
+        end = len(line[:match.start()].rstrip())
+    return trailing
+
+
+def _signed_amount(match, card):
+    value = Decimal(match["value"].replace(".", "").replace(",", "."))
+    marked = bool(match["minus"] or match["trailing_minus"])
+    if card:
+        # Na fatura as compras vêm sem sinal; estornos e créditos vêm marcados
+        negative = not (marked or match["dc"] == "C")
+    else:
+        negative = marked or match["dc"] == "D"
+    return -value if negative else value
+
+
+def _transaction_date(match, reference):
+    if match["month_name"]:
+        month = _MONTHS[match["month_name"].lower()[:3]]
+    else:
+        month = int(match["month"])
+    day = int(match["day"])
+    if match["year"]:
+        year = int(match["year"])
+        year += 2000 if year < 100 else 0
+    else:
+        # Sem ano: o mais recente que não passa da data de referência do documento
+        year = reference.year if (month, day) <= (reference.month, reference.day) else reference.year - 1
+    return datetime.date(year, month, day)
+
+
+def parse_statement_text(text, today=None):
+    """Retorna (lançamentos, cobertura) a partir do texto de uma fatura ou extrato.
+
+    A cobertura é a fração das linhas com valor no fim (fora totais sem data) que as
+    regras reconheceram, como lançamento ou rótulo datado ("Saldo anterior"); uma
+    cobertura baixa indica um layout que as regras não conhecem.
+    """
+    card = bool(_CARD_HINTS.search(text)) and not _STATEMENT_HINTS.search(text)
+    reference = reference_date(text, today)
+    transactions = []
+    candidates = labels = 0
+    for line in text.splitlines():
+        trailing = _trailing_amounts(line)
+        if not trailing:
+            continue
+        date = _DATE.match(line)
+        description = " ".join(line[date.end() if date else 0:trailing[0].start()].split())
+        if _SKIP.match(description):
+            if date is not None:
+                # Datada: conta na cobertura, para que um rótulo errado não suma sem aviso
+                candidates += 1
+                labels += 1
+            continue
+        candidates += 1
+        if date is None:
+            continue
+        description = description[:_MAX_DESCRIPTION]
+        if not re.search(r"[^\W\d_]", description):
+            continue
+        try:
+            transaction_date = _transaction_date(date, reference)
+        except ValueError:
+            continue
+        # Nos extratos o segundo valor é o saldo; na fatura o último é o valor em reais
+        amount = _signed_amount(trailing[-1] if card else trailing[0], card)
+        transactions.append({
+            "description": description,
+            "amount": float(amount.quantize(_CENTS)),
+            "transaction_date": transaction_date.isoformat(),
+        })
+    return transactions, ((len(transactions) + labels) / candidates if candidates else 0.0)
+
+
+def parse_pdf(pdf_content, today=None):
+    """Retorna (resultado ou None, desfecho); o desfecho explica quando o modelo é necessário."""
+    text = extract_text(pdf_content)
+    if text is None:
+        return None, "too_many_pages"
+    if len(text.strip()) < _MIN_TEXT_CHARS:
+        return None, "no_text"
+    transactions, coverage = parse_statement_text(text, today)
+    if not transactions or coverage < INVOICE_LOCAL_MIN_COVERAGE:
+        return None, "no_match"
+    return {"transactions": transactions}, "parsed"
+
+
+async def parse_invoice_locally(pdf_content):
+    """Extração e regras rodam no threadpool: são CPU e não devem travar o event loop."""
+    return await run_in_threadpool(parse_pdf, pdf_content)
@@ -0,0 +1,29 @@
+# Processo worker da fila de análises de faturas
+#
+# Uso: python invoice_worker.py (no mesmo diretório e com o mesmo .env do backend)
+import asyncio
+
+from dotenv import load_dotenv
+
+# As configurações são lidas na importação dos módulos
+load_dotenv()
+
+from instrumentation import setup_opentelemetry
+from cache import redis_client
+from invoice import get_invoice_analyzer
+from invoice_jobs import InvoiceWorker, INVOICE_WORKER_CONCURRENCY
+
+
+async def main():
+    analyzer = get_invoice_analyzer()
+    print(f"Worker de faturas iniciado (modelo {analyzer.model.version}, "
+          f"{INVOICE_WORKER_CONCURRENCY} jobs simultâneos).")
+    try:
+        await InvoiceWorker(analyzer).run()
+    finally:
+        await redis_client.aclose()
+
+
+if __name__ == "__main__":
+    setup_opentelemetry()
+    asyncio.run(main())
@@ -1,30 +1,62 @@
 import os
 import json
+import asyncio
 import time
-import psycopg2
-import psycopg2.extras
-import redis
-import google.generativeai as genai
-from fastapi import FastAPI, HTTPException, UploadFile, File
+import base64
+import datetime
+import itertools
+from fastapi import FastAPI, HTTPException, UploadFile, File, Request, Query, Header
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, StreamingResponse, Response, PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 from typing import List, Optional
 from dotenv import load_dotenv
 
+# As configurações são lidas na importação dos módulos
+load_dotenv()
+
 # Importa a configuração de instrumentação e métricas customizadas
 from instrumentation import (
     setup_opentelemetry, tracer,
     transactions_created_counter, transactions_deleted_counter, 
     api_requests_counter, transaction_amount_histogram,
-    database_query_duration, active_connections_gauge
+    summary_cache_counter, conditional_request_counter
+)
+from database import db, PoolTimeout
+from cache import (
+    redis_client, get_cached_summary, summary_generation, store_summary, summary_write, data_version,
+    run_cache_invalidation, LOCAL_CACHE_TTL, SingleFlight,
+    period_cache_key, get_cached_period, store_period, PERIOD_SUMMARY_CACHE_TTL, redis_lock, SUMMARY_CACHE_KEY, SUMMARY_CACHE_TTL, SUMMARY_STAMPEDE_PROTECTION,
+    SUMMARY_STALE_WHILE_REVALIDATE, SUMMARY_LOCK_KEY, SUMMARY_LOCK_TIMEOUT
+)
+from migrations import run_migrations
+from invoice import get_invoice_analyzer, InvoiceModelNotConfigured
+from idempotency import idempotent_request, IdempotencyError
+from profiler import (
+    setup_profiler, sampler, authorized, profile_request, profile_worker, get_profile, PROFILE_HEADER,
+    PROFILER_MAX_SECONDS
+)
+from uploads import receive_upload, UploadError, UploadTooLarge, INVOICE_MAX_UPLOAD_BYTES
+from invoice_jobs import enqueue_invoice_job, get_invoice_job, invoice_job_events, InvoiceQueueUnavailable
+from replicas import (
+    replica_router, prefers_primary, run_replica_monitor, READ_YOUR_WRITES_COOKIE, DB_READ_YOUR_WRITES_WINDOW,
+    DB_REPLICA_MAX_LAG
+)
+from partitions import ensure_partitions, archive_partitions, run_partition_maintenance, PARTITION_MAINTENANCE_INTERVAL
+from transaction_import import (
+    TransactionImport, ImportFormatError, IMPORT_COLUMNS, detect_format, validate_records, insert_new_transactions
+)
+from summary import (
+    summary_source, compute_summary, run_summary_reconciliation, SUMMARY_RECONCILE_INTERVAL,
+    compute_period_summary, period_starts, PERIOD_GRANULARITIES, PERIOD_SUMMARY_MAX_BUCKETS
 )
-
-load_dotenv()
 
 # --- Configurações e Conexões ---
 app = FastAPI(title="Fintelli API - Finanças Inteligentes com IA")
 
 setup_opentelemetry(app)
+setup_profiler()
 
 app.add_middleware(
     CORSMiddleware,
@@ -32,38 +64,76 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # O frontend segue a paginação de /api/transactions por este cabeçalho
+    expose_headers=["X-Next-Cursor"],
 )
-redis_client = redis.Redis(host='cache', port=6379, db=0, decode_responses=True)
-def get_db_connection():
-    with tracer.start_as_current_span("database.connect") as span:
-        active_connections_gauge.add(1)
-        span.set_attribute("db.system", "postgresql")
-        span.set_attribute("db.name", os.getenv("POSTGRES_DB"))
-        try:
-            conn = psycopg2.connect(
-                dbname=os.getenv("POSTGRES_DB"),
-                user=os.getenv("POSTGRES_USER"),
-                password=os.getenv("POSTGRES_PASSWORD"),
-                host="db"
-            )
-            span.set_attribute("db.connection.status", "success")
-            return conn
-        except Exception as e:
-            span.set_attribute("db.connection.status", "error")
-            span.record_exception(e)
-            active_connections_gauge.add(-1)
-            raise
+@app.exception_handler(PoolTimeout)
+def pool_timeout_handler(request: Request, exc: PoolTimeout):
+    return JSONResponse(status_code=503, content={"detail": "Banco de dados indisponível no momento, tente novamente."})
+
+@app.exception_handler(IdempotencyError)
+def idempotency_error_handler(request: Request, exc: IdempotencyError):
+    return JSONResponse(status_code=exc.status_code, content={"detail": str(exc)}, headers=exc.headers)
+
+# Escritas bem-sucedidas marcam o cliente para ler do primário por alguns segundos
+_WRITE_METHODS = {"POST", "PUT", "PATCH", "DELETE"}
+
+@app.middleware("http")
+async def read_your_writes(request: Request, call_next):
+    response = await call_next(request)
+    if replica_router.replicas and request.method in _WRITE_METHODS and response.status_code < 400:
+        response.set_cookie(
+            READ_YOUR_WRITES_COOKIE, f"{time.time() + DB_READ_YOUR_WRITES_WINDOW:.3f}",
+            max_age=max(1, int(DB_READ_YOUR_WRITES_WINDOW)), httponly=True, samesite="lax",
+        )
+    return response
+
+# Com "X-Profile: <PROFILER_TOKEN>" a requisição é amostrada e o perfil fica em
+# /api/profiles/{trace_id}; sem token válido o cabeçalho é ignorado
+@app.middleware("http")
+async def sampling_profiler(request: Request, call_next):
+    if not sampler.installed or not authorized(request.headers.get(PROFILE_HEADER)):
+        return await call_next(request)
+    async with profile_request() as profile:
+        response = await call_next(request)
+    response.headers["X-Profile-Id"] = profile.id
+    return response
+
+def read_db(request: Request):
+    """Banco para leituras: uma réplica em dia ou, na falta dela, o primário."""
+    return replica_router.choose(prefers_primary(request.cookies)) or db
+
 @app.on_event("startup")
-def on_startup():
-    # Cria as tabelas no DB se não existirem
-    conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute("CREATE TABLE IF NOT EXISTS transactions (id SERIAL PRIMARY KEY, description VARCHAR(255) NOT NULL, amount NUMERIC(10, 2) NOT NULL, transaction_date DATE NOT NULL);")
-    cur.execute("CREATE TABLE IF NOT EXISTS fixed_expenses (id SERIAL PRIMARY KEY, description VARCHAR(255) NOT NULL, amount NUMERIC(10, 2) NOT NULL);")
-    conn.commit()
-    cur.close()
-    conn.close()
-    print("Banco de dados verificado.")
+async def on_startup():
+    await db.open()
+    # Cria ou atualiza o esquema (tabelas e índices) a partir das migrações versionadas
+    applied = await run_migrations(db)
+    await ensure_partitions(db)
+    await archive_partitions(db)
+    print(f"Banco de dados verificado (modo de I/O: {db.mode}, migrações aplicadas: {applied or 'nenhuma'}).")
+    if SUMMARY_RECONCILE_INTERVAL > 0:
+        app.state.summary_reconciliation = asyncio.create_task(run_summary_reconciliation())
+    if LOCAL_CACHE_TTL > 0:
+        app.state.cache_invalidation = asyncio.create_task(run_cache_invalidation())
+    if PARTITION_MAINTENANCE_INTERVAL > 0:
+        app.state.partition_maintenance = asyncio.create_task(run_partition_maintenance(db))
+    # Cliente do modelo de faturas criado uma vez; sem configuração, o endpoint responde 500
+    try:
+        get_invoice_analyzer()
+    except InvoiceModelNotConfigured as e:
+        print(f"Análise de faturas indisponível: {e}")
+    if replica_router.replicas:
+        await replica_router.open()
+        app.state.replica_monitor = asyncio.create_task(run_replica_monitor(db))
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    for name in ("summary_reconciliation", "cache_invalidation", "partition_maintenance", "replica_monitor"):
+        if getattr(app.state, name, None):
+            getattr(app.state, name).cancel()
+    await replica_router.close()
+    await db.close()
+    await redis_client.aclose()
 
 # --- Modelos Pydantic ---
 class Transaction(BaseModel):
@@ -71,102 +141,336 @@ class Transaction(BaseModel):
     description: str
     amount: float
     transaction_date: str
+class TransactionIds(BaseModel):
+    ids: List[int]
 class FixedExpense(BaseModel):
     id: Optional[int] = None
     description: str
     amount: float
 
-# --- Funções de Cache ---
-def invalidate_summary_cache():
-    with tracer.start_as_current_span("cache.invalidate") as span:
-        span.set_attribute("cache.key", "financial_summary")
-        redis_client.delete("financial_summary")
-        span.set_attribute("cache.operation", "delete")
+# --- Paginação por chave (keyset) ---
+TRANSACTIONS_PAGE_SIZE = int(os.getenv("TRANSACTIONS_PAGE_SIZE", "100"))
+TRANSACTIONS_MAX_PAGE_SIZE = int(os.getenv("TRANSACTIONS_MAX_PAGE_SIZE", "1000"))
+
+TRANSACTIONS_QUERY = (
+    "SELECT id, description, amount, to_char(transaction_date, 'YYYY-MM-DD') as transaction_date "
+    "FROM transactions {where} ORDER BY transactions.transaction_date DESC, id DESC"
+)
+
+# Máximo de itens por chamada nas rotas em lote
+TRANSACTIONS_BATCH_MAX_ITEMS = int(os.getenv("TRANSACTIONS_BATCH_MAX_ITEMS", "1000"))
+
+def check_batch_size(size):
+    if size > TRANSACTIONS_BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"Máximo de {TRANSACTIONS_BATCH_MAX_ITEMS} itens por lote")
+
+def encode_cursor(row):
+    """Cursor opaco com a posição (transaction_date, id) da última linha da página."""
+    raw = f"{row['transaction_date']},{row['id']}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+def decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        date_part, id_part = raw.split(",")
+        return datetime.date.fromisoformat(date_part), int(id_part)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Cursor de paginação inválido.")
+
+def keyset_condition(after):
+    """Retorna (cláusula WHERE, parâmetros) para continuar após o cursor informado."""
+    if after is None:
+        return "", ()
+    return "WHERE (transactions.transaction_date, id) < (%s, %s)", decode_cursor(after)
+
+def serialize_transaction(row):
+    return {
+        "id": row['id'],
+        "description": row['description'],
+        "amount": float(row['amount']),
+        "transaction_date": row['transaction_date'],
+    }
+
+# --- GET condicional (ETag / If-None-Match) ---
+# A versão dos dados muda a cada escrita em transactions; uma requisição cuja ETag ainda
+# é a atual recebe 304 sem consultar o banco nem serializar a resposta.
+
+def make_etag(resource, version):
+    return f'"{resource}-{version}"'
+
+def etag_matches(request, etag):
+    """If-None-Match com a comparação fraca que a RFC 9110 pede para GET."""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    return any(candidate.strip().removeprefix("W/") == etag for candidate in header.split(","))
+
+async def current_etag(resource):
+    """Retorna (ETag, instante da última escrita), ou (None, None) sem versão disponível."""
+    version = await data_version()
+    if version is None:
+        return None, None
+    tag, written_at = version
+    return make_etag(resource, tag), written_at
+
+def not_modified(endpoint, etag):
+    conditional_request_counter.add(1, {"endpoint": endpoint, "result": "not_modified"})
+    return Response(status_code=304, headers={"ETag": etag, "Cache-Control": "no-cache"})
+
+def tag_response(response, endpoint, etag):
+    """Marca a resposta com a ETag; no-cache faz o navegador revalidar a cada uso."""
+    conditional_request_counter.add(1, {"endpoint": endpoint, "result": "modified" if etag else "untagged"})
+    if etag:
+        response.headers["ETag"] = etag
+        response.headers["Cache-Control"] = "no-cache"
+    return response
+
+# --- Carregamento do resumo com proteção contra stampede ---
+summary_flight = SingleFlight()
+_background_refreshes = set()
+
+async def recompute_summary():
+    """Recalcula o resumo no banco e tenta gravá-lo no cache."""
+    # Lida antes da consulta: se houver escrita no meio, o recálculo não é gravado
+    generation = await summary_generation()
+    start_time = time.perf_counter()
+    
+    with tracer.start_as_current_span("database.query.summary") as db_span:
+        query, table = summary_source()
+        db_span.set_attribute("db.operation", "SELECT")
+        db_span.set_attribute("db.table", table)
+        
+        summary, transactions_count = await compute_summary(db)
+        
+        # Custo do recálculo, guardado com o resumo (ver store_summary)
+        query_duration = time.perf_counter() - start_time
+    
+    with tracer.start_as_current_span("business.calculate_summary") as calc_span:
+        calc_span.set_attribute("summary.income", summary["income"])
+        calc_span.set_attribute("summary.expense", summary["expense"])
+        calc_span.set_attribute("summary.balance", summary["balance"])
+        calc_span.set_attribute("summary.transactions_count", transactions_count)
+    
+    # Salva no cache
+    with tracer.start_as_current_span("cache.set") as cache_span:
+        cache_span.set_attribute("cache.key", SUMMARY_CACHE_KEY)
+        cache_span.set_attribute("cache.ttl", SUMMARY_CACHE_TTL)
+        cache_span.set_attribute("cache.stored", await store_summary(summary, generation, query_duration))
+    
+    return summary, "database"
+
+async def refresh_summary():
+    """Recalcula o resumo; no modo "redis" apenas o worker com o lock vai ao banco."""
+    if SUMMARY_STAMPEDE_PROTECTION != "redis":
+        return await recompute_summary()
+    async with redis_lock(SUMMARY_LOCK_KEY, SUMMARY_LOCK_TIMEOUT) as acquired:
+        if acquired:
+            return await recompute_summary()
+    # Outro worker está recalculando: aguarda o valor aparecer no cache
+    deadline = time.monotonic() + SUMMARY_LOCK_TIMEOUT
+    while time.monotonic() < deadline:
+        cached, freshness = await get_cached_summary()
+        if cached is not None and freshness != "stale":
+            return cached, "redis_wait"
+        await asyncio.sleep(0.05)
+    return await recompute_summary()
+
+async def load_summary():
+    """Retorna (resumo, resultado) coalescendo recálculos concorrentes."""
+    if SUMMARY_STAMPEDE_PROTECTION == "none":
+        summary, source = await refresh_summary()
+        return summary, source
+    (summary, source), coalesced = await summary_flight.run(SUMMARY_CACHE_KEY, refresh_summary)
+    return summary, "coalesced" if coalesced else source
+
+def schedule_summary_refresh():
+    """Dispara um recálculo em segundo plano, se nenhum estiver em andamento neste worker."""
+    if summary_flight.in_flight(SUMMARY_CACHE_KEY):
+        return
+    
+    async def refresh():
+        try:
+            await summary_flight.run(SUMMARY_CACHE_KEY, refresh_summary)
+        except Exception as e:
+            print(f"Falha ao revalidar o resumo em cache: {e}")
+    
+    task = asyncio.create_task(refresh())
+    _background_refreshes.add(task)
+    task.add_done_callback(_background_refreshes.discard)
 
 # --- Rotas da API ---
 
 @app.get("/api/summary")
-def get_summary():
+async def get_summary(request: Request, response: Response):
     with tracer.start_as_current_span("api.get_summary") as span:
         api_requests_counter.add(1, {"endpoint": "/api/summary", "method": "GET"})
         
+        # Lida antes do cache e do banco: uma escrita concorrente muda a ETag das próximas leituras
+        etag, _ = await current_etag("summary")
+        if etag and etag_matches(request, etag):
+            span.set_attribute("summary.source", "not_modified")
+            return not_modified("/api/summary", etag)
+        tag_response(response, "/api/summary", etag)
+        
         # Tenta buscar no cache
         with tracer.start_as_current_span("cache.get") as cache_span:
-            cache_span.set_attribute("cache.key", "financial_summary")
-            cached_summary = redis_client.get("financial_summary")
-            if cached_summary:
-                cache_span.set_attribute("cache.hit", True)
-                span.set_attribute("summary.source", "cache")
-                return json.loads(cached_summary)
-            cache_span.set_attribute("cache.hit", False)
-        
-        # Busca no banco de dados
-        span.set_attribute("summary.source", "database")
-        start_time = time.time()
-        
-        with tracer.start_as_current_span("database.query.summary") as db_span:
-            conn = get_db_connection()
-            cur = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-            db_span.set_attribute("db.operation", "SELECT")
-            db_span.set_attribute("db.table", "transactions")
-            
-            cur.execute("SELECT amount FROM transactions")
-            transactions = cur.fetchall()
-            cur.close()
-            conn.close()
-            active_connections_gauge.add(-1)
-            
-            query_duration = time.time() - start_time
-            database_query_duration.record(query_duration, {"operation": "get_summary"})
-            db_span.set_attribute("db.rows_returned", len(transactions))
-        
-        # Calcula resumo
-        with tracer.start_as_current_span("business.calculate_summary") as calc_span:
-            income = sum(float(row['amount']) for row in transactions if row['amount'] > 0)
-            expense = sum(float(row['amount']) for row in transactions if row['amount'] < 0)
-            summary = {"income": income, "expense": expense, "balance": income + expense}
-            
-            calc_span.set_attribute("summary.income", income)
-            calc_span.set_attribute("summary.expense", expense)
-            calc_span.set_attribute("summary.balance", income + expense)
-            calc_span.set_attribute("summary.transactions_count", len(transactions))
+            cache_span.set_attribute("cache.key", SUMMARY_CACHE_KEY)
+            cached_summary, freshness = await get_cached_summary()
+            cache_span.set_attribute("cache.hit", cached_summary is not None)
+            if freshness:
+                cache_span.set_attribute("cache.freshness", freshness)
         
-        # Salva no cache
-        with tracer.start_as_current_span("cache.set") as cache_span:
-            cache_span.set_attribute("cache.key", "financial_summary")
-            cache_span.set_attribute("cache.ttl", 3600)
-            redis_client.set("financial_summary", json.dumps(summary), ex=3600)
+        if cached_summary is not None:
+            if freshness == "fresh":
+                result = "hit"
+            elif SUMMARY_STALE_WHILE_REVALIDATE > 0:
+                # Serve o valor atual enquanto um único recálculo roda em segundo plano
+                schedule_summary_refresh()
+                result = "stale"
+            elif summary_flight.in_flight(SUMMARY_CACHE_KEY):
+                # Expiração antecipada já sendo tratada por outra requisição
+                result = "hit"
+            else:
+                result = None
+            if result:
+                summary_cache_counter.add(1, {"result": result, "mode": SUMMARY_STAMPEDE_PROTECTION})
+                span.set_attribute("summary.source", "cache" if result == "hit" else result)
+                return cached_summary
         
+        # Miss (ou expiração antecipada sem SWR): busca no banco de dados
+        summary, source = await load_summary()
+        if source == "database":
+            result = "miss" if cached_summary is None else "early_refresh"
+        else:
+            result = "coalesced"
+        summary_cache_counter.add(1, {"result": result, "mode": SUMMARY_STAMPEDE_PROTECTION})
+        span.set_attribute("summary.source", source)
         return summary
 
+@app.get("/api/summary/period")
+async def get_period_summary(
+    date_from: datetime.date = Query(..., alias="from"),
+    date_to: datetime.date = Query(..., alias="to"),
+    granularity: str = Query("month"),
+):
+    """Receitas e despesas por dia, semana ou mês num intervalo de datas."""
+    with tracer.start_as_current_span("api.get_period_summary") as span:
+        api_requests_counter.add(1, {"endpoint": "/api/summary/period", "method": "GET"})
+        if granularity not in PERIOD_GRANULARITIES:
+            raise HTTPException(status_code=400, detail=f"granularity deve ser uma de: {', '.join(PERIOD_GRANULARITIES)}")
+        if date_from > date_to:
+            raise HTTPException(status_code=400, detail="'from' deve ser anterior ou igual a 'to'")
+        buckets = sum(1 for _ in itertools.islice(period_starts(date_from, date_to, granularity), PERIOD_SUMMARY_MAX_BUCKETS + 1))
+        if buckets > PERIOD_SUMMARY_MAX_BUCKETS:
+            raise HTTPException(status_code=400, detail=f"Intervalo excede {PERIOD_SUMMARY_MAX_BUCKETS} períodos; use uma granularidade maior")
+        span.set_attribute("summary.granularity", granularity)
+        span.set_attribute("summary.periods", buckets)
+        
+        # A geração é lida antes do banco: uma escrita concorrente muda a chave das próximas leituras
+        generation = await summary_generation()
+        key = period_cache_key(generation, granularity, date_from, date_to)
+        with tracer.start_as_current_span("cache.get") as cache_span:
+            cache_span.set_attribute("cache.key", key)
+            cached = await get_cached_period(key)
+            cache_span.set_attribute("cache.hit", cached is not None)
+        if cached is not None:
+            summary_cache_counter.add(1, {"result": "hit", "mode": "period"})
+            return cached
+        
+        with tracer.start_as_current_span("database.query.period_summary") as db_span:
+            db_span.set_attribute("db.operation", "SELECT")
+            db_span.set_attribute("db.table", "transactions_daily")
+            result = await compute_period_summary(db, date_from, date_to, granularity)
+        
+        with tracer.start_as_current_span("cache.set") as cache_span:
+            cache_span.set_attribute("cache.key", key)
+            cache_span.set_attribute("cache.ttl", PERIOD_SUMMARY_CACHE_TTL)
+            await store_period(key, result)
+        summary_cache_counter.add(1, {"result": "miss", "mode": "period"})
+        return result
+
 @app.get("/api/transactions", response_model=List[Transaction])
-def get_transactions():
+async def get_transactions(
+    request: Request,
+    limit: int = Query(TRANSACTIONS_PAGE_SIZE, ge=1, le=TRANSACTIONS_MAX_PAGE_SIZE),
+    after: Optional[str] = None,
+):
     with tracer.start_as_current_span("api.get_transactions") as span:
         api_requests_counter.add(1, {"endpoint": "/api/transactions", "method": "GET"})
+        span.set_attribute("pagination.limit", limit)
+        span.set_attribute("pagination.has_cursor", after is not None)
         
-        start_time = time.time()
+        where, params = keyset_condition(after)
+        etag, written_at = await current_etag("transactions")
+        if etag and etag_matches(request, etag):
+            span.set_attribute("http.not_modified", True)
+            return not_modified("/api/transactions", etag)
+        source = read_db(request)
+        if etag and source is not db and time.time() - written_at < DB_REPLICA_MAX_LAG:
+            # A réplica pode ainda não ter a última escrita: sem ETag para não marcar dados antigos
+            etag = None
         
         with tracer.start_as_current_span("database.query.transactions") as db_span:
-            conn = get_db_connection()
-            cur = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
             db_span.set_attribute("db.operation", "SELECT")
             db_span.set_attribute("db.table", "transactions")
             
-            cur.execute("SELECT id, description, amount, to_char(transaction_date, 'YYYY-MM-DD') as transaction_date FROM transactions ORDER BY transaction_date DESC, id DESC")
-            transactions = cur.fetchall()
-            cur.close()
-            conn.close()
-            active_connections_gauge.add(-1)
+            # Busca uma linha a mais para saber se existe próxima página
+            transactions = await source.fetch_all(
+                TRANSACTIONS_QUERY.format(where=where) + " LIMIT %s",
+                params + (limit + 1,)
+            )
             
-            query_duration = time.time() - start_time
-            database_query_duration.record(query_duration, {"operation": "get_transactions"})
             db_span.set_attribute("db.rows_returned", len(transactions))
-            span.set_attribute("transactions.count", len(transactions))
         
-        return [dict(row) for row in transactions]
+        page = transactions[:limit]
+        span.set_attribute("transactions.count", len(page))
+        
+        headers = {}
+        if len(transactions) > limit:
+            next_cursor = encode_cursor(page[-1])
+            headers["X-Next-Cursor"] = next_cursor
+            headers["Link"] = f'</api/transactions?limit={limit}&after={next_cursor}>; rel="next"'
+        
+        # As linhas já vêm no formato da resposta; evita revalidar cada uma pelo response_model
+        response = JSONResponse(content=[serialize_transaction(row) for row in page], headers=headers)
+        return tag_response(response, "/api/transactions", etag)
+
+@app.get("/api/transactions/stream")
+async def stream_transactions(request: Request, after: Optional[str] = None):
+    """Exporta todas as transações como NDJSON, com memória constante."""
+    api_requests_counter.add(1, {"endpoint": "/api/transactions/stream", "method": "GET"})
+    where, params = keyset_condition(after)
+    
+    async def ndjson():
+        with tracer.start_as_current_span("database.stream.transactions") as db_span:
+            db_span.set_attribute("db.operation", "SELECT")
+            db_span.set_attribute("db.table", "transactions")
+            rows_sent = 0
+            async for rows in read_db(request).stream_batches(TRANSACTIONS_QUERY.format(where=where), params):
+                rows_sent += len(rows)
+                yield "".join(json.dumps(serialize_transaction(row)) + "\n" for row in rows)
+            db_span.set_attribute("db.rows_returned", rows_sent)
+    
+    return StreamingResponse(ndjson(), media_type="application/x-ndjson")
+
+def replay_response(replay):
+    """Resposta gravada pela primeira requisição com a mesma Idempotency-Key."""
+    status_code, body = replay
+    return JSONResponse(status_code=status_code, content=body, headers={"Idempotent-Replayed": "true"})
 
 @app.post("/api/transactions", response_model=Transaction, status_code=201)
-def add_transaction(transaction: Transaction):
+async def add_transaction(transaction: Transaction, idempotency_key: Optional[str] = Header(None)):
+    # Repetições com a mesma chave devolvem a resposta gravada sem tocar no banco
+    async with idempotent_request("transactions", idempotency_key, transaction.model_dump()) as idempotency:
+        if idempotency.replay is not None:
+            return replay_response(idempotency.replay)
+        created = await create_transaction(transaction)
+        await idempotency.save(201, jsonable_encoder(created))
+        return created
+
+async def create_transaction(transaction: Transaction):
     with tracer.start_as_current_span("api.add_transaction") as span:
         api_requests_counter.add(1, {"endpoint": "/api/transactions", "method": "POST"})
         span.set_attribute("transaction.description", transaction.description)
@@ -179,30 +483,21 @@ def add_transaction(transaction: Transaction):
             {"type": "income" if transaction.amount > 0 else "expense"}
         )
         
-        start_time = time.time()
-        
-        with tracer.start_as_current_span("database.insert.transaction") as db_span:
-            conn = get_db_connection()
-            cur = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-            db_span.set_attribute("db.operation", "INSERT")
-            db_span.set_attribute("db.table", "transactions")
-            
-            cur.execute(
-                "INSERT INTO transactions (description, amount, transaction_date) VALUES (%s, %s, %s) RETURNING id", 
-                (transaction.description, transaction.amount, transaction.transaction_date)
-            )
-            new_id = cur.fetchone()['id']
-            conn.commit()
-            cur.close()
-            conn.close()
-            active_connections_gauge.add(-1)
-            
-            query_duration = time.time() - start_time
-            database_query_duration.record(query_duration, {"operation": "insert_transaction"})
-            db_span.set_attribute("db.new_id", new_id)
+        # O resumo em cache recebe o valor da nova transação ao final do bloco
+        async with summary_write() as write:
+            with tracer.start_as_current_span("database.insert.transaction") as db_span:
+                db_span.set_attribute("db.operation", "INSERT")
+                db_span.set_attribute("db.table", "transactions")
+                
+                row = await db.fetch_one(
+                    "INSERT INTO transactions (description, amount, transaction_date) VALUES (%s, %s, %s) RETURNING id", 
+                    (transaction.description, transaction.amount, transaction.transaction_date)
+                )
+                new_id = row['id']
+                
+                db_span.set_attribute("db.new_id", new_id)
+            write.added([transaction.amount])
         
-        # Invalida cache
-        invalidate_summary_cache()
         transaction.id = new_id
         
         # Incrementa a métrica customizada
@@ -215,100 +510,330 @@ def add_transaction(transaction: Transaction):
         
         return transaction
 
+@app.post("/api/transactions/batch", response_model=List[Transaction], status_code=201)
+async def add_transactions(transactions: List[Transaction], idempotency_key: Optional[str] = Header(None)):
+    """Cria várias transações numa única transação do banco; devolve os ids na ordem recebida."""
+    payload = [transaction.model_dump() for transaction in transactions]
+    async with idempotent_request("transactions_batch", idempotency_key, payload) as idempotency:
+        if idempotency.replay is not None:
+            return replay_response(idempotency.replay)
+        created = await create_transactions(transactions)
+        await idempotency.save(201, jsonable_encoder(created))
+        return created
+
+async def create_transactions(transactions: List[Transaction]):
+    with tracer.start_as_current_span("api.add_transactions") as span:
+        api_requests_counter.add(1, {"endpoint": "/api/transactions/batch", "method": "POST"})
+        check_batch_size(len(transactions))
+        span.set_attribute("batch.size", len(transactions))
+        if not transactions:
+            return []
+        
+        for transaction in transactions:
+            transaction_amount_histogram.record(
+                abs(transaction.amount),
+                {"type": "income" if transaction.amount > 0 else "expense"}
+            )
+        
+        # Um único delta no resumo em cache para o lote inteiro
+        async with summary_write() as write:
+            with tracer.start_as_current_span("database.insert.transactions") as db_span:
+                db_span.set_attribute("db.operation", "INSERT")
+                db_span.set_attribute("db.table", "transactions")
+                db_span.set_attribute("db.rows", len(transactions))
+                
+                rows = await db.insert_rows(
+                    "transactions",
+                    ("description", "amount", "transaction_date"),
+                    [(t.description, t.amount, t.transaction_date) for t in transactions],
+                    returning="id",
+                )
+            write.added([t.amount for t in transactions])
+        
+        for transaction, row in zip(transactions, rows):
+            transaction.id = row['id']
+        incomes = sum(1 for t in transactions if t.amount > 0)
+        transactions_created_counter.add(incomes, {"type": "income"})
+        transactions_created_counter.add(len(transactions) - incomes, {"type": "expense"})
+        
+        span.set_attribute("operation.success", True)
+        return transactions
+
+@app.post("/api/transactions/batch-delete")
+async def delete_transactions(request: TransactionIds):
+    """Remove vários ids numa única instrução; informa, por id, se ele existia."""
+    with tracer.start_as_current_span("api.delete_transactions") as span:
+        api_requests_counter.add(1, {"endpoint": "/api/transactions/batch-delete", "method": "POST"})
+        ids = list(dict.fromkeys(request.ids))
+        check_batch_size(len(ids))
+        span.set_attribute("batch.size", len(ids))
+        if not ids:
+            return {"deleted": 0, "results": []}
+        
+        async with summary_write() as write:
+            with tracer.start_as_current_span("database.delete.transactions") as db_span:
+                db_span.set_attribute("db.operation", "DELETE")
+                db_span.set_attribute("db.table", "transactions")
+                
+                deleted = await db.fetch_all("DELETE FROM transactions WHERE id = ANY(%s) RETURNING id, amount", (ids,))
+                
+                db_span.set_attribute("db.rows_affected", len(deleted))
+            write.removed([row['amount'] for row in deleted])
+        
+        transactions_deleted_counter.add(len(deleted))
+        deleted_ids = {row['id'] for row in deleted}
+        span.set_attribute("operation.rows_affected", len(deleted))
+        return {
+            "deleted": len(deleted),
+            "results": [{"id": transaction_id, "deleted": transaction_id in deleted_ids} for transaction_id in ids],
+        }
+
+@app.post("/api/transactions/import")
+async def import_transactions(file: UploadFile = File(...), format: Optional[str] = Query(None)):
+    """Importa um arquivo CSV ou NDJSON em lotes via COPY, com relatório de erros por linha."""
+    with tracer.start_as_current_span("api.import_transactions") as span:
+        api_requests_counter.add(1, {"endpoint": "/api/transactions/import", "method": "POST"})
+        
+        try:
+            fmt = detect_format(file.filename, file.content_type, format)
+        except ImportFormatError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        span.set_attribute("import.format", fmt)
+        
+        importer = TransactionImport(file.file, fmt)
+        imported = 0
+        batches = 0
+        try:
+            async for rows, lines in importer.batches():
+                batches += 1
+                try:
+                    # Um delta (e uma invalidação do cache) por lote, não por linha
+                    async with summary_write() as write:
+                        with tracer.start_as_current_span("database.copy.transactions") as db_span:
+                            db_span.set_attribute("db.operation", "COPY")
+                            db_span.set_attribute("db.table", "transactions")
+                            db_span.set_attribute("db.rows", len(rows))
+                            
+                            await db.copy_rows("transactions", IMPORT_COLUMNS, rows)
+                        write.added([amount for _, amount, _ in rows])
+                except PoolTimeout:
+                    raise
+                except Exception as e:
+                    # O lote inteiro é desfeito; os anteriores já foram gravados
+                    span.record_exception(e)
+                    for line in lines:
+                        importer.add_error(line, f"lote rejeitado pelo banco: {e}")
+                    continue
+                imported += len(rows)
+                incomes = sum(1 for _, amount, _ in rows if amount > 0)
+                transactions_created_counter.add(incomes, {"type": "income"})
+                transactions_created_counter.add(len(rows) - incomes, {"type": "expense"})
+        except ImportFormatError as e:
+            # Cabeçalho inválido: detectado antes do primeiro lote
+            raise HTTPException(status_code=400, detail=str(e))
+        
+        span.set_attribute("import.imported", imported)
+        span.set_attribute("import.failed", importer.failed)
+        span.set_attribute("import.batches", batches)
+        return {
+            "imported": imported,
+            "failed": importer.failed,
+            "batches": batches,
+            "errors": importer.errors,
+            "errors_truncated": importer.failed > len(importer.errors),
+        }
+
 @app.delete("/api/transactions/{transaction_id}", status_code=204)
-def delete_transaction(transaction_id: int):
+async def delete_transaction(transaction_id: int):
     with tracer.start_as_current_span("api.delete_transaction") as span:
         api_requests_counter.add(1, {"endpoint": "/api/transactions", "method": "DELETE"})
         span.set_attribute("transaction.id", transaction_id)
         
-        start_time = time.time()
-        
-        with tracer.start_as_current_span("database.delete.transaction") as db_span:
-            conn = get_db_connection()
-            cur = conn.cursor()
-            db_span.set_attribute("db.operation", "DELETE")
-            db_span.set_attribute("db.table", "transactions")
-            db_span.set_attribute("transaction.id", transaction_id)
-            
-            cur.execute("DELETE FROM transactions WHERE id = %s", (transaction_id,))
-            rows_affected = cur.rowcount
-            conn.commit()
-            cur.close()
-            conn.close()
-            active_connections_gauge.add(-1)
-            
-            query_duration = time.time() - start_time
-            database_query_duration.record(query_duration, {"operation": "delete_transaction"})
-            db_span.set_attribute("db.rows_affected", rows_affected)
-            span.set_attribute("operation.rows_affected", rows_affected)
+        # O resumo em cache desconta a transação removida ao final do bloco
+        async with summary_write() as write:
+            with tracer.start_as_current_span("database.delete.transaction") as db_span:
+                db_span.set_attribute("db.operation", "DELETE")
+                db_span.set_attribute("db.table", "transactions")
+                db_span.set_attribute("transaction.id", transaction_id)
+                
+                deleted = await db.fetch_all("DELETE FROM transactions WHERE id = %s RETURNING amount", (transaction_id,))
+                rows_affected = len(deleted)
+                
+                db_span.set_attribute("db.rows_affected", rows_affected)
+                span.set_attribute("operation.rows_affected", rows_affected)
+            write.removed([row['amount'] for row in deleted])
         
-        # Invalida cache e registra métrica
-        invalidate_summary_cache()
         transactions_deleted_counter.add(1)
         
         span.set_attribute("operation.success", True)
         return {}
 
 @app.get("/api/fixed-expenses", response_model=List[FixedExpense])
-def get_fixed_expenses():
+async def get_fixed_expenses(request: Request):
     with tracer.start_as_current_span("api.get_fixed_expenses") as span:
         api_requests_counter.add(1, {"endpoint": "/api/fixed-expenses", "method": "GET"})
         
-        start_time = time.time()
-        
         with tracer.start_as_current_span("database.query.fixed_expenses") as db_span:
-            conn = get_db_connection()
-            cur = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
             db_span.set_attribute("db.operation", "SELECT")
             db_span.set_attribute("db.table", "fixed_expenses")
             
-            cur.execute("SELECT * FROM fixed_expenses ORDER BY description")
-            fixed_expenses = cur.fetchall()
-            cur.close()
-            conn.close()
-            active_connections_gauge.add(-1)
+            fixed_expenses = await read_db(request).fetch_all("SELECT * FROM fixed_expenses ORDER BY description")
             
-            query_duration = time.time() - start_time
-            database_query_duration.record(query_duration, {"operation": "get_fixed_expenses"})
             db_span.set_attribute("db.rows_returned", len(fixed_expenses))
             span.set_attribute("fixed_expenses.count", len(fixed_expenses))
         
         return [dict(row) for row in fixed_expenses]
 
 @app.post("/api/fixed-expenses", response_model=FixedExpense, status_code=201)
-def add_fixed_expense(expense: FixedExpense):
-    conn = get_db_connection()
-    cur = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-    cur.execute("INSERT INTO fixed_expenses (description, amount) VALUES (%s, %s) RETURNING id", (expense.description, expense.amount))
-    new_id = cur.fetchone()['id']
-    conn.commit()
-    cur.close()
-    conn.close()
-    expense.id = new_id
+async def add_fixed_expense(expense: FixedExpense):
+    row = await db.fetch_one("INSERT INTO fixed_expenses (description, amount) VALUES (%s, %s) RETURNING id", (expense.description, expense.amount))
+    expense.id = row['id']
     return expense
 
 @app.delete("/api/fixed-expenses/{expense_id}", status_code=204)
-def delete_fixed_expense(expense_id: int):
-    conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute("DELETE FROM fixed_expenses WHERE id = %s", (expense_id,))
-    conn.commit()
-    cur.close()
-    conn.close()
+async def delete_fixed_expense(expense_id: int):
+    await db.execute("DELETE FROM fixed_expenses WHERE id = %s", (expense_id,))
     return {}
 
-@app.post("/api/analyze-invoice")
-async def analyze_invoice(file: UploadFile = File(...)):
-    GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
-    if not GEMINI_API_KEY:
-        raise HTTPException(status_code=500, detail="Chave da API do Gemini não configurada.")
-    genai.configure(api_key=GEMINI_API_KEY)
+# O corpo é lido em streaming (ver uploads.py); o esquema documenta o campo no OpenAPI
+_INVOICE_UPLOAD_BODY = {
+    "requestBody": {
+        "required": True,
+        "content": {"multipart/form-data": {"schema": {
+            "type": "object", "required": ["file"],
+            "properties": {"file": {"type": "string", "format": "binary"}},
+        }}},
+    }
+}
+
+@app.post("/api/analyze-invoice", openapi_extra=_INVOICE_UPLOAD_BODY)
+async def analyze_invoice(request: Request, mode: str = Query("sync"), auto_import: bool = Query(False, alias="import")):
+    with tracer.start_as_current_span("api.analyze_invoice") as span:
+        api_requests_counter.add(1, {"endpoint": "/api/analyze-invoice", "method": "POST"})
+        if mode not in ("sync", "async"):
+            raise HTTPException(status_code=400, detail="mode deve ser sync ou async")
+        if auto_import and mode == "async":
+            raise HTTPException(status_code=400, detail="import=true está disponível apenas no modo sync")
+        span.set_attribute("invoice.mode", mode)
+        span.set_attribute("invoice.import", auto_import)
+        analyzer = None
+        if mode == "sync":
+            try:
+                analyzer = get_invoice_analyzer()
+            except InvoiceModelNotConfigured as e:
+                raise HTTPException(status_code=500, detail=str(e))
+        try:
+            upload = await receive_upload(request, max_bytes=INVOICE_MAX_UPLOAD_BYTES)
+        except UploadTooLarge as e:
+            raise HTTPException(status_code=413, detail=str(e))
+        except UploadError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        try:
+            span.set_attribute("invoice.upload.bytes", upload.size)
+            span.set_attribute("invoice.upload.on_disk", upload.on_disk)
+            with upload.contents() as pdf_content:
+                if mode == "async":
+                    return await enqueue_analysis(span, pdf_content, upload.filename)
+                try:
+                    result, source = await analyzer.analyze(pdf_content, upload.sha256)
+                except Exception as e:
+                    span.record_exception(e)
+                    raise HTTPException(status_code=500, detail=f"Erro ao analisar o PDF: {e}")
+        finally:
+            span.set_attribute("invoice.upload.peak_buffered_bytes", upload.peak_buffered_bytes)
+            span.set_attribute("invoice.upload.peak_memory_bytes", upload.peak_memory)
+            upload.close()
+        span.set_attribute("invoice.source", source)
+        if auto_import:
+            return {**result, "import": await import_invoice_transactions(span, result.get("transactions") or [])}
+        return result
+
+async def import_invoice_transactions(span, records):
+    """Grava os lançamentos da fatura numa única transação, ignorando os que já existem."""
+    rows, errors = validate_records(records)
+    check_batch_size(len(rows))
+    created = []
+    if rows:
+        # Um único delta no resumo em cache para a fatura inteira
+        async with summary_write() as write:
+            with tracer.start_as_current_span("database.insert.invoice_transactions") as db_span:
+                db_span.set_attribute("db.operation", "INSERT")
+                db_span.set_attribute("db.table", "transactions")
+                db_span.set_attribute("db.rows", len(rows))
+                
+                async with db.transaction() as tx:
+                    created = await insert_new_transactions(tx, rows)
+                
+                db_span.set_attribute("db.rows_affected", len(created))
+            write.added([row['amount'] for row in created])
+    
+    incomes = sum(1 for row in created if row['amount'] > 0)
+    transactions_created_counter.add(incomes, {"type": "income"})
+    transactions_created_counter.add(len(created) - incomes, {"type": "expense"})
+    span.set_attribute("import.imported", len(created))
+    span.set_attribute("import.duplicates", len(rows) - len(created))
+    span.set_attribute("import.failed", len(errors))
+    return {
+        "imported": len(created),
+        "duplicates": len(rows) - len(created),
+        "failed": len(errors),
+        "errors": errors,
+        "transactions": [serialize_transaction(row) for row in created],
+    }
+
+async def enqueue_analysis(span, pdf_content, filename):
+    """Modo assíncrono: a análise roda no worker e o cliente acompanha pelo job."""
     try:
-        model = genai.GenerativeModel('gemini-1.5-flash')
-        pdf_content = await file.read()
-        prompt = "Analise o texto da fatura... (prompt completo omitido por brevidade)"
-        response = model.generate_content([prompt, {"mime_type": "application/pdf", "data": pdf_content}])
-        cleaned_response_text = response.text.strip().replace("```json", "").replace("```", "")
-        return json.loads(cleaned_response_text)
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Erro ao analisar o PDF: {e}")
+        job_id = await enqueue_invoice_job(pdf_content, filename)
+    except InvoiceQueueUnavailable as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "5"})
+    span.set_attribute("invoice.job_id", job_id)
+    status_url = f"/api/analyze-invoice/jobs/{job_id}"
+    return JSONResponse(
+        status_code=202,
+        content={"job_id": job_id, "status": "queued", "status_url": status_url, "events_url": f"{status_url}/events"},
+        headers={"Location": status_url},
+    )
+
+@app.get("/api/analyze-invoice/jobs/{job_id}")
+async def get_invoice_analysis_job(job_id: str):
+    job = await get_invoice_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job não encontrado ou expirado.")
+    return job
+
+@app.get("/api/analyze-invoice/jobs/{job_id}/events")
+async def stream_invoice_analysis_job(job_id: str):
+    """Server-Sent Events com cada mudança de estado do job até ele terminar."""
+    if await get_invoice_job(job_id) is None:
+        raise HTTPException(status_code=404, detail="Job não encontrado ou expirado.")
+    return StreamingResponse(
+        invoice_job_events(job_id), media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+# --- Profiler por amostragem ---
+def require_profiler(token):
+    if not sampler.installed:
+        raise HTTPException(status_code=404, detail="Profiler desativado (defina PROFILER_TOKEN).")
+    if not authorized(token):
+        raise HTTPException(status_code=403, detail="Token do profiler inválido.")
+
+@app.post("/api/profiles")
+async def profile_worker_for(
+    seconds: float = Query(10, gt=0, le=PROFILER_MAX_SECONDS),
+    token: Optional[str] = Header(None, alias="X-Profile"),
+):
+    """Amostra este worker (o que atender a requisição) por ``seconds`` segundos."""
+    require_profiler(token)
+    profile = await profile_worker(seconds)
+    return {"profile_id": profile.id, "samples": profile.samples, "profile_url": f"/api/profiles/{profile.id}"}
+
+@app.get("/api/profiles/{profile_id}", response_class=PlainTextResponse)
+async def get_sampled_profile(profile_id: str, token: Optional[str] = Header(None, alias="X-Profile")):
+    """Perfil no formato folded ("raiz;...;folha contagem"), para flamegraph.pl ou speedscope."""
+    require_profiler(token)
+    folded = await get_profile(profile_id)
+    if folded is None:
+        raise HTTPException(status_code=404, detail="Perfil não encontrado ou expirado.")
+    return PlainTextResponse(folded)
@@ -0,0 +1,406 @@
+# Migrações versionadas do esquema no PostgreSQL
+from collections import namedtuple
+
+from instrumentation import tracer
+
+Migration = namedtuple("Migration", "version name statements")
+
+# Novas migrações entram sempre no fim da lista, com a próxima versão;
+# uma migração já aplicada nunca deve ser editada.
+MIGRATIONS = [
+    Migration(1, "create_tables", [
+        # IF NOT EXISTS: bancos criados antes das migrações já têm as tabelas
+        """
+        CREATE TABLE IF NOT EXISTS transactions (
+            id SERIAL PRIMARY KEY,
+            description VARCHAR(255) NOT NULL,
+            amount NUMERIC(10, 2) NOT NULL,
+            transaction_date DATE NOT NULL
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS fixed_expenses (
+            id SERIAL PRIMARY KEY,
+            description VARCHAR(255) NOT NULL,
+            amount NUMERIC(10, 2) NOT NULL
+        )
+        """,
+    ]),
+    Migration(2, "transactions_date_id_index", [
+        # Atende ORDER BY transaction_date DESC, id DESC e a paginação por chave sem ordenar
+        "CREATE INDEX IF NOT EXISTS transactions_date_id_idx ON transactions (transaction_date DESC, id DESC)",
+    ]),
+    Migration(3, "transactions_sign_partial_indexes", [
+        # Receitas e despesas por período com index-only scan (amount incluído no índice)
+        "CREATE INDEX IF NOT EXISTS transactions_income_date_idx ON transactions (transaction_date) INCLUDE (amount) WHERE amount > 0",
+        "CREATE INDEX IF NOT EXISTS transactions_expense_date_idx ON transactions (transaction_date) INCLUDE (amount) WHERE amount < 0",
+    ]),
+    Migration(4, "transactions_date_brin", [
+        # Poucas páginas mesmo com milhões de linhas; útil para varreduras longas por período
+        "CREATE INDEX IF NOT EXISTS transactions_date_brin ON transactions USING brin (transaction_date)",
+    ]),
+    Migration(5, "transactions_daily_rollup", [
+        """
+        CREATE TABLE IF NOT EXISTS transactions_daily (
+            day DATE PRIMARY KEY,
+            income NUMERIC NOT NULL DEFAULT 0,
+            expense NUMERIC NOT NULL DEFAULT 0,
+            transactions_count BIGINT NOT NULL DEFAULT 0
+        )
+        """,
+        # Triggers por instrução com tabelas de transição: um lote (COPY, INSERT em
+        # lote, DELETE ... ANY) gera um único upsert agrupado por dia, em ordem de
+        # dia para que escritas concorrentes travem as linhas na mesma sequência
+        """
+        CREATE OR REPLACE FUNCTION transactions_daily_apply() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP IN ('DELETE', 'UPDATE') THEN
+                INSERT INTO transactions_daily AS daily (day, income, expense, transactions_count)
+                SELECT transaction_date,
+                       -COALESCE(SUM(amount) FILTER (WHERE amount > 0), 0),
+                       -COALESCE(SUM(amount) FILTER (WHERE amount < 0), 0),
+                       -COUNT(*)
+                FROM old_rows GROUP BY transaction_date ORDER BY transaction_date
+                ON CONFLICT (day) DO UPDATE SET
+                    income = daily.income + EXCLUDED.income,
+                    expense = daily.expense + EXCLUDED.expense,
+                    transactions_count = daily.transactions_count + EXCLUDED.transactions_count;
+            END IF;
+            IF TG_OP IN ('INSERT', 'UPDATE') THEN
+                INSERT INTO transactions_daily AS daily (day, income, expense, transactions_count)
+                SELECT transaction_date,
+                       COALESCE(SUM(amount) FILTER (WHERE amount > 0), 0),
+                       COALESCE(SUM(amount) FILTER (WHERE amount < 0), 0),
+                       COUNT(*)
+                FROM new_rows GROUP BY transaction_date ORDER BY transaction_date
+                ON CONFLICT (day) DO UPDATE SET
+                    income = daily.income + EXCLUDED.income,
+                    expense = daily.expense + EXCLUDED.expense,
+                    transactions_count = daily.transactions_count + EXCLUDED.transactions_count;
+            END IF;
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql
+        """,
+        """
+        CREATE OR REPLACE FUNCTION transactions_daily_reset() RETURNS trigger AS $$
+        BEGIN
+            DELETE FROM transactions_daily;
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql
+        """,
+        # Trava escritas durante o backfill para que nenhuma linha escape dos triggers
+        "LOCK TABLE transactions IN SHARE ROW EXCLUSIVE MODE",
+        """
+        INSERT INTO transactions_daily (day, income, expense, transactions_count)
+        SELECT transaction_date,
+               COALESCE(SUM(amount) FILTER (WHERE amount > 0), 0),
+               COALESCE(SUM(amount) FILTER (WHERE amount < 0), 0),
+               COUNT(*)
+        FROM transactions GROUP BY transaction_date
+        ON CONFLICT (day) DO NOTHING
+        """,
+        # Tabelas de transição exigem um trigger por evento
+        """
+        CREATE TRIGGER transactions_daily_insert AFTER INSERT ON transactions
+        REFERENCING NEW TABLE AS new_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION transactions_daily_apply()
+        """,
+        """
+        CREATE TRIGGER transactions_daily_delete AFTER DELETE ON transactions
+        REFERENCING OLD TABLE AS old_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION transactions_daily_apply()
+        """,
+        """
+        CREATE TRIGGER transactions_daily_update AFTER UPDATE ON transactions
+        REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION transactions_daily_apply()
+        """,
+        """
+        CREATE TRIGGER transactions_daily_truncate AFTER TRUNCATE ON transactions
+        FOR EACH STATEMENT EXECUTE FUNCTION transactions_daily_reset()
+        """,
+    ]),
+    Migration(6, "transactions_monthly_partitions", [
+        # Uma partição por mês (transactions_AAAA_MM). Datas sem partição caem em
+        # transactions_default e são movidas quando o mês ganha a sua; como essas
+        # linhas já estão nos agregados, a movimentação não dispara triggers.
+        """
+        CREATE OR REPLACE FUNCTION transactions_ensure_partition(target date) RETURNS text AS $$
+        DECLARE
+            start_date date := date_trunc('month', target)::date;
+            end_date date := (date_trunc('month', target) + interval '1 month')::date;
+            partition_name text := 'transactions_' || to_char(target, 'YYYY_MM');
+        BEGIN
+            IF to_regclass(partition_name) IS NOT NULL THEN
+                RETURN NULL;
+            END IF;
+            EXECUTE format('CREATE TABLE %I (LIKE transactions INCLUDING DEFAULTS INCLUDING CONSTRAINTS)', partition_name);
+            ALTER TABLE transactions_default DISABLE TRIGGER USER;
+            EXECUTE format(
+                'WITH moved AS (DELETE FROM transactions_default'
+                ' WHERE transaction_date >= %L AND transaction_date < %L RETURNING *)'
+                ' INSERT INTO %I SELECT * FROM moved',
+                start_date, end_date, partition_name);
+            ALTER TABLE transactions_default ENABLE TRIGGER USER;
+            EXECUTE format('ALTER TABLE transactions ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)',
+                           partition_name, start_date, end_date);
+            RETURN partition_name;
+        END
+        $$ LANGUAGE plpgsql
+        """,
+        # Do mês atual até months_ahead à frente, mais os meses que caíram na default
+        """
+        CREATE OR REPLACE FUNCTION transactions_ensure_partitions(months_ahead integer) RETURNS SETOF text AS $$
+        DECLARE
+            month date;
+            created text;
+        BEGIN
+            -- Materializa a lista antes do laço: um cursor aberto na default impediria o ALTER TABLE
+            FOREACH month IN ARRAY ARRAY(
+                SELECT generate_series(date_trunc('month', current_date),
+                                       date_trunc('month', current_date) + make_interval(months => months_ahead),
+                                       interval '1 month')::date
+                UNION
+                SELECT DISTINCT date_trunc('month', transaction_date)::date FROM transactions_default
+                ORDER BY 1
+            )
+            LOOP
+                created := transactions_ensure_partition(month);
+                IF created IS NOT NULL THEN
+                    RETURN NEXT created;
+                END IF;
+            END LOOP;
+        END
+        $$ LANGUAGE plpgsql
+        """,
+        # Desanexa os meses anteriores a ``before`` para o schema archive e tira as
+        # linhas arquivadas dos agregados, como se tivessem sido excluídas
+        """
+        CREATE OR REPLACE FUNCTION transactions_archive_partitions(before date)
+        RETURNS TABLE (partition_name text, income numeric, expense numeric, transactions_count bigint) AS $$
+        DECLARE
+            child regclass;
+            start_date date;
+        BEGIN
+            FOR child IN
+                SELECT inhrelid::regclass FROM pg_inherits
+                WHERE inhparent = 'transactions'::regclass
+                  AND inhrelid::regclass::text ~ '^transactions_[0-9]{4}_[0-9]{2}$'
+                ORDER BY 1
+            LOOP
+                start_date := to_date(substr(child::text, 14), 'YYYY_MM');
+                CONTINUE WHEN start_date + interval '1 month' > before;
+                partition_name := child::text;
+                EXECUTE format(
+                    'SELECT COALESCE(SUM(amount) FILTER (WHERE amount > 0), 0),'
+                    ' COALESCE(SUM(amount) FILTER (WHERE amount < 0), 0), COUNT(*) FROM %s', child)
+                    INTO income, expense, transactions_count;
+                EXECUTE format('ALTER TABLE transactions DETACH PARTITION %s', child);
+                -- O mês já pode ter sido arquivado antes (linhas com data antiga chegaram depois)
+                IF to_regclass('archive.' || partition_name) IS NULL THEN
+                    EXECUTE format('ALTER TABLE %s SET SCHEMA archive', child);
+                ELSE
+                    EXECUTE format('INSERT INTO archive.%I SELECT * FROM %s', partition_name, child);
+                    EXECUTE format('DROP TABLE %s', child);
+                END IF;
+                DELETE FROM transactions_daily
+                WHERE day >= start_date AND day < start_date + interval '1 month';
+                IF to_regclass('transactions_summary') IS NOT NULL THEN
+                    EXECUTE 'UPDATE transactions_summary SET income = income - $1,'
+                            ' expense = expense - $2, transactions_count = transactions_count - $3'
+                        USING income, expense, transactions_count;
+                END IF;
+                RETURN NEXT;
+            END LOOP;
+        END
+        $$ LANGUAGE plpgsql
+        """,
+        "CREATE SCHEMA IF NOT EXISTS archive",
+        # A conversão reescreve a tabela: bloqueia leituras e escritas até o commit
+        "LOCK TABLE transactions IN ACCESS EXCLUSIVE MODE",
+        "ALTER TABLE transactions RENAME TO transactions_unpartitioned",
+        "ALTER TABLE transactions_unpartitioned RENAME CONSTRAINT transactions_pkey TO transactions_unpartitioned_pkey",
+        # A chave primária precisa incluir a chave de partição; o id continua
+        # vindo da mesma sequência, então segue único
+        """
+        CREATE TABLE transactions (
+            id INTEGER NOT NULL DEFAULT nextval('transactions_id_seq'),
+            description VARCHAR(255) NOT NULL,
+            amount NUMERIC(10, 2) NOT NULL,
+            transaction_date DATE NOT NULL,
+            CONSTRAINT transactions_pkey PRIMARY KEY (id, transaction_date)
+        ) PARTITION BY RANGE (transaction_date)
+        """,
+        "ALTER SEQUENCE transactions_id_seq OWNED BY transactions.id",
+        "CREATE TABLE transactions_default PARTITION OF transactions DEFAULT",
+        """
+        SELECT transactions_ensure_partition(month)
+        FROM (SELECT DISTINCT date_trunc('month', transaction_date)::date AS month
+              FROM transactions_unpartitioned ORDER BY 1) AS months
+        """,
+        # Sem triggers na tabela nova: os agregados já contêm estas linhas
+        """
+        INSERT INTO transactions (id, description, amount, transaction_date)
+        SELECT id, description, amount, transaction_date FROM transactions_unpartitioned
+        """,
+        "DROP TABLE transactions_unpartitioned",
+        # O resumo em tabela (SUMMARY_AGGREGATE=table) tinha triggers na tabela antiga;
+        # a migração 7 o recria e recalcula
+        "DROP TABLE IF EXISTS transactions_summary",
+        # Índices das migrações 2 a 4, agora particionados (um por partição)
+        "CREATE INDEX transactions_date_id_idx ON transactions (transaction_date DESC, id DESC)",
+        "CREATE INDEX transactions_income_date_idx ON transactions (transaction_date) INCLUDE (amount) WHERE amount > 0",
+        "CREATE INDEX transactions_expense_date_idx ON transactions (transaction_date) INCLUDE (amount) WHERE amount < 0",
+        "CREATE INDEX transactions_date_brin ON transactions USING brin (transaction_date)",
+        # Triggers da migração 5 na tabela particionada; as tabelas de transição
+        # recebem as linhas de todas as partições
+        """
+        CREATE TRIGGER transactions_daily_insert AFTER INSERT ON transactions
+        REFERENCING NEW TABLE AS new_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION transactions_daily_apply()
+        """,
+        """
+        CREATE TRIGGER transactions_daily_delete AFTER DELETE ON transactions
+        REFERENCING OLD TABLE AS old_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION transactions_daily_apply()
+        """,
+        """
+        CREATE TRIGGER transactions_daily_update AFTER UPDATE ON transactions
+        REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION transactions_daily_apply()
+        """,
+        """
+        CREATE TRIGGER transactions_daily_truncate AFTER TRUNCATE ON transactions
+        FOR EACH STATEMENT EXECUTE FUNCTION transactions_daily_reset()
+        """,
+    ]),
+    Migration(7, "transactions_summary_rollup", [
+        # Resumo O(1) lido no modo SUMMARY_AGGREGATE=table. Versões anteriores o
+        # criavam na inicialização, com trigger por linha; o que sobrou é descartado
+        "DROP TRIGGER IF EXISTS transactions_summary_row ON transactions",
+        "DROP TRIGGER IF EXISTS transactions_summary_truncate ON transactions",
+        "DROP TABLE IF EXISTS transactions_summary",
+        """
+        CREATE TABLE transactions_summary (
+            singleton BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (singleton),
+            income NUMERIC NOT NULL DEFAULT 0,
+            expense NUMERIC NOT NULL DEFAULT 0,
+            transactions_count BIGINT NOT NULL DEFAULT 0
+        )
+        """,
+        # Como em transactions_daily: um UPDATE da linha única por instrução, não por
+        # linha, e nenhum quando a instrução não alterou transações
+        """
+        CREATE OR REPLACE FUNCTION transactions_summary_apply() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP IN ('DELETE', 'UPDATE') THEN
+                UPDATE transactions_summary AS summary SET
+                    income = summary.income - delta.income,
+                    expense = summary.expense - delta.expense,
+                    transactions_count = summary.transactions_count - delta.transactions_count
+                FROM (SELECT COALESCE(SUM(amount) FILTER (WHERE amount > 0), 0) AS income,
+                             COALESCE(SUM(amount) FILTER (WHERE amount < 0), 0) AS expense,
+                             COUNT(*) AS transactions_count
+                      FROM old_rows) AS delta
+                WHERE delta.transactions_count > 0;
+            END IF;
+            IF TG_OP IN ('INSERT', 'UPDATE') THEN
+                UPDATE transactions_summary AS summary SET
+                    income = summary.income + delta.income,
+                    expense = summary.expense + delta.expense,
+                    transactions_count = summary.transactions_count + delta.transactions_count
+                FROM (SELECT COALESCE(SUM(amount) FILTER (WHERE amount > 0), 0) AS income,
+                             COALESCE(SUM(amount) FILTER (WHERE amount < 0), 0) AS expense,
+                             COUNT(*) AS transactions_count
+                      FROM new_rows) AS delta
+                WHERE delta.transactions_count > 0;
+            END IF;
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql
+        """,
+        """
+        CREATE OR REPLACE FUNCTION transactions_summary_reset() RETURNS trigger AS $$
+        BEGIN
+            UPDATE transactions_summary SET income = 0, expense = 0, transactions_count = 0;
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql
+        """,
+        # Trava escritas durante o backfill para que nenhuma linha escape dos triggers
+        "LOCK TABLE transactions IN SHARE ROW EXCLUSIVE MODE",
+        """
+        INSERT INTO transactions_summary (income, expense, transactions_count)
+        SELECT COALESCE(SUM(amount) FILTER (WHERE amount > 0), 0),
+               COALESCE(SUM(amount) FILTER (WHERE amount < 0), 0),
+               COUNT(*)
+        FROM transactions
+        """,
+        """
+        CREATE TRIGGER transactions_summary_insert AFTER INSERT ON transactions
+        REFERENCING NEW TABLE AS new_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION transactions_summary_apply()
+        """,
+        """
+        CREATE TRIGGER transactions_summary_delete AFTER DELETE ON transactions
+        REFERENCING OLD TABLE AS old_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION transactions_summary_apply()
+        """,
+        """
+        CREATE TRIGGER transactions_summary_update AFTER UPDATE ON transactions
+        REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION transactions_summary_apply()
+        """,
+        """
+        CREATE TRIGGER transactions_summary_truncate AFTER TRUNCATE ON transactions
+        FOR EACH STATEMENT EXECUTE FUNCTION transactions_summary_reset()
+        """,
+    ]),
+]
+
+# Chave do advisory lock que serializa as migrações entre workers
+MIGRATIONS_LOCK_ID = 7_238_104
+
+_CREATE_MIGRATIONS_TABLE = """
+    CREATE TABLE IF NOT EXISTS schema_migrations (
+        version INTEGER PRIMARY KEY,
+        name TEXT NOT NULL,
+        applied_at TIMESTAMPTZ NOT NULL DEFAULT now()
+    )
+"""
+
+
+async def apply_migration(tx, migration):
+    """Aplica ``migration`` dentro de ``tx`` se ainda não foi aplicada. Retorna True se aplicou."""
+    # O lock vale até o fim da transação: outro worker espera e depois vê a versão registrada
+    await tx.execute("SELECT pg_advisory_xact_lock(%s)", (MIGRATIONS_LOCK_ID,))
+    await tx.execute(_CREATE_MIGRATIONS_TABLE)
+    if await tx.fetch_one("SELECT 1 AS applied FROM schema_migrations WHERE version = %s", (migration.version,)):
+        return False
+    with tracer.start_as_current_span("database.migration") as span:
+        span.set_attribute("db.migration.version", migration.version)
+        span.set_attribute("db.migration.name", migration.name)
+        for statement in migration.statements:
+            await tx.execute(statement)
+        await tx.execute(
+            "INSERT INTO schema_migrations (version, name) VALUES (%s, %s)",
+            (migration.version, migration.name),
+        )
+    return True
+
+
+async def run_migrations(db, target=None):
+    """Aplica as migrações pendentes até ``target`` (todas por padrão), uma transação por versão.
+
+    Retorna as versões aplicadas nesta chamada.
+    """
+    applied = []
+    for migration in MIGRATIONS:
+        if target is not None and migration.version > target:
+            break
+        async with db.transaction() as tx:
+            if await apply_migration(tx, migration):
+                applied.append(migration.version)
+    return applied
@@ -0,0 +1,67 @@
+# Manutenção das partições mensais de transactions (migração 6)
+import asyncio
+import datetime
+import os
+
+from instrumentation import tracer
+from cache import summary_write
+
+# Meses à frente do atual que já devem ter partição
+PARTITION_MONTHS_AHEAD = int(os.getenv("PARTITION_MONTHS_AHEAD", "3"))
+# Meses mantidos em transactions; partições mais antigas são desanexadas para o
+# schema archive e deixam de contar nos resumos. 0 desativa o arquivamento
+PARTITION_RETENTION_MONTHS = int(os.getenv("PARTITION_RETENTION_MONTHS", "0"))
+# Intervalo (s) entre rodadas de manutenção após a da inicialização; 0 desativa o laço
+PARTITION_MAINTENANCE_INTERVAL = float(os.getenv("PARTITION_MAINTENANCE_INTERVAL", "3600"))
+
+# Serializa a manutenção entre workers (DDL concorrente nas mesmas partições falharia)
+PARTITIONS_LOCK_ID = 7_238_105
+
+
+def retention_cutoff(today, retention_months):
+    """Primeiro dia do mês mais antigo mantido: meses anteriores são arquivados."""
+    months = today.year * 12 + today.month - 1 - retention_months
+    return datetime.date(months // 12, months % 12 + 1, 1)
+
+
+async def ensure_partitions(db, months_ahead=PARTITION_MONTHS_AHEAD):
+    """Cria as partições que faltam. Retorna os nomes das partições criadas."""
+    with tracer.start_as_current_span("partitions.ensure") as span:
+        async with db.transaction() as tx:
+            await tx.execute("SELECT pg_advisory_xact_lock(%s)", (PARTITIONS_LOCK_ID,))
+            rows = await tx.fetch_all(
+                "SELECT name FROM transactions_ensure_partitions(%s) AS name", (months_ahead,)
+            )
+        created = [row['name'] for row in rows]
+        span.set_attribute("partitions.created", len(created))
+        return created
+
+
+async def archive_partitions(db, retention_months=PARTITION_RETENTION_MONTHS, today=None):
+    """Arquiva as partições além da retenção. Retorna os nomes das partições arquivadas."""
+    if retention_months <= 0:
+        return []
+    before = retention_cutoff(today or datetime.date.today(), retention_months)
+    with tracer.start_as_current_span("partitions.archive") as span:
+        span.set_attribute("partitions.before", before.isoformat())
+        # Para o cache, arquivar equivale a excluir as linhas dos meses arquivados
+        async with summary_write() as write:
+            async with db.transaction() as tx:
+                await tx.execute("SELECT pg_advisory_xact_lock(%s)", (PARTITIONS_LOCK_ID,))
+                archived = await tx.fetch_all("SELECT * FROM transactions_archive_partitions(%s)", (before,))
+            write.removed([row['income'] for row in archived] + [row['expense'] for row in archived])
+        span.set_attribute("partitions.archived", len(archived))
+        return [row['partition_name'] for row in archived]
+
+
+async def run_partition_maintenance(db):
+    """Laço de manutenção: cria partições futuras e arquiva as antigas."""
+    while True:
+        await asyncio.sleep(PARTITION_MAINTENANCE_INTERVAL)
+        try:
+            created = await ensure_partitions(db)
+            archived = await archive_partitions(db)
+            if created or archived:
+                print(f"Partições de transactions: criadas {created or 'nenhuma'}, arquivadas {archived or 'nenhuma'}.")
+        except Exception as e:
+            print(f"Falha na manutenção das partições de transactions: {e}")
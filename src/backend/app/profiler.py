@@ -0,0 +1,180 @@
+# Profiler por amostragem de pilha (SIGPROF), opt-in
+#
+# Com PROFILER_TOKEN definido, uma requisição com o cabeçalho "X-Profile: <token>" é
+# amostrada enquanto roda: a cada PROFILER_INTERVAL segundos de CPU do processo a pilha
+# da thread principal (o event loop do uvicorn) é registrada se pertencer à requisição
+# (ContextVar). O perfil, no formato "folded" (flamegraph.pl, speedscope, inferno), fica
+# no Redis com o trace_id do span da requisição como id e o span recebe o atributo
+# profile.id, então um trace lento no Jaeger leva direto ao perfil. POST /api/profiles
+# amostra o worker inteiro por alguns segundos.
+#
+# Só mede CPU em código Python: tempo esperando I/O aparece nos spans, não no perfil,
+# e tempo dentro de extensões em C é atribuído à linha Python que as chamou.
+import asyncio
+import contextvars
+import hmac
+import os
+import signal
+import threading
+import uuid
+from collections import Counter
+from contextlib import asynccontextmanager
+
+import redis
+from opentelemetry import trace
+
+from cache import redis_client
+
+# Vazio desativa o profiler; o mesmo valor autoriza o cabeçalho e os endpoints
+PROFILER_TOKEN = os.getenv("PROFILER_TOKEN", "")
+# Intervalo entre amostras, em segundos de CPU do processo
+PROFILER_INTERVAL = float(os.getenv("PROFILER_INTERVAL", "0.005"))
+# Duração máxima (s) da amostragem do worker inteiro
+PROFILER_MAX_SECONDS = float(os.getenv("PROFILER_MAX_SECONDS", "60"))
+# Por quanto tempo (s) os perfis ficam disponíveis no Redis
+PROFILE_TTL = int(os.getenv("PROFILE_TTL", "3600"))
+
+PROFILE_KEY_PREFIX = "profile:"
+PROFILE_HEADER = "x-profile"
+
+_request_profile = contextvars.ContextVar("request_profile", default=None)
+
+
+class ProfilerUnavailable(Exception):
+    """Profiler desativado ou sem suporte a SIGPROF nesta plataforma."""
+
+
+class Profile:
+    """Contagem de pilhas amostradas, da raiz para a folha."""
+
+    def __init__(self, profile_id):
+        self.id = profile_id
+        self.stacks = Counter()
+
+    @property
+    def samples(self):
+        return sum(self.stacks.values())
+
+    def add(self, frame):
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append((code.co_name, code.co_filename, code.co_firstlineno))
+            frame = frame.f_back
+        self.stacks[tuple(reversed(stack))] += 1
+
+    def folded(self):
+        """Uma linha "raiz;...;folha contagem" por pilha distinta."""
+        lines = []
+        for stack, count in self.stacks.most_common():
+            frames = ";".join(f"{name} ({os.path.basename(filename)}:{line})" for name, filename, line in stack)
+            lines.append(f"{frames} {count}")
+        return "\n".join(lines) + "\n" if lines else ""
+
+
+class StackSampler:
+    """Temporizador ITIMER_PROF ligado só enquanto houver algum perfil ativo."""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.installed = False
+        self.worker_profiles = set()
+        self._active = 0
+        self._lock = threading.Lock()
+
+    def install(self):
+        """Registra o tratador de SIGPROF; precisa rodar na thread principal."""
+        if not PROFILER_TOKEN:
+            raise ProfilerUnavailable("PROFILER_TOKEN não definido")
+        if not hasattr(signal, "setitimer"):
+            raise ProfilerUnavailable("SIGPROF não suportado nesta plataforma")
+        signal.signal(signal.SIGPROF, self._sample)
+        self.installed = True
+
+    def _sample(self, signum, frame):
+        profile = _request_profile.get()
+        if profile is not None:
+            profile.add(frame)
+        for profile in tuple(self.worker_profiles):
+            profile.add(frame)
+
+    def start(self):
+        if not self.installed:
+            raise ProfilerUnavailable("profiler desativado")
+        with self._lock:
+            self._active += 1
+            if self._active == 1:
+                signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+
+    def stop(self):
+        with self._lock:
+            self._active -= 1
+            if self._active == 0:
+                signal.setitimer(signal.ITIMER_PROF, 0)
+
+
+sampler = StackSampler(PROFILER_INTERVAL)
+
+
+def setup_profiler():
+    """Ativa o profiler se configurado; chamado na importação do app (thread principal)."""
+    if not PROFILER_TOKEN:
+        return
+    try:
+        sampler.install()
+    except (ProfilerUnavailable, ValueError) as e:
+        print(f"Profiler indisponível: {e}")
+        return
+    print(f"Profiler por amostragem ativo (intervalo {PROFILER_INTERVAL * 1000:g} ms de CPU)")
+
+
+def authorized(token):
+    return bool(PROFILER_TOKEN) and token is not None and hmac.compare_digest(token, PROFILER_TOKEN)
+
+
+def profile_id_for(span):
+    """trace_id do span em hexadecimal; sem trace válido (SDK desligado), um id aleatório."""
+    context = span.get_span_context()
+    return trace.format_trace_id(context.trace_id) if context.is_valid else uuid.uuid4().hex
+
+
+async def store_profile(profile):
+    try:
+        await redis_client.set(f"{PROFILE_KEY_PREFIX}{profile.id}", profile.folded(), ex=PROFILE_TTL)
+    except redis.RedisError as e:
+        trace.get_current_span().record_exception(e)
+
+
+async def get_profile(profile_id):
+    return await redis_client.get(f"{PROFILE_KEY_PREFIX}{profile_id}")
+
+
+@asynccontextmanager
+async def profile_request():
+    """Amostra o código que roda neste contexto (a requisição) e grava o perfil ao final."""
+    span = trace.get_current_span()
+    profile = Profile(profile_id_for(span))
+    span.set_attribute("profile.id", profile.id)
+    sampler.start()
+    reset = _request_profile.set(profile)
+    try:
+        yield profile
+    finally:
+        _request_profile.reset(reset)
+        sampler.stop()
+        span.set_attribute("profile.samples", profile.samples)
+        await store_profile(profile)
+
+
+async def profile_worker(seconds):
+    """Amostra tudo o que roda na thread principal deste worker por ``seconds`` segundos."""
+    profile = Profile(uuid.uuid4().hex)
+    sampler.start()
+    sampler.worker_profiles.add(profile)
+    try:
+        await asyncio.sleep(min(seconds, PROFILER_MAX_SECONDS))
+    finally:
+        sampler.worker_profiles.discard(profile)
+        sampler.stop()
+    await store_profile(profile)
+    return profile
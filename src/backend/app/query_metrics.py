@@ -0,0 +1,281 @@
+# Medição das instruções SQL no nível do cursor
+#
+# Os cursores de database.py (psycopg3 no modo async, psycopg2 no sync) são subclasses
+# daqui: cada instrução é cronometrada com perf_counter_ns em volta do execute/fetch,
+# sem o checkout da conexão, e registrada em database_query_duration_seconds com a
+# impressão digital da instrução (literais e parâmetros trocados por "?"), junto com
+# as linhas (e, com DB_QUERY_RESULT_BYTES, os bytes) devolvidas. Instruções acima de
+# DB_SLOW_QUERY_THRESHOLD vão para o log de consultas lentas só com os tipos dos
+# parâmetros, nunca os valores.
+#
+# Cursores no servidor (stream_batches) somam o DECLARE e todos os FETCH numa única
+# medição, registrada quando o cursor fecha.
+import functools
+import os
+import re
+import time
+from contextlib import asynccontextmanager, contextmanager
+
+import psycopg
+import psycopg2.extensions
+
+from instrumentation import (
+    database_query_duration, database_rows_returned, database_bytes_returned, database_slow_queries_counter
+)
+
+# Duração (s) a partir da qual a instrução entra no log de consultas lentas; 0 desativa
+DB_SLOW_QUERY_THRESHOLD = float(os.getenv("DB_SLOW_QUERY_THRESHOLD", "0.5"))
+# Soma os bytes de cada valor devolvido (só no modo async). O PGresult do psycopg não
+# expõe PQgetlength: medir copia cada célula, então fica desligado por padrão
+DB_QUERY_RESULT_BYTES = os.getenv("DB_QUERY_RESULT_BYTES", "false").lower() == "true"
+
+_COMMENT = re.compile(r"--[^\n]*|/\*.*?\*/", re.S)
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_PLACEHOLDER = re.compile(r"%\(\w+\)[sbt]|%[sbt]|\$\d+")
+_NUMBER = re.compile(r"(?<![\w.])-?\d+(?:\.\d+)?\b")
+_SPACES = re.compile(r"\s+")
+_COMMA = re.compile(r" ?, ?")
+_PAREN_SPACES = re.compile(r"(?<=\() | (?=\))")
+# (?, ?, ?) -> (?) e VALUES (?), (?), ... -> VALUES (?)
+_LIST = re.compile(r"\(\?(?:, \?)*\)")
+_ROWS = re.compile(r"\(\?\)(?:, \(\?\))+")
+# Instruções maiores que isso não entram no cache: o execute_values do psycopg2 embute
+# os valores no SQL (em bytes), então cada lote é um texto único e com dados do usuário
+_FINGERPRINT_CACHE_MAX_LENGTH = 2048
+
+
+def fingerprint(query):
+    """Forma normalizada da instrução: mesma impressão digital para qualquer parâmetro."""
+    if isinstance(query, str) and len(query) <= _FINGERPRINT_CACHE_MAX_LENGTH:
+        return _cached_fingerprint(query)
+    if isinstance(query, bytes):
+        query = query.decode("utf-8", "replace")
+    elif not isinstance(query, str):
+        query = str(query)
+    return _normalize(query)
+
+
+@functools.lru_cache(maxsize=1024)
+def _cached_fingerprint(query):
+    return _normalize(query)
+
+
+def _normalize(query):
+    text = _COMMENT.sub(" ", query)
+    text = _STRING.sub("?", text)
+    text = _PLACEHOLDER.sub("?", text)
+    text = _NUMBER.sub("?", text)
+    text = _SPACES.sub(" ", text).strip().rstrip(";").strip()
+    text = _PAREN_SPACES.sub("", _COMMA.sub(", ", text))
+    text = _LIST.sub("(?)", text)
+    return _ROWS.sub("(?)", text)
+
+
+def redact(params):
+    """Só o formato dos parâmetros: tipos, nomes e quantidade, sem nenhum valor."""
+    if params is None:
+        return "nenhum"
+    if isinstance(params, dict):
+        return "{" + ", ".join(f"{name}: {type(value).__name__}" for name, value in params.items()) + "}"
+    if isinstance(params, list) and params and isinstance(params[0], (list, tuple, dict)):
+        # executemany: um conjunto de parâmetros por linha
+        return f"{len(params)} x {redact(params[0])}"
+    if isinstance(params, (list, tuple)):
+        return "[" + ", ".join(type(value).__name__ for value in params) + "]"
+    return type(params).__name__
+
+
+def record_statement(query, params, elapsed_ns, rows=0, nbytes=None, target="primary"):
+    statement = fingerprint(query)
+    if not statement:
+        return
+    elapsed = elapsed_ns / 1e9
+    attributes = {"db.statement": statement, "db.operation": statement.split(" ", 1)[0].upper(), "db.target": target}
+    database_query_duration.record(elapsed, attributes)
+    database_rows_returned.record(rows, attributes)
+    if nbytes is not None:
+        database_bytes_returned.record(nbytes, attributes)
+    if DB_SLOW_QUERY_THRESHOLD > 0 and elapsed >= DB_SLOW_QUERY_THRESHOLD:
+        database_slow_queries_counter.add(1, attributes)
+        size = f", {nbytes} bytes" if nbytes is not None else ""
+        print(f"Consulta lenta ({target}, {elapsed * 1000:.1f} ms, {rows} linhas{size}): {statement} "
+              f"| parâmetros: {redact(params)}")
+
+
+def _target(connection):
+    return getattr(connection, "db_target", "primary")
+
+
+# --- psycopg3 (modo async) ---
+
+def _result_size(pgresult):
+    """Linhas e bytes (valores no formato do protocolo, None se desligado) do último resultado."""
+    if pgresult is None or pgresult.status != psycopg.pq.ExecStatus.TUPLES_OK:
+        return 0, (0 if DB_QUERY_RESULT_BYTES else None)
+    if not DB_QUERY_RESULT_BYTES:
+        return pgresult.ntuples, None
+    nbytes = 0
+    for row in range(pgresult.ntuples):
+        for column in range(pgresult.nfields):
+            value = pgresult.get_value(row, column)
+            if value is not None:
+                nbytes += len(value)
+    return pgresult.ntuples, nbytes
+
+
+class TimedAsyncCursor(psycopg.AsyncCursor):
+    """Cursor psycopg3 que registra cada execute, executemany e COPY."""
+
+    async def execute(self, query, params=None, **kwargs):
+        start = time.perf_counter_ns()
+        rows, nbytes = 0, None
+        try:
+            result = await super().execute(query, params, **kwargs)
+            rows, nbytes = _result_size(self.pgresult)
+            return result
+        finally:
+            record_statement(query, params, time.perf_counter_ns() - start, rows, nbytes, _target(self.connection))
+
+    async def executemany(self, query, params_seq, *, returning=False):
+        params_seq = list(params_seq)
+        start = time.perf_counter_ns()
+        rows = 0
+        try:
+            await super().executemany(query, params_seq, returning=returning)
+            # Com returning há um resultado por conjunto e o chamador os percorre com
+            # nextset(); o INSERT ... VALUES de insert_rows devolve uma linha por conjunto
+            rows = len(params_seq) if returning else 0
+        finally:
+            record_statement(query, params_seq, time.perf_counter_ns() - start, rows,
+                             target=_target(self.connection))
+
+    @asynccontextmanager
+    async def copy(self, statement, params=None, **kwargs):
+        start = time.perf_counter_ns()
+        try:
+            async with super().copy(statement, params, **kwargs) as copy:
+                yield copy
+        finally:
+            record_statement(statement, params, time.perf_counter_ns() - start, target=_target(self.connection))
+
+
+class TimedAsyncServerCursor(psycopg.AsyncServerCursor):
+    """Cursor nomeado psycopg3: DECLARE e FETCHs somados numa única medição."""
+
+    _timed_query = None
+
+    async def execute(self, query, params=None, **kwargs):
+        self._timed_query, self._timed_params = query, params
+        self._timed_ns = self._timed_rows = 0
+        self._timed_bytes = 0 if DB_QUERY_RESULT_BYTES else None
+        start = time.perf_counter_ns()
+        try:
+            return await super().execute(query, params, **kwargs)
+        finally:
+            self._timed_ns += time.perf_counter_ns() - start
+
+    async def _timed_fetch(self, fetch, *args):
+        start = time.perf_counter_ns()
+        try:
+            return await fetch(*args)
+        finally:
+            self._timed_ns += time.perf_counter_ns() - start
+            rows, nbytes = _result_size(self.pgresult)
+            self._timed_rows += rows
+            if nbytes is not None:
+                self._timed_bytes += nbytes
+
+    async def fetchone(self):
+        return await self._timed_fetch(super().fetchone)
+
+    async def fetchmany(self, size=0):
+        return await self._timed_fetch(super().fetchmany, size)
+
+    async def fetchall(self):
+        return await self._timed_fetch(super().fetchall)
+
+    async def close(self):
+        try:
+            await super().close()
+        finally:
+            if self._timed_query is not None:
+                record_statement(self._timed_query, self._timed_params, self._timed_ns,
+                                 self._timed_rows, self._timed_bytes, _target(self.connection))
+                self._timed_query = None
+
+
+async def configure_async_connection(conn, target="primary"):
+    """Callback ``configure`` do AsyncConnectionPool.
+
+    O cursor_factory comum vai nos parâmetros de conexão (o instrumentador do psycopg
+    cria os spans numa subclasse dele); aqui ficam o de cursores nomeados e o alvo.
+    """
+    conn.server_cursor_factory = TimedAsyncServerCursor
+    conn.db_target = target
+
+
+# --- psycopg2 (modo sync) ---
+# O psycopg2 não expõe o resultado bruto: aqui só linhas, sem bytes.
+
+class _TimedCursorMixin:
+    _timed_query = None
+
+    def execute(self, query, vars=None):
+        start = time.perf_counter_ns()
+        try:
+            return super().execute(query, vars)
+        finally:
+            elapsed = time.perf_counter_ns() - start
+            if self.name is None:
+                rows = max(self.rowcount, 0) if self.description is not None else 0
+                record_statement(query, vars, elapsed, rows, target=_target(self.connection))
+            else:
+                self._timed_query, self._timed_params, self._timed_ns, self._timed_rows = query, vars, elapsed, 0
+
+    def copy_expert(self, sql, file, size=8192):
+        start = time.perf_counter_ns()
+        try:
+            return super().copy_expert(sql, file, size)
+        finally:
+            record_statement(sql, None, time.perf_counter_ns() - start, target=_target(self.connection))
+
+    @contextmanager
+    def _timed_fetch(self):
+        # Só cursores nomeados vão ao servidor no fetch; os demais já têm o resultado
+        start = time.perf_counter_ns()
+        try:
+            yield
+        finally:
+            if self._timed_query is not None:
+                self._timed_ns += time.perf_counter_ns() - start
+
+    def fetchmany(self, size=None):
+        with self._timed_fetch():
+            rows = super().fetchmany(size) if size is not None else super().fetchmany()
+        if self._timed_query is not None:
+            self._timed_rows += len(rows)
+        return rows
+
+    def close(self):
+        try:
+            super().close()
+        finally:
+            if self._timed_query is not None:
+                record_statement(self._timed_query, self._timed_params, self._timed_ns, self._timed_rows,
+                                 target=_target(self.connection))
+                self._timed_query = None
+
+
+@functools.lru_cache(maxsize=None)
+def _timed_cursor_class(base):
+    return type(f"Timed{base.__name__}", (_TimedCursorMixin, base), {})
+
+
+class TimedConnection(psycopg2.extensions.connection):
+    """Conexão psycopg2 cujos cursores, de qualquer cursor_factory, são medidos."""
+
+    db_target = "primary"
+
+    def cursor(self, *args, cursor_factory=None, **kwargs):
+        base = cursor_factory or self.cursor_factory or psycopg2.extensions.cursor
+        return super().cursor(*args, cursor_factory=_timed_cursor_class(base), **kwargs)
@@ -0,0 +1,173 @@
+# Roteamento de leituras entre o primário e réplicas do PostgreSQL
+import asyncio
+import itertools
+import os
+import time
+
+from opentelemetry import trace
+
+from instrumentation import tracer, db_read_route_counter, register_replicas
+from database import create_database, PRIMARY
+
+# Réplicas de leitura, "host[:porta]" separadas por vírgula; vazio mantém tudo no primário
+DB_REPLICA_HOSTS = os.getenv("DB_REPLICA_HOSTS", "")
+# round_robin | least_latency
+DB_REPLICA_SELECTION = os.getenv("DB_REPLICA_SELECTION", "round_robin").lower()
+# Réplicas com atraso acima deste limite (s) saem do rodízio até se recuperarem
+DB_REPLICA_MAX_LAG = float(os.getenv("DB_REPLICA_MAX_LAG", "5"))
+DB_REPLICA_CHECK_INTERVAL = float(os.getenv("DB_REPLICA_CHECK_INTERVAL", "2"))
+# Depois de um POST/DELETE o cliente lê do primário por esta janela (s) e vê a própria escrita
+DB_READ_YOUR_WRITES_WINDOW = float(os.getenv("DB_READ_YOUR_WRITES_WINDOW", "5"))
+READ_YOUR_WRITES_COOKIE = "fintelli_primary_until"
+
+# Peso da medição mais recente na média móvel da latência
+_LATENCY_ALPHA = 0.3
+
+PRIMARY_LSN_QUERY = "SELECT pg_current_wal_lsn()::text AS lsn"
+
+REPLICA_STATUS_QUERY = """
+    SELECT pg_is_in_recovery() AS in_recovery,
+           pg_last_wal_replay_lsn()::text AS replay_lsn,
+           EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())::float AS replay_age
+"""
+
+
+def parse_hosts(value):
+    """Converte "host[:porta],..." em [(host, porta)]; porta None usa POSTGRES_PORT."""
+    hosts = []
+    for item in value.split(","):
+        item = item.strip()
+        if item:
+            host, _, port = item.partition(":")
+            hosts.append((host, port or None))
+    return hosts
+
+
+def parse_lsn(lsn):
+    """Converte um LSN ("16/B374D848") na posição em bytes no WAL."""
+    high, low = lsn.split("/")
+    return (int(high, 16) << 32) + int(low, 16)
+
+
+def replication_lag(primary_lsn, replay_lsn, replay_age):
+    """Atraso em segundos: 0 se a réplica já reproduziu tudo o que o primário gravou.
+
+    Atrás do primário, usa o tempo desde o último commit reproduzido, uma estimativa
+    conservadora: após um longo período sem escritas ela supera o atraso real.
+    """
+    if parse_lsn(replay_lsn) >= parse_lsn(primary_lsn):
+        return 0.0
+    return max(replay_age or 0.0, 0.0)
+
+
+def prefers_primary(cookies, now=None):
+    """True se o cliente escreveu há menos de DB_READ_YOUR_WRITES_WINDOW segundos."""
+    try:
+        return float(cookies.get(READ_YOUR_WRITES_COOKIE, 0)) > (now or time.time())
+    except ValueError:
+        return False
+
+
+class Replica:
+    """Uma réplica e o estado medido na última verificação."""
+
+    def __init__(self, db):
+        self.db = db
+        self.target = db.target
+        # Só entra no rodízio depois da primeira verificação bem-sucedida
+        self.healthy = False
+        self.lag = None
+        self.latency = None
+
+    def record(self, lag, latency, max_lag):
+        self.lag = lag
+        self.latency = latency if self.latency is None else (
+            _LATENCY_ALPHA * latency + (1 - _LATENCY_ALPHA) * self.latency
+        )
+        self.healthy = lag <= max_lag
+
+
+class ReplicaRouter:
+    """Escolhe onde executar cada leitura; escritas vão sempre ao primário."""
+
+    def __init__(self, replicas, selection=DB_REPLICA_SELECTION, max_lag=DB_REPLICA_MAX_LAG):
+        self.replicas = replicas
+        self.selection = selection
+        self.max_lag = max_lag
+        self._turn = itertools.count()
+        register_replicas(self.stats)
+
+    def stats(self):
+        return {replica.target: (replica.lag, replica.latency) for replica in self.replicas}
+
+    def choose(self, prefer_primary=False):
+        """Retorna a réplica para uma leitura, ou None para usar o primário."""
+        replica, reason = self._choose(prefer_primary)
+        target = replica.target if replica else PRIMARY
+        trace.get_current_span().set_attribute("db.target", target)
+        if self.replicas:
+            db_read_route_counter.add(1, {"db.target": target, "reason": reason})
+        return replica.db if replica else None
+
+    def _choose(self, prefer_primary):
+        if not self.replicas:
+            return None, "no_replicas"
+        if prefer_primary:
+            return None, "read_your_writes"
+        healthy = [replica for replica in self.replicas if replica.healthy]
+        if not healthy:
+            return None, "fallback"
+        if self.selection == "least_latency":
+            return min(healthy, key=lambda replica: replica.latency), "replica"
+        return healthy[next(self._turn) % len(healthy)], "replica"
+
+    async def open(self):
+        for replica in self.replicas:
+            await replica.db.open()
+
+    async def close(self):
+        for replica in self.replicas:
+            await replica.db.close()
+
+    async def check(self, primary):
+        """Mede atraso e latência de cada réplica em relação ao primário."""
+        if not self.replicas:
+            return
+        # LSN do primário antes das réplicas: o que elas reproduzirem depois só reduz o atraso
+        primary_lsn = (await primary.fetch_one(PRIMARY_LSN_QUERY))["lsn"]
+        await asyncio.gather(*(self._check(replica, primary_lsn) for replica in self.replicas))
+
+    async def _check(self, replica, primary_lsn):
+        with tracer.start_as_current_span("database.replica_check") as span:
+            span.set_attribute("db.target", replica.target)
+            try:
+                start = time.perf_counter()
+                status = await asyncio.wait_for(replica.db.fetch_one(REPLICA_STATUS_QUERY), DB_REPLICA_CHECK_INTERVAL)
+                latency = time.perf_counter() - start
+                if not status["in_recovery"]:
+                    # Um servidor promovido deixou de receber as escritas do primário
+                    raise RuntimeError("o servidor não está em recuperação (não é uma réplica)")
+                replica.record(replication_lag(primary_lsn, status["replay_lsn"], status["replay_age"]),
+                               latency, self.max_lag)
+                span.set_attribute("db.replica.lag", replica.lag)
+                span.set_attribute("db.replica.latency", latency)
+            except Exception as e:
+                replica.healthy = False
+                span.record_exception(e)
+            span.set_attribute("db.replica.healthy", replica.healthy)
+
+
+replica_router = ReplicaRouter([
+    Replica(create_database(f"replica:{host}:{port or os.getenv('POSTGRES_PORT', '5432')}", host, port))
+    for host, port in parse_hosts(DB_REPLICA_HOSTS)
+])
+
+
+async def run_replica_monitor(primary):
+    """Laço que mantém o estado das réplicas atualizado."""
+    while True:
+        try:
+            await replica_router.check(primary)
+        except Exception as e:
+            print(f"Falha na verificação das réplicas: {e}")
+        await asyncio.sleep(DB_REPLICA_CHECK_INTERVAL)
@@ -0,0 +1,201 @@
+# Amostragem de traces e spans customizados de baixo custo
+#
+# Três peças, combinadas em instrumentation.py conforme as variáveis TRACE_*:
+# - RouteRatioSampler: decide na raiz do trace com uma taxa por rota (http.route);
+#   os spans filhos seguem a decisão do pai (ParentBased).
+# - KeepErrorsAndSlow + TailSamplingProcessor: os traces não amostrados na raiz ainda
+#   são gravados em memória e exportados se terminarem com erro ou passarem do limite
+#   de duração. Economiza a exportação, não a criação dos spans.
+# - FoldedTracer: os spans customizados não são criados; atributos e eventos vão para
+#   o span atual (o da requisição, criado pelo instrumentador do FastAPI), prefixados
+#   com o nome do span customizado.
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from opentelemetry import trace
+from opentelemetry.sdk.trace import ReadableSpan, SpanProcessor
+from opentelemetry.sdk.trace.sampling import Decision, Sampler, SamplingResult, TraceIdRatioBased
+from opentelemetry.trace import StatusCode, TraceFlags
+
+
+def parse_route_rates(value):
+    """Converte "rota=taxa,rota=taxa" em dicionário; taxas entre 0 e 1."""
+    rates = {}
+    for item in filter(None, (part.strip() for part in value.split(","))):
+        route, separator, rate = item.rpartition("=")
+        if not separator or not route.strip():
+            raise ValueError(f"Taxa de amostragem por rota inválida: {item!r} (use rota=taxa)")
+        ratio = float(rate)
+        if not 0.0 <= ratio <= 1.0:
+            raise ValueError(f"Taxa de amostragem fora de [0, 1]: {item!r}")
+        rates[route.strip()] = ratio
+    return rates
+
+
+class RouteRatioSampler(Sampler):
+    """Amostragem por trace_id com uma taxa por rota e uma taxa padrão para as demais."""
+
+    def __init__(self, default_ratio, route_ratios=None):
+        self.default = TraceIdRatioBased(default_ratio)
+        self.routes = {route: TraceIdRatioBased(ratio) for route, ratio in (route_ratios or {}).items()}
+
+    def should_sample(self, parent_context, trace_id, name, kind=None, attributes=None, links=None, trace_state=None):
+        sampler = self.routes.get((attributes or {}).get("http.route"), self.default)
+        return sampler.should_sample(parent_context, trace_id, name, kind, attributes, links, trace_state)
+
+    def get_description(self):
+        routes = ",".join(f"{route}={sampler.rate}" for route, sampler in self.routes.items())
+        return f"RouteRatioSampler{{{self.default.rate};{routes}}}"
+
+
+class KeepErrorsAndSlow(Sampler):
+    """Grava (sem exportar) o que o sampler base descartar, para a decisão no fim do trace."""
+
+    def __init__(self, base):
+        self.base = base
+
+    def should_sample(self, parent_context, trace_id, name, kind=None, attributes=None, links=None, trace_state=None):
+        result = self.base.should_sample(parent_context, trace_id, name, kind, attributes, links, trace_state)
+        if result.decision == Decision.RECORD_AND_SAMPLE:
+            return result
+        return SamplingResult(Decision.RECORD_ONLY, result.attributes, result.trace_state)
+
+    def get_description(self):
+        return f"KeepErrorsAndSlow{{{self.base.get_description()}}}"
+
+
+def _as_sampled(span):
+    """Cópia do span marcada como amostrada, para passar pelo BatchSpanProcessor."""
+    context = span.context
+    sampled = trace.SpanContext(
+        context.trace_id, context.span_id, context.is_remote,
+        TraceFlags(context.trace_flags | TraceFlags.SAMPLED), context.trace_state,
+    )
+    return ReadableSpan(
+        name=span.name, context=sampled, parent=span.parent, resource=span.resource,
+        attributes=span.attributes, events=span.events, links=span.links, kind=span.kind,
+        status=span.status, start_time=span.start_time, end_time=span.end_time,
+        instrumentation_scope=span.instrumentation_scope,
+    )
+
+
+class TailSamplingProcessor(SpanProcessor):
+    """Repassa os spans amostrados e guarda os demais até o fim do span raiz local.
+
+    Quando a raiz termina, o trace inteiro é exportado se algum span terminou com erro
+    ou se a raiz durou ao menos ``slow_threshold`` segundos; senão é descartado. No
+    máximo ``max_traces`` traces ficam em memória (os mais antigos são descartados).
+    """
+
+    def __init__(self, downstream, slow_threshold, max_traces=1000, counter=None):
+        self.downstream = downstream
+        self.slow_threshold_ns = int(slow_threshold * 1e9)
+        self.max_traces = max_traces
+        self.counter = counter
+        self._traces = OrderedDict()
+        self._lock = threading.Lock()
+
+    def on_start(self, span, parent_context=None):
+        self.downstream.on_start(span, parent_context)
+
+    def on_end(self, span):
+        if span.context.trace_flags.sampled:
+            self.downstream.on_end(span)
+            return
+        trace_id = span.context.trace_id
+        with self._lock:
+            pending = self._traces.setdefault(trace_id, [])
+            pending.append(span)
+            is_root = span.parent is None or span.parent.is_remote
+            if is_root:
+                del self._traces[trace_id]
+            elif len(self._traces) > self.max_traces:
+                self._traces.popitem(last=False)
+                self._record("evicted")
+        if not is_root:
+            return
+        if any(s.status.status_code == StatusCode.ERROR for s in pending):
+            decision = "kept_error"
+        elif span.end_time - span.start_time >= self.slow_threshold_ns:
+            decision = "kept_slow"
+        else:
+            decision = "dropped"
+        self._record(decision)
+        if decision != "dropped":
+            for pending_span in pending:
+                self.downstream.on_end(_as_sampled(pending_span))
+
+    def _record(self, decision):
+        if self.counter is not None:
+            self.counter.add(1, {"decision": decision})
+
+    def shutdown(self):
+        self.downstream.shutdown()
+
+    def force_flush(self, timeout_millis=30000):
+        return self.downstream.force_flush(timeout_millis)
+
+
+class _FoldedSpan:
+    """O span atual visto por um span customizado dobrado nele.
+
+    Atributos e eventos ganham o prefixo ``<nome do span>.``: dois blocos que gravam a
+    mesma chave (``cache.key``, ``db.operation``) não se sobrescrevem, e o span da
+    requisição não recebe atributos ``db.*`` como se fosse um cliente do banco.
+    """
+
+    def __init__(self, span, prefix):
+        self._span = span
+        self._prefix = prefix
+
+    def set_attribute(self, key, value):
+        self._span.set_attribute(f"{self._prefix}.{key}", value)
+
+    def set_attributes(self, attributes):
+        self._span.set_attributes({f"{self._prefix}.{key}": value for key, value in attributes.items()})
+
+    def add_event(self, name, attributes=None, timestamp=None):
+        self._span.add_event(f"{self._prefix}.{name}", attributes, timestamp)
+
+    def record_exception(self, exception, attributes=None, timestamp=None, escaped=False):
+        self._span.record_exception(exception, {"span.name": self._prefix, **(attributes or {})}, timestamp, escaped)
+
+    def __getattr__(self, name):
+        return getattr(self._span, name)
+
+
+def _fold_prefix(span, name):
+    """``name``, ou ``name[n]`` se um bloco com esse nome já gravou no span (ex.: lotes do COPY)."""
+    attributes = getattr(span, "attributes", None) or {}
+    prefix, occurrence = name, 1
+    while any(key.startswith(f"{prefix}.") for key in attributes):
+        occurrence += 1
+        prefix = f"{name}[{occurrence}]"
+    return prefix
+
+
+class FoldedTracer:
+    """Tracer cujos spans customizados viram atributos do span atual.
+
+    Sem span ativo (ex.: o job no worker de faturas) o span é criado normalmente,
+    para o trace não ficar sem raiz.
+    """
+
+    def __init__(self, tracer):
+        self._tracer = tracer
+
+    @contextmanager
+    def start_as_current_span(self, name, *args, **kwargs):
+        current = trace.get_current_span()
+        if not current.get_span_context().is_valid or kwargs.get("context") is not None:
+            with self._tracer.start_as_current_span(name, *args, **kwargs) as span:
+                yield span
+            return
+        folded = _FoldedSpan(current, _fold_prefix(current, name))
+        if kwargs.get("attributes"):
+            folded.set_attributes(kwargs["attributes"])
+        yield folded
+
+    def start_span(self, name, *args, **kwargs):
+        return self._tracer.start_span(name, *args, **kwargs)
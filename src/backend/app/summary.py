@@ -0,0 +1,143 @@
+# Agregação do resumo financeiro no PostgreSQL e reconciliação do cache
+import asyncio
+import datetime
+import os
+from decimal import Decimal
+
+from instrumentation import tracer
+from database import db
+from cache import redis_client, get_cached_summary, summary_generation, store_summary
+
+# "query" agrega a tabela transactions a cada cache miss (O(linhas));
+# "table" lê a linha única de transactions_summary (migração 7), mantida por trigger (O(1))
+SUMMARY_AGGREGATE = os.getenv("SUMMARY_AGGREGATE", "query").lower()
+
+# Intervalo (s) entre reconciliações do resumo em cache com o banco; 0 desativa
+SUMMARY_RECONCILE_INTERVAL = float(os.getenv("SUMMARY_RECONCILE_INTERVAL", "300"))
+SUMMARY_RECONCILE_LOCK_KEY = "financial_summary:reconcile_lock"
+
+SUMMARY_QUERY = """
+    SELECT COALESCE(SUM(amount) FILTER (WHERE amount > 0), 0) AS income,
+           COALESCE(SUM(amount) FILTER (WHERE amount < 0), 0) AS expense,
+           COUNT(*) AS transactions_count
+    FROM transactions
+"""
+
+SUMMARY_TABLE_QUERY = "SELECT income, expense, transactions_count FROM transactions_summary"
+
+def summary_source():
+    """Retorna (consulta, tabela consultada) para o modo configurado."""
+    if SUMMARY_AGGREGATE == "table":
+        return SUMMARY_TABLE_QUERY, "transactions_summary"
+    return SUMMARY_QUERY, "transactions"
+
+
+async def compute_summary(db):
+    """Calcula o resumo no banco. Retorna (resumo, quantidade de transações)."""
+    query, _ = summary_source()
+    totals = await db.fetch_one(query)
+    income = float(totals['income'])
+    expense = float(totals['expense'])
+    return {"income": income, "expense": expense, "balance": income + expense}, totals['transactions_count']
+
+
+async def reconcile_summary_cache(attempts=3):
+    """Sobrescreve o resumo em cache com o valor do banco, corrigindo desvios acumulados."""
+    with tracer.start_as_current_span("cache.reconcile") as span:
+        span.set_attribute("cache.key", "financial_summary")
+        for attempt in range(1, attempts + 1):
+            generation = await summary_generation()
+            cached, _ = await get_cached_summary()
+            summary, _ = await compute_summary(db)
+            if await store_summary(summary, generation):
+                span.set_attribute("cache.reconcile.attempts", attempt)
+                if cached is not None:
+                    span.set_attribute("summary.drift", summary["balance"] - cached["balance"])
+                return True
+        # Escritas concorrentes em todas as tentativas; os deltas mantêm o cache até a próxima rodada
+        span.set_attribute("cache.reconcile.attempts", attempts)
+        return False
+
+
+async def run_summary_reconciliation():
+    """Laço de reconciliação; um lock no Redis garante uma execução por intervalo entre workers."""
+    while True:
+        try:
+            if await redis_client.set(SUMMARY_RECONCILE_LOCK_KEY, "1", nx=True, ex=max(1, int(SUMMARY_RECONCILE_INTERVAL))):
+                await reconcile_summary_cache()
+        except Exception as e:
+            print(f"Falha na reconciliação do resumo em cache: {e}")
+        await asyncio.sleep(SUMMARY_RECONCILE_INTERVAL)
+
+
+# --- Resumos por período ---
+# Lidos de transactions_daily (migração 5), mantida por triggers a cada escrita:
+# o custo depende do número de dias no intervalo, não do número de transações.
+PERIOD_GRANULARITIES = ("day", "week", "month")
+PERIOD_SUMMARY_MAX_BUCKETS = int(os.getenv("PERIOD_SUMMARY_MAX_BUCKETS", "1000"))
+
+PERIOD_SUMMARY_QUERY = """
+    SELECT date_trunc(%(granularity)s, day::timestamp)::date AS period_start,
+           SUM(income) AS income,
+           SUM(expense) AS expense,
+           SUM(transactions_count) AS transactions_count
+    FROM transactions_daily
+    WHERE day >= %(date_from)s AND day <= %(date_to)s
+    GROUP BY 1
+    ORDER BY 1
+"""
+
+
+def period_start(day, granularity):
+    """Início do período que contém ``day`` (semanas começam na segunda, como date_trunc)."""
+    if granularity == "week":
+        return day - datetime.timedelta(days=day.weekday())
+    if granularity == "month":
+        return day.replace(day=1)
+    return day
+
+
+def period_starts(date_from, date_to, granularity):
+    """Inícios de todos os períodos entre as datas, inclusive os sem transações."""
+    start = period_start(date_from, granularity)
+    while start <= date_to:
+        yield start
+        if granularity == "day":
+            start += datetime.timedelta(days=1)
+        elif granularity == "week":
+            start += datetime.timedelta(days=7)
+        else:
+            start = (start + datetime.timedelta(days=32)).replace(day=1)
+
+
+def _totals(income, expense, count):
+    return {"income": float(income), "expense": float(expense), "balance": float(income + expense), "transactions_count": count}
+
+
+async def compute_period_summary(db, date_from, date_to, granularity):
+    """Receitas e despesas por período entre ``date_from`` e ``date_to`` (inclusive).
+
+    O primeiro e o último período podem começar antes ou terminar depois do
+    intervalo; seus totais consideram apenas os dias dentro dele.
+    """
+    rows = await db.fetch_all(PERIOD_SUMMARY_QUERY, {
+        "granularity": granularity, "date_from": date_from, "date_to": date_to,
+    })
+    by_start = {row['period_start']: row for row in rows}
+    periods = []
+    income = expense = Decimal(0)
+    count = 0
+    for start in period_starts(date_from, date_to, granularity):
+        row = by_start.get(start)
+        values = (Decimal(row['income']), Decimal(row['expense']), int(row['transactions_count'])) if row else (Decimal(0), Decimal(0), 0)
+        periods.append({"period_start": start.isoformat(), **_totals(*values)})
+        income += values[0]
+        expense += values[1]
+        count += values[2]
+    return {
+        "from": date_from.isoformat(),
+        "to": date_to.isoformat(),
+        "granularity": granularity,
+        "periods": periods,
+        "total": _totals(income, expense, count),
+    }
@@ -0,0 +1,199 @@
+# Importação em massa de transações (CSV ou NDJSON) via COPY e gravação deduplicada
+# dos lançamentos extraídos de faturas
+import csv
+import datetime
+import io
+import json
+import os
+from decimal import Decimal, InvalidOperation
+
+from starlette.concurrency import run_in_threadpool
+
+IMPORT_BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", "5000"))
+# Erros além deste limite são contados, mas não listados na resposta
+IMPORT_MAX_ERRORS = int(os.getenv("IMPORT_MAX_ERRORS", "1000"))
+
+IMPORT_COLUMNS = ("description", "amount", "transaction_date")
+IMPORT_FORMATS = ("csv", "ndjson")
+
+# Limites das colunas de transactions: VARCHAR(255) e NUMERIC(10, 2)
+_MAX_DESCRIPTION = 255
+_MAX_AMOUNT = Decimal("100000000")
+_CENTS = Decimal("0.01")
+
+
+class ImportFormatError(ValueError):
+    """O arquivo não pode ser lido no formato informado."""
+
+
+def detect_format(filename, content_type, requested=None):
+    """Escolhe o formato pelo parâmetro explícito, extensão ou content-type."""
+    if requested:
+        fmt = requested.lower()
+        if fmt not in IMPORT_FORMATS:
+            raise ImportFormatError(f"Formato não suportado: {requested}")
+        return fmt
+    name = (filename or "").lower()
+    content_type = (content_type or "").lower()
+    if name.endswith((".ndjson", ".jsonl")) or "ndjson" in content_type or "jsonl" in content_type:
+        return "ndjson"
+    if name.endswith(".csv") or "csv" in content_type:
+        return "csv"
+    raise ImportFormatError("Não foi possível identificar o formato; use ?format=csv ou ?format=ndjson")
+
+
+def validate_record(record):
+    """Converte um registro em (descrição, valor, data) ou levanta ValueError."""
+    if not isinstance(record, dict):
+        raise ValueError("registro deve ser um objeto")
+    missing = [column for column in IMPORT_COLUMNS if record.get(column) in (None, "")]
+    if missing:
+        raise ValueError(f"campos obrigatórios ausentes: {', '.join(missing)}")
+
+    description = str(record["description"]).strip()
+    if not description:
+        raise ValueError("description vazia")
+    if "\x00" in description:
+        raise ValueError("description contém caracteres inválidos")
+    if len(description) > _MAX_DESCRIPTION:
+        raise ValueError(f"description com mais de {_MAX_DESCRIPTION} caracteres")
+
+    raw_amount = record["amount"]
+    if isinstance(raw_amount, bool):
+        raise ValueError(f"amount inválido: {raw_amount!r}")
+    try:
+        amount = Decimal(str(raw_amount).strip()).quantize(_CENTS)
+    except (InvalidOperation, ValueError):
+        raise ValueError(f"amount inválido: {raw_amount!r}")
+    if not amount.is_finite() or abs(amount) >= _MAX_AMOUNT:
+        raise ValueError(f"amount fora do intervalo: {raw_amount!r}")
+
+    try:
+        transaction_date = datetime.date.fromisoformat(str(record["transaction_date"]).strip())
+    except ValueError:
+        raise ValueError(f"transaction_date inválida (use AAAA-MM-DD): {record['transaction_date']!r}")
+
+    return description, amount, transaction_date
+
+
+def validate_records(records):
+    """Valida uma lista de registros; retorna (linhas válidas, erros por posição)."""
+    rows, errors = [], []
+    for index, record in enumerate(records):
+        try:
+            rows.append(validate_record(record))
+        except ValueError as e:
+            errors.append({"index": index, "error": str(e)})
+    return rows, errors
+
+
+# Insere só o que ainda não existe com a mesma (data, descrição, valor), respeitando a
+# multiplicidade: duas compras iguais no mesmo dia com uma já lançada gravam apenas uma.
+# O índice por data limita a busca dos existentes às linhas do mesmo dia.
+_INSERT_NEW_TRANSACTIONS = """
+WITH incoming AS (
+    SELECT description, amount, transaction_date,
+           row_number() OVER (PARTITION BY description, amount, transaction_date ORDER BY position) AS occurrence
+    FROM unnest(%s::varchar[], %s::numeric[], %s::date[]) WITH ORDINALITY
+         AS t (description, amount, transaction_date, position)
+)
+INSERT INTO transactions (description, amount, transaction_date)
+SELECT description, amount, transaction_date FROM incoming
+WHERE occurrence > (
+    SELECT count(*) FROM transactions existing
+    WHERE existing.transaction_date = incoming.transaction_date
+      AND existing.description = incoming.description
+      AND existing.amount = incoming.amount
+)
+RETURNING id, description, amount, to_char(transaction_date, 'YYYY-MM-DD') AS transaction_date
+"""
+
+# Serializa importações deduplicadas concorrentes (ex.: a mesma fatura enviada duas vezes)
+_DEDUP_LOCK_KEY = 7_203_118
+
+
+async def insert_new_transactions(tx, rows):
+    """Grava numa única instrução as linhas que ainda não existem; retorna as inseridas."""
+    if not rows:
+        return []
+    await tx.execute("SELECT pg_advisory_xact_lock(%s)", (_DEDUP_LOCK_KEY,))
+    descriptions, amounts, dates = (list(column) for column in zip(*rows))
+    return await tx.fetch_all(_INSERT_NEW_TRANSACTIONS, (descriptions, amounts, dates))
+
+
+def _csv_records(text):
+    reader = csv.DictReader(text)
+    header = reader.fieldnames or []
+    missing = [column for column in IMPORT_COLUMNS if column not in header]
+    if missing:
+        raise ImportFormatError(f"Cabeçalho CSV sem as colunas: {', '.join(missing)}")
+    for record in reader:
+        yield reader.line_num, record
+
+
+def _ndjson_records(text):
+    for line_number, line in enumerate(text, start=1):
+        if not line.strip():
+            continue
+        try:
+            yield line_number, json.loads(line)
+        except json.JSONDecodeError as e:
+            yield line_number, ValueError(f"JSON inválido: {e.msg}")
+
+
+class TransactionImport:
+    """Lê o arquivo enviado em lotes de linhas válidas, acumulando os erros por linha.
+
+    O arquivo do upload já está em disco (SpooledTemporaryFile); a leitura e a
+    validação de cada lote rodam no threadpool para não ocupar o event loop.
+    """
+
+    def __init__(self, file, fmt, batch_size=IMPORT_BATCH_SIZE, max_errors=IMPORT_MAX_ERRORS):
+        self.batch_size = batch_size
+        self.max_errors = max_errors
+        self.errors = []
+        self.failed = 0
+        self._text = io.TextIOWrapper(file, encoding="utf-8-sig", newline="")
+        self._records = _csv_records(self._text) if fmt == "csv" else _ndjson_records(self._text)
+        self._done = False
+
+    def add_error(self, line, message):
+        self.failed += 1
+        if len(self.errors) < self.max_errors:
+            self.errors.append({"line": line, "error": message})
+
+    def _next_batch(self):
+        rows, lines = [], []
+        while len(rows) < self.batch_size:
+            try:
+                line, record = next(self._records)
+            except StopIteration:
+                self._done = True
+                break
+            except UnicodeDecodeError:
+                self._done = True
+                self.add_error(None, "arquivo não está em UTF-8; importação interrompida")
+                break
+            except csv.Error as e:
+                self._done = True
+                self.add_error(None, f"CSV inválido: {e}; importação interrompida")
+                break
+            try:
+                if isinstance(record, Exception):
+                    raise record
+                rows.append(validate_record(record))
+                lines.append(line)
+            except ValueError as e:
+                self.add_error(line, str(e))
+        return rows, lines
+
+    async def batches(self):
+        """Produz (linhas válidas, números de linha) até o fim do arquivo."""
+        try:
+            while not self._done:
+                rows, lines = await run_in_threadpool(self._next_batch)
+                if rows:
+                    yield rows, lines
+        finally:
+            # Devolve o arquivo ao UploadFile, que é quem o fecha
+            self._text.detach()
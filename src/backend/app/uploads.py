@@ -0,0 +1,211 @@
+# Recebimento de uploads em streaming: limite de tamanho, hash incremental e spool em disco
+#
+# O multipart é lido direto do stream da requisição, sem o UploadFile do FastAPI (que
+# recebe o corpo inteiro antes de o endpoint rodar). Só o campo do arquivo é guardado.
+import hashlib
+import mmap
+import os
+import tempfile
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from python_multipart.exceptions import FormParserError
+from python_multipart.multipart import MultipartParser, parse_options_header
+from starlette.concurrency import run_in_threadpool
+
+# Tamanho máximo do PDF de uma fatura; o upload é interrompido assim que passa do limite
+INVOICE_MAX_UPLOAD_BYTES = int(os.getenv("INVOICE_MAX_UPLOAD_BYTES", str(20 * 1024 * 1024)))
+# Até este tamanho o arquivo fica em memória; acima dele vai para um arquivo temporário
+UPLOAD_SPOOL_MAX_MEMORY = int(os.getenv("UPLOAD_SPOOL_MAX_MEMORY", str(1024 * 1024)))
+
+# Folga para cabeçalhos e delimitadores do multipart ao comparar o Content-Length com o limite
+_MULTIPART_OVERHEAD = 64 * 1024
+
+# Upload cujo conteúdo está aberto (SpooledUpload.contents) na requisição atual
+_open_upload = ContextVar("open_upload", default=None)
+
+
+class UploadError(ValueError):
+    """O corpo não é um multipart válido com o campo esperado."""
+
+
+class UploadTooLarge(Exception):
+    """O arquivo passou do tamanho máximo."""
+
+
+class SpooledUpload:
+    """Arquivo recebido em partes: em memória até ``spool_bytes``, depois em disco.
+
+    O sha256 é calculado à medida que as partes chegam. ``peak_buffered_bytes`` é o
+    maior volume de bytes do arquivo no buffer do upload ao mesmo tempo;
+    ``peak_memory`` soma a ele as cópias registradas com ``content_copy`` por quem
+    consome o conteúdo (o cliente do Gemini, por exemplo, exige bytes).
+    """
+
+    def __init__(self, filename=None, content_type=None, spool_bytes=UPLOAD_SPOOL_MAX_MEMORY):
+        self.filename = filename
+        self.content_type = content_type
+        self.size = 0
+        self.peak_buffered_bytes = 0
+        self.peak_memory = 0
+        self._copied_bytes = 0
+        self._spool_bytes = spool_bytes
+        self._hash = hashlib.sha256()
+        self._buffer = bytearray()
+        self._file = None
+
+    @property
+    def sha256(self):
+        return self._hash.hexdigest()
+
+    @property
+    def on_disk(self):
+        return self._file is not None
+
+    async def write(self, data):
+        self._hash.update(data)
+        self.size += len(data)
+        self.peak_buffered_bytes = max(self.peak_buffered_bytes, len(self._buffer) + len(data))
+        self.peak_memory = max(self.peak_memory, self.peak_buffered_bytes)
+        if self._file is None and len(self._buffer) + len(data) > self._spool_bytes:
+            self._file = tempfile.TemporaryFile()
+            await run_in_threadpool(self._file.write, self._buffer)
+            self._buffer = bytearray()
+        if self._file is None:
+            self._buffer += data
+        else:
+            await run_in_threadpool(self._file.write, data)
+
+    @contextmanager
+    def contents(self):
+        """Conteúdo sem cópia: memoryview do buffer ou mmap do arquivo temporário."""
+        if self._file is None:
+            view = memoryview(self._buffer)
+            release = view.release
+        else:
+            self._file.flush()
+            view = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            release = view.close
+        token = _open_upload.set(self)
+        try:
+            yield view
+        finally:
+            _open_upload.reset(token)
+            release()
+
+    def _copied(self, nbytes):
+        self._copied_bytes += nbytes
+        self.peak_memory = max(self.peak_memory, len(self._buffer) + self._copied_bytes)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+        self._buffer = bytearray()
+
+
+@contextmanager
+def content_copy(nbytes):
+    """Registra, enquanto durar o bloco, uma cópia de ``nbytes`` do upload aberto.
+
+    Fora de SpooledUpload.contents (ex.: o worker, que recebe o PDF do Redis) não faz nada.
+    """
+    upload = _open_upload.get()
+    if upload is None or not nbytes:
+        yield
+        return
+    upload._copied(nbytes)
+    try:
+        yield
+    finally:
+        upload._copied(-nbytes)
+
+
+class _FilePartReader:
+    """Callbacks do parser: separa os bytes do campo ``field`` e descarta os demais."""
+
+    def __init__(self, field, spool_bytes):
+        self.field = field.encode()
+        self.spool_bytes = spool_bytes
+        self.upload = None
+        self.pending = []
+        self._reading = False
+        self._headers = {}
+        self._header_name = b""
+        self._header_value = b""
+
+    def callbacks(self):
+        return {
+            "on_part_begin": self.on_part_begin,
+            "on_header_field": self.on_header_field,
+            "on_header_value": self.on_header_value,
+            "on_header_end": self.on_header_end,
+            "on_headers_finished": self.on_headers_finished,
+            "on_part_data": self.on_part_data,
+        }
+
+    def on_part_begin(self):
+        self._headers = {}
+        self._reading = False
+
+    def on_header_field(self, data, start, end):
+        self._header_name += data[start:end]
+
+    def on_header_value(self, data, start, end):
+        self._header_value += data[start:end]
+
+    def on_header_end(self):
+        self._headers[self._header_name.lower()] = self._header_value
+        self._header_name = b""
+        self._header_value = b""
+
+    def on_headers_finished(self):
+        _, options = parse_options_header(self._headers.get(b"content-disposition", b""))
+        if self.upload is None and options.get(b"name") == self.field and b"filename" in options:
+            self.upload = SpooledUpload(
+                filename=options[b"filename"].decode("utf-8", "replace"),
+                content_type=self._headers.get(b"content-type", b"").decode("latin-1") or None,
+                spool_bytes=self.spool_bytes,
+            )
+            self._reading = True
+
+    def on_part_data(self, data, start, end):
+        if self._reading:
+            # Fatia sem cópia do chunk recebido; a única cópia é a gravação no spool
+            self.pending.append(memoryview(data)[start:end])
+
+
+async def receive_upload(request, field="file", max_bytes=INVOICE_MAX_UPLOAD_BYTES,
+                         spool_bytes=UPLOAD_SPOOL_MAX_MEMORY):
+    """Lê o arquivo do campo ``field`` de um multipart/form-data, direto do stream.
+
+    Levanta UploadTooLarge assim que o arquivo passa de ``max_bytes``, sem ler o
+    restante do corpo. Quem chama deve fechar o SpooledUpload retornado.
+    """
+    content_type, params = parse_options_header(request.headers.get("content-type", ""))
+    if content_type != b"multipart/form-data" or b"boundary" not in params:
+        raise UploadError("Envie o arquivo como multipart/form-data.")
+    declared = request.headers.get("content-length", "")
+    if declared.isdigit() and int(declared) - _MULTIPART_OVERHEAD > max_bytes:
+        raise UploadTooLarge(f"Arquivo maior que o limite de {max_bytes} bytes.")
+
+    reader = _FilePartReader(field, spool_bytes)
+    parser = MultipartParser(params[b"boundary"], reader.callbacks())
+    try:
+        async for chunk in request.stream():
+            parser.write(chunk)
+            # As gravações são assíncronas; os callbacks do parser só acumulam as fatias
+            for data in reader.pending:
+                if reader.upload.size + len(data) > max_bytes:
+                    raise UploadTooLarge(f"Arquivo maior que o limite de {max_bytes} bytes.")
+                await reader.upload.write(data)
+            reader.pending.clear()
+        parser.finalize()
+    except BaseException as e:
+        if reader.upload is not None:
+            reader.upload.close()
+        if isinstance(e, FormParserError):
+            raise UploadError("Corpo multipart inválido.") from e
+        raise
+    if reader.upload is None:
+        raise UploadError(f"Campo de arquivo '{field}' ausente.")
+    return reader.upload
@@ -7,7 +7,9 @@ import { SummaryCard } from './components/SummaryCard';
 function App() {
     const [summary, setSummary] = useState<Summary>({ income: 0, expense: 0, balance: 0 });
     const [transactions, setTransactions] = useState<Transaction[]>([]);
+    const [nextCursor, setNextCursor] = useState<string | undefined>();
     const [loading, setLoading] = useState<boolean>(true);
+    const [loadingMore, setLoadingMore] = useState<boolean>(false);
 
     useEffect(() => {
         // Função para buscar todos os dados iniciais
@@ -17,7 +19,8 @@ function App() {
                 const summaryRes = await getSummary();
                 const transactionsRes = await getTransactions();
                 setSummary(summaryRes);
-                setTransactions(transactionsRes);
+                setTransactions(transactionsRes.transactions);
+                setNextCursor(transactionsRes.nextCursor);
             } catch (error) {
                 console.error("Failed to fetch data", error);
             } finally {
@@ -28,17 +31,33 @@ function App() {
         fetchData();
     }, []);
 
+    // Os totais vêm de /api/summary; a lista volta para a primeira página
     const refreshData = async () => {
         try {
             const summaryRes = await getSummary();
             const transactionsRes = await getTransactions();
             setSummary(summaryRes);
-            setTransactions(transactionsRes);
+            setTransactions(transactionsRes.transactions);
+            setNextCursor(transactionsRes.nextCursor);
         } catch (error) {
             console.error("Failed to fetch data", error);
         }
     };
 
+    const loadMore = async () => {
+        if (!nextCursor || loadingMore) return;
+        try {
+            setLoadingMore(true);
+            const transactionsRes = await getTransactions(nextCursor);
+            setTransactions(current => [...current, ...transactionsRes.transactions]);
+            setNextCursor(transactionsRes.nextCursor);
+        } catch (error) {
+            console.error("Failed to fetch transactions", error);
+        } finally {
+            setLoadingMore(false);
+        }
+    };
+
     return (
         <div className="container mx-auto p-8">
             <h1 className="text-4xl font-bold text-center mb-8">🧠 Fintelli - Finanças Inteligentes com IA</h1>
@@ -72,7 +91,14 @@ function App() {
 
             {/* Lista de Transações */}
             <section>
-                <TransactionList transactions={transactions} onTransactionDeleted={refreshData} loading={loading} />
+                <TransactionList
+                    transactions={transactions}
+                    onTransactionDeleted={refreshData}
+                    loading={loading}
+                    hasMore={nextCursor !== undefined}
+                    loadingMore={loadingMore}
+                    onLoadMore={loadMore}
+                />
             </section>
         </div>
     );
@@ -1,4 +1,4 @@
-import React, { useState } from 'react';
+import React, { useRef, useState } from 'react';
 import * as api from '../services/api';
 
 interface TransactionFormProps {
@@ -11,6 +11,8 @@ export function TransactionForm({ onTransactionAdded }: TransactionFormProps) {
     const [type, setType] = useState<'income' | 'expense'>('income');
     const [date, setDate] = useState(new Date().toISOString().split('T')[0]);
     const [isSubmitting, setIsSubmitting] = useState(false);
+    // Chave do lançamento em envio: um novo envio dos mesmos dados (ex.: após um timeout) a reutiliza
+    const pendingSubmission = useRef<{ payload: string; key: string } | null>(null);
 
     console.log('TransactionForm mounted', { description, amount, type, date });
 
@@ -29,12 +31,19 @@ export function TransactionForm({ onTransactionAdded }: TransactionFormProps) {
 
         console.log('Sending transaction', { description, amount: finalAmount, transaction_date: date });
 
+        const transaction = {
+            description,
+            amount: finalAmount,
+            transaction_date: date,
+        };
+        const payload = JSON.stringify(transaction);
+        if (pendingSubmission.current?.payload !== payload) {
+            pendingSubmission.current = { payload, key: api.newIdempotencyKey() };
+        }
+
         try {
-            const result = await api.addTransaction({
-                description,
-                amount: finalAmount,
-                transaction_date: date,
-            });
+            const result = await api.addTransaction(transaction, pendingSubmission.current.key);
+            pendingSubmission.current = null;
 
             console.log('Transaction added successfully', result);
 
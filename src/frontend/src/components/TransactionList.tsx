@@ -5,9 +5,12 @@ interface TransactionListProps {
     transactions: api.Transaction[];
     onTransactionDeleted: () => void;
     loading: boolean;
+    hasMore: boolean;
+    loadingMore: boolean;
+    onLoadMore: () => void;
 }
 
-export function TransactionList({ transactions, onTransactionDeleted, loading }: TransactionListProps) {
+export function TransactionList({ transactions, onTransactionDeleted, loading, hasMore, loadingMore, onLoadMore }: TransactionListProps) {
 
     const handleDelete = async (id: number) => {
         if (window.confirm('Tem certeza que deseja apagar esta transação?')) {
@@ -48,6 +51,17 @@ export function TransactionList({ transactions, onTransactionDeleted, loading }:
                     );
                 })}
             </div>
+            {hasMore && (
+                <div className="text-center mt-4">
+                    <button
+                        onClick={onLoadMore}
+                        disabled={loadingMore}
+                        className="px-4 py-2 text-sm font-medium text-blue-600 hover:text-blue-800 disabled:text-gray-400"
+                    >
+                        {loadingMore ? 'Carregando...' : 'Carregar mais'}
+                    </button>
+                </div>
+            )}
         </div>
     );
 }
@@ -25,16 +25,33 @@ export const getSummary = async () => {
     return response.data;
 };
 
-export const getTransactions = async () => {
-    const response = await apiClient.get<Transaction[]>('/transactions');
-    return response.data;
+export interface TransactionsPage {
+    transactions: Transaction[];
+    // Cursor da próxima página (cabeçalho X-Next-Cursor); ausente na última
+    nextCursor?: string;
+}
+
+// Uma página por chamada; a seguinte só é pedida quando o usuário carrega mais
+export const getTransactions = async (after?: string): Promise<TransactionsPage> => {
+    const response = await apiClient.get<Transaction[]>('/transactions', { params: { after } });
+    return {
+        transactions: response.data,
+        nextCursor: (response.headers['x-next-cursor'] as string | undefined) || undefined,
+    };
 };
 
-export const addTransaction = async (transaction: Omit<Transaction, 'id'>) => {
-    const response = await apiClient.post<Transaction>('/transactions', transaction);
+// Reenvios com a mesma chave devolvem a transação já criada em vez de duplicá-la
+export const addTransaction = async (transaction: Omit<Transaction, 'id'>, idempotencyKey?: string) => {
+    const headers = idempotencyKey ? { 'Idempotency-Key': idempotencyKey } : undefined;
+    const response = await apiClient.post<Transaction>('/transactions', transaction, { headers });
     return response.data;
 };
 
+export const newIdempotencyKey = () =>
+    typeof crypto !== 'undefined' && typeof crypto.randomUUID === 'function'
+        ? crypto.randomUUID()
+        : `${Date.now().toString(36)}-${Math.random().toString(36).slice(2)}`;
+
 export const deleteTransaction = async (id: number) => {
     await apiClient.delete(`/transactions/${id}`);
 };
@@ -5,28 +5,44 @@ from fastapi.testclient import TestClient
 import psycopg2
 import redis
 import json
-from unittest.mock import patch, MagicMock
+import datetime
+from unittest.mock import patch, MagicMock, AsyncMock
 
 # Importa a aplicação principal
 import sys
 import os
 sys.path.append(os.path.join(os.path.dirname(__file__), '../../src/backend/app'))
 
+import main
 from main import app
 
 client = TestClient(app)
 
+@pytest.fixture(autouse=True)
+def clear_local_cache():
+    """Cada teste começa com o cache local (L1) vazio"""
+    import cache
+    cache.local_cache.clear()
+
+@pytest.fixture(autouse=True)
+def no_data_version():
+    """Sem versão dos dados (e sem ETag); os GETs condicionais têm testes próprios"""
+    with patch('main.data_version', AsyncMock(return_value=None)):
+        yield
+
+def configure_database(mock_db, rows=None, row=None, rowcount=1):
+    """Configura o substituto da camada de acesso a dados (main.db)"""
+    mock_db.fetch_all = AsyncMock(return_value=rows if rows is not None else [])
+    mock_db.fetch_one = AsyncMock(return_value=row)
+    mock_db.execute = AsyncMock(return_value=rowcount)
+
 class TestTransactionsAPI:
     """Testes para endpoints de transações"""
     
     def test_get_summary_empty_database(self):
         """Testa o resumo com banco vazio"""
-        with patch('main.get_db_connection') as mock_db:
-            mock_conn = MagicMock()
-            mock_cursor = MagicMock()
-            mock_cursor.fetchall.return_value = []
-            mock_conn.cursor.return_value.__enter__.return_value = mock_cursor
-            mock_db.return_value = mock_conn
+        with patch('main.db') as mock_db:
+            configure_database(mock_db, row={'income': 0, 'expense': 0, 'transactions_count': 0})
             
             response = client.get("/api/summary")
             assert response.status_code == 200
@@ -35,16 +51,9 @@ class TestTransactionsAPI:
 
     def test_get_summary_with_transactions(self):
         """Testa o resumo com transações"""
-        with patch('main.get_db_connection') as mock_db:
-            mock_conn = MagicMock()
-            mock_cursor = MagicMock()
-            # Simula transações: receita de 1000 e despesa de -500
-            mock_cursor.fetchall.return_value = [
-                {'amount': 1000.00},
-                {'amount': -500.00}
-            ]
-            mock_conn.cursor.return_value.__enter__.return_value = mock_cursor
-            mock_db.return_value = mock_conn
+        with patch('main.db') as mock_db:
+            # Simula os totais agregados no banco: receita de 1000 e despesa de -500
+            configure_database(mock_db, row={'income': 1000.00, 'expense': -500.00, 'transactions_count': 2})
             
             response = client.get("/api/summary")
             assert response.status_code == 200
@@ -55,27 +64,65 @@ class TestTransactionsAPI:
 
     def test_get_transactions_empty(self):
         """Testa listagem de transações vazia"""
-        with patch('main.get_db_connection') as mock_db:
-            mock_conn = MagicMock()
-            mock_cursor = MagicMock()
-            mock_cursor.fetchall.return_value = []
-            mock_conn.cursor.return_value.__enter__.return_value = mock_cursor
-            mock_db.return_value = mock_conn
+        with patch('main.db') as mock_db:
+            configure_database(mock_db, rows=[])
             
             response = client.get("/api/transactions")
             assert response.status_code == 200
             assert response.json() == []
 
+    def test_get_transactions_keyset_pagination(self):
+        """Testa a paginação por cursor (transaction_date DESC, id DESC)"""
+        rows = [
+            {'id': 3, 'description': 'C', 'amount': -30, 'transaction_date': '2024-06-03'},
+            {'id': 2, 'description': 'B', 'amount': -20, 'transaction_date': '2024-06-02'},
+            {'id': 1, 'description': 'A', 'amount': 10, 'transaction_date': '2024-06-01'},
+        ]
+        with patch('main.db') as mock_db:
+            configure_database(mock_db, rows=rows)
+            
+            response = client.get("/api/transactions?limit=2")
+            assert response.status_code == 200
+            assert [t["id"] for t in response.json()] == [3, 2]
+            
+            cursor = response.headers["X-Next-Cursor"]
+            assert main.decode_cursor(cursor) == (datetime.date(2024, 6, 2), 2)
+            
+            configure_database(mock_db, rows=rows[2:])
+            response = client.get(f"/api/transactions?limit=2&after={cursor}")
+            assert [t["id"] for t in response.json()] == [1]
+            assert "X-Next-Cursor" not in response.headers
+            query, params = mock_db.fetch_all.call_args.args
+            assert "(transactions.transaction_date, id) < (%s, %s)" in query
+            assert params == (datetime.date(2024, 6, 2), 2, 3)
+
+    def test_get_transactions_invalid_cursor(self):
+        """Testa cursor de paginação inválido"""
+        response = client.get("/api/transactions?after=invalido")
+        assert response.status_code == 400
+
+    def test_stream_transactions_ndjson(self):
+        """Testa a exportação em NDJSON por lotes"""
+        async def batches(query, params):
+            yield [{'id': 2, 'description': 'B', 'amount': -20, 'transaction_date': '2024-06-02'}]
+            yield [{'id': 1, 'description': 'A', 'amount': 10, 'transaction_date': '2024-06-01'}]
+        
+        with patch('main.db') as mock_db:
+            mock_db.stream_batches = batches
+            
+            response = client.get("/api/transactions/stream")
+            assert response.status_code == 200
+            assert response.headers["content-type"].startswith("application/x-ndjson")
+            lines = [json.loads(line) for line in response.text.splitlines()]
+            assert [t["id"] for t in lines] == [2, 1]
+            assert lines[1]["amount"] == 10.0
+
     def test_add_transaction_success(self):
         """Testa adição de transação com sucesso"""
-        with patch('main.get_db_connection') as mock_db, \
-             patch('main.invalidate_summary_cache') as mock_cache:
+        with patch('main.db') as mock_db, \
+             patch('main.summary_write') as mock_cache:
             
-            mock_conn = MagicMock()
-            mock_cursor = MagicMock()
-            mock_cursor.fetchone.return_value = {'id': 1}
-            mock_conn.cursor.return_value.__enter__.return_value = mock_cursor
-            mock_db.return_value = mock_conn
+            configure_database(mock_db, row={'id': 1})
             
             transaction_data = {
                 "description": "Salário",
@@ -103,28 +150,63 @@ class TestTransactionsAPI:
 
     def test_delete_transaction_success(self):
         """Testa remoção de transação com sucesso"""
-        with patch('main.get_db_connection') as mock_db, \
-             patch('main.invalidate_summary_cache') as mock_cache:
+        with patch('main.db') as mock_db, \
+             patch('main.summary_write') as mock_cache:
             
-            mock_conn = MagicMock()
-            mock_cursor = MagicMock()
-            mock_conn.cursor.return_value.__enter__.return_value = mock_cursor
-            mock_db.return_value = mock_conn
+            configure_database(mock_db)
             
             response = client.delete("/api/transactions/1")
             assert response.status_code == 204
 
+class TestBatchAPI:
+    """Testes para as rotas de criação e remoção em lote"""
+    
+    def test_batch_create_returns_ids_in_order(self):
+        """O lote é inserido de uma vez e cada item recebe seu id"""
+        with patch('main.db') as mock_db, \
+             patch('main.summary_write') as mock_write:
+            mock_db.insert_rows = AsyncMock(return_value=[{'id': 7}, {'id': 8}])
+            
+            response = client.post("/api/transactions/batch", json=[
+                {"description": "Salário", "amount": 5000, "transaction_date": "2024-06-01"},
+                {"description": "Mercado", "amount": -300, "transaction_date": "2024-06-02"},
+            ])
+            
+            assert response.status_code == 201
+            assert [t["id"] for t in response.json()] == [7, 8]
+            mock_db.insert_rows.assert_awaited_once()
+            mock_write.assert_called_once()
+    
+    def test_batch_delete_reports_each_id(self):
+        """Ids inexistentes aparecem como não removidos; duplicados são ignorados"""
+        with patch('main.db') as mock_db, \
+             patch('main.summary_write') as mock_write:
+            configure_database(mock_db, rows=[{'id': 1, 'amount': 10}])
+            
+            response = client.post("/api/transactions/batch-delete", json={"ids": [1, 2, 1]})
+            
+            assert response.json() == {
+                "deleted": 1,
+                "results": [{"id": 1, "deleted": True}, {"id": 2, "deleted": False}],
+            }
+            query, params = mock_db.fetch_all.call_args.args
+            assert "ANY(%s)" in query
+            assert params == ([1, 2],)
+            mock_write.assert_called_once()
+    
+    def test_batch_size_limit(self):
+        """Lotes acima do limite são recusados"""
+        with patch('main.db'), patch('main.TRANSACTIONS_BATCH_MAX_ITEMS', 1):
+            response = client.post("/api/transactions/batch-delete", json={"ids": [1, 2]})
+            assert response.status_code == 400
+
 class TestFixedExpensesAPI:
     """Testes para endpoints de gastos fixos"""
     
     def test_get_fixed_expenses_empty(self):
         """Testa listagem de gastos fixos vazia"""
-        with patch('main.get_db_connection') as mock_db:
-            mock_conn = MagicMock()
-            mock_cursor = MagicMock()
-            mock_cursor.fetchall.return_value = []
-            mock_conn.cursor.return_value.__enter__.return_value = mock_cursor
-            mock_db.return_value = mock_conn
+        with patch('main.db') as mock_db:
+            configure_database(mock_db, rows=[])
             
             response = client.get("/api/fixed-expenses")
             assert response.status_code == 200
@@ -132,12 +214,8 @@ class TestFixedExpensesAPI:
 
     def test_add_fixed_expense_success(self):
         """Testa adição de gasto fixo com sucesso"""
-        with patch('main.get_db_connection') as mock_db:
-            mock_conn = MagicMock()
-            mock_cursor = MagicMock()
-            mock_cursor.fetchone.return_value = {'id': 1}
-            mock_conn.cursor.return_value.__enter__.return_value = mock_cursor
-            mock_db.return_value = mock_conn
+        with patch('main.db') as mock_db:
+            configure_database(mock_db, row={'id': 1})
             
             expense_data = {
                 "description": "Internet",
@@ -156,10 +234,9 @@ class TestCacheIntegration:
     
     def test_cache_summary_hit(self):
         """Testa cache hit no resumo"""
-        with patch('main.redis_client') as mock_redis:
-            # Simula cache hit
-            cached_data = '{"income": 1000, "expense": -500, "balance": 500}'
-            mock_redis.get.return_value = cached_data
+        with patch('cache.redis_client', new_callable=AsyncMock) as mock_redis:
+            # Simula cache hit (hash com receita e despesa)
+            mock_redis.hgetall.return_value = {"income": "1000", "expense": "-500"}
             
             response = client.get("/api/summary")
             assert response.status_code == 200
@@ -168,23 +245,109 @@ class TestCacheIntegration:
 
     def test_cache_summary_miss(self):
         """Testa cache miss no resumo"""
-        with patch('main.redis_client') as mock_redis, \
-             patch('main.get_db_connection') as mock_db:
+        with patch('cache.redis_client', new_callable=AsyncMock) as mock_redis, \
+             patch('main.db') as mock_db:
             
             # Simula cache miss
+            mock_redis.hgetall.return_value = {}
             mock_redis.get.return_value = None
             
             # Simula resposta do banco
-            mock_conn = MagicMock()
-            mock_cursor = MagicMock()
-            mock_cursor.fetchall.return_value = [{'amount': 1000.00}]
-            mock_conn.cursor.return_value.__enter__.return_value = mock_cursor
-            mock_db.return_value = mock_conn
+            configure_database(mock_db, row={'income': 1000.00, 'expense': 0, 'transactions_count': 1})
             
             response = client.get("/api/summary")
             assert response.status_code == 200
-            # Verifica se o cache foi populado
-            mock_redis.set.assert_called_once()
+            # Verifica se o cache foi populado (script Lua de gravação condicional)
+            mock_redis.evalsha.assert_called_once()
+
+    def test_stale_summary_served_while_revalidating(self):
+        """Com SWR o valor expirado é servido e o recálculo vai para segundo plano"""
+        with patch('cache.redis_client', new_callable=AsyncMock) as mock_redis, \
+             patch('main.SUMMARY_STALE_WHILE_REVALIDATE', 30), \
+             patch('main.schedule_summary_refresh') as mock_refresh, \
+             patch('main.db') as mock_db:
+            mock_redis.hgetall.return_value = {"income": "10", "expense": "-5", "expires_at": "0", "compute_time": "0.1"}
+            configure_database(mock_db)
+            
+            response = client.get("/api/summary")
+            assert response.json()["balance"] == 5
+            mock_refresh.assert_called_once()
+            mock_db.fetch_one.assert_not_called()
+
+class TestSummaryAggregate:
+    """Testes para a agregação do resumo no banco"""
+    
+    def test_summary_uses_sql_aggregation(self):
+        """O resumo é somado no PostgreSQL, sem trazer as linhas para o Python"""
+        with patch('main.db') as mock_db, \
+             patch('cache.redis_client', new_callable=AsyncMock) as mock_redis:
+            mock_redis.hgetall.return_value = {}
+            mock_redis.get.return_value = None
+            configure_database(mock_db, row={'income': 10, 'expense': -4, 'transactions_count': 3})
+            
+            response = client.get("/api/summary")
+            assert response.json() == {"income": 10.0, "expense": -4.0, "balance": 6.0}
+            query = mock_db.fetch_one.call_args.args[0]
+            assert "FILTER (WHERE amount > 0)" in query
+            mock_db.fetch_all.assert_not_called()
+    
+    def test_summary_table_mode(self):
+        """No modo 'table' o resumo vem da tabela mantida por trigger"""
+        import summary
+        with patch('summary.SUMMARY_AGGREGATE', 'table'):
+            query, table = summary.summary_source()
+            assert table == "transactions_summary"
+            assert query == summary.SUMMARY_TABLE_QUERY
+
+class TestPeriodSummary:
+    """Testes para o resumo por período (rollup diário)"""
+    
+    def test_period_starts_fill_gaps(self):
+        """Todos os períodos do intervalo aparecem, inclusive os vazios"""
+        from summary import period_starts
+        days = list(period_starts(datetime.date(2024, 1, 30), datetime.date(2024, 3, 2), "month"))
+        assert days == [datetime.date(2024, 1, 1), datetime.date(2024, 2, 1), datetime.date(2024, 3, 1)]
+        weeks = list(period_starts(datetime.date(2024, 1, 3), datetime.date(2024, 1, 15), "week"))
+        assert weeks[0] == datetime.date(2024, 1, 1)
+        assert len(weeks) == 3
+    
+    def test_period_summary_from_rollup(self):
+        """O resumo vem de transactions_daily e é gravado sob a própria chave"""
+        with patch('main.db') as mock_db, \
+             patch('cache.redis_client', new_callable=AsyncMock) as mock_redis:
+            mock_redis.get.return_value = None
+            configure_database(mock_db, rows=[
+                {'period_start': datetime.date(2024, 2, 1), 'income': 100, 'expense': -40, 'transactions_count': 3},
+            ])
+            
+            response = client.get("/api/summary/period?from=2024-01-15&to=2024-02-20&granularity=month")
+            
+            data = response.json()
+            assert [p["period_start"] for p in data["periods"]] == ["2024-01-01", "2024-02-01"]
+            assert data["periods"][0]["transactions_count"] == 0
+            assert data["total"] == {"income": 100.0, "expense": -40.0, "balance": 60.0, "transactions_count": 3}
+            assert "transactions_daily" in mock_db.fetch_all.call_args.args[0]
+            key = mock_redis.set.call_args.args[0]
+            assert key.startswith("financial_summary:period:")
+            assert key.endswith(":month:2024-01-15:2024-02-20")
+    
+    def test_period_summary_cache_hit(self):
+        """Um resultado em cache não consulta o banco"""
+        with patch('main.db') as mock_db, \
+             patch('cache.redis_client', new_callable=AsyncMock) as mock_redis:
+            mock_redis.get.side_effect = ["3", json.dumps({"periods": [], "total": {"balance": 1}})]
+            configure_database(mock_db)
+            
+            response = client.get("/api/summary/period?from=2024-01-01&to=2024-01-31&granularity=day")
+            
+            assert response.json()["total"]["balance"] == 1
+            mock_db.fetch_all.assert_not_called()
+    
+    def test_period_summary_validation(self):
+        """Granularidade, ordem das datas e número de períodos são validados"""
+        assert client.get("/api/summary/period?from=2024-01-01&to=2024-02-01&granularity=year").status_code == 400
+        assert client.get("/api/summary/period?from=2024-02-01&to=2024-01-01").status_code == 400
+        assert client.get("/api/summary/period?from=2000-01-01&to=2024-01-01&granularity=day").status_code == 400
 
 class TestDatabaseIntegration:
     """Testes para integração com PostgreSQL"""
@@ -198,12 +361,15 @@ class TestDatabaseIntegration:
 
     def test_database_connection(self):
         """Testa conexão com o banco"""
-        with patch('main.psycopg2.connect') as mock_connect:
-            mock_connect.return_value = MagicMock()
+        with patch('database.psycopg2.connect') as mock_connect:
+            mock_connect.return_value = MagicMock(closed=0)
             
-            from main import get_db_connection
-            conn = get_db_connection()
-            assert conn is not None
+            from database import get_db_connection
+            with get_db_connection() as conn:
+                assert conn is not None
+            # A segunda requisição reaproveita a conexão do pool
+            with get_db_connection() as conn:
+                assert conn is not None
             mock_connect.assert_called_once()
 
 class TestOpenTelemetryInstrumentation:
@@ -218,12 +384,8 @@ class TestOpenTelemetryInstrumentation:
                 "transaction_date": "2024-06-14"
             }
             
-            with patch('main.get_db_connection') as mock_db:
-                mock_conn = MagicMock()
-                mock_cursor = MagicMock()
-                mock_cursor.fetchone.return_value = {'id': 1}
-                mock_conn.cursor.return_value.__enter__.return_value = mock_cursor
-                mock_db.return_value = mock_conn
+            with patch('main.db') as mock_db:
+                configure_database(mock_db, row={'id': 1})
                 
                 response = client.post("/api/transactions", json=transaction_data)
                 assert response.status_code == 201
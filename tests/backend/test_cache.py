@@ -0,0 +1,250 @@
+"""
+Testes para o cache write-through do resumo financeiro (scripts Lua no Redis)
+"""
+import pytest
+import asyncio
+import time
+from unittest.mock import patch
+
+import fakeredis.aioredis
+
+import sys
+import os
+sys.path.append(os.path.join(os.path.dirname(__file__), '../../src/backend/app'))
+
+import cache
+
+
+@pytest.fixture
+def fake_redis():
+    client = fakeredis.aioredis.FakeRedis(decode_responses=True)
+    cache.local_cache.clear()
+    with patch('cache.redis_client', client):
+        yield client
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+class TestSummaryWriteThrough:
+    """Testes para o resumo mantido por deltas"""
+
+    def test_store_and_read_summary(self, fake_redis):
+        """Um recálculo sem escritas concorrentes é gravado e lido do hash"""
+        async def scenario():
+            generation = await cache.summary_generation()
+            stored = await cache.store_summary({"income": 100.0, "expense": -40.0, "balance": 60.0}, generation)
+            return stored, await cache.get_cached_summary()
+
+        stored, (summary, freshness) = run(scenario())
+        assert stored is True
+        assert summary == {"income": 100.0, "expense": -40.0, "balance": 60.0}
+        assert freshness == "fresh"
+
+    def test_writes_update_cached_summary(self, fake_redis):
+        """Inserções e remoções são aplicadas no resumo em cache"""
+        async def scenario():
+            await cache.store_summary({"income": 100.0, "expense": -40.0, "balance": 60.0}, "0")
+            async with cache.summary_write() as write:
+                write.added([50, -10])
+            async with cache.summary_write() as write:
+                write.removed([100])
+            return await cache.get_cached_summary()
+
+        assert run(scenario())[0] == {"income": 50.0, "expense": -50.0, "balance": 0.0}
+
+    def test_recompute_discarded_during_pending_write(self, fake_redis):
+        """Um recálculo concorrente com uma escrita não é gravado"""
+        async def scenario():
+            generation = await cache.summary_generation()
+            async with cache.summary_write() as write:
+                # Escrita ainda em andamento: o valor lido do banco pode não incluí-la
+                stored_during = await cache.store_summary({"income": 1.0, "expense": 0.0, "balance": 1.0}, generation)
+                write.added([1])
+            stored_after = await cache.store_summary({"income": 1.0, "expense": 0.0, "balance": 1.0}, generation)
+            return stored_during, stored_after, await cache.get_cached_summary()
+
+        stored_during, stored_after, (summary, _) = run(scenario())
+        assert stored_during is False
+        assert stored_after is False
+        assert summary is None
+
+    def test_failed_write_releases_pending(self, fake_redis):
+        """Uma escrita com erro não bloqueia recálculos seguintes"""
+        async def scenario():
+            with pytest.raises(RuntimeError):
+                async with cache.summary_write():
+                    raise RuntimeError("falha no banco")
+            generation = await cache.summary_generation()
+            return await cache.store_summary({"income": 0.0, "expense": 0.0, "balance": 0.0}, generation)
+
+        assert run(scenario()) is True
+
+    def test_redis_failure_after_commit_does_not_fail_the_write(self, fake_redis, capsys):
+        """Com o Redis fora depois do commit a escrita conclui e o cache local é descartado"""
+        async def scenario():
+            await cache.store_summary({"income": 10.0, "expense": 0.0, "balance": 10.0}, "0")
+            await cache.get_cached_summary()
+            async with cache.summary_write() as write:
+                write.added([5.0])
+                fake_redis.evalsha = fake_redis.delete = fake_redis.publish = unavailable
+
+        async def unavailable(*args, **kwargs):
+            raise cache.redis.ConnectionError("Redis indisponível")
+
+        run(scenario())
+        assert "Falha ao descartar o resumo em cache" in capsys.readouterr().out
+        assert cache.local_cache.get(cache.SUMMARY_CACHE_KEY) is None
+
+    def test_legacy_string_key_is_a_miss(self, fake_redis):
+        """O formato antigo (string JSON) é tratado como miss e substituído"""
+        async def scenario():
+            await fake_redis.set(cache.SUMMARY_CACHE_KEY, '{"income": 1}')
+            missed, _ = await cache.get_cached_summary()
+            await cache.store_summary({"income": 2.0, "expense": 0.0, "balance": 2.0}, "0")
+            summary, _ = await cache.get_cached_summary()
+            return missed, summary
+
+        missed, summary = run(scenario())
+        assert missed is None
+        assert summary["income"] == 2.0
+
+
+class TestStampedeProtection:
+    """Testes para single-flight, stale-while-revalidate e expiração antecipada"""
+
+    def test_single_flight_coalesces_concurrent_calls(self):
+        """Chamadas concorrentes executam a função uma única vez"""
+        calls = []
+
+        async def compute():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return 42
+
+        async def scenario():
+            flight = cache.SingleFlight()
+            return await asyncio.gather(*(flight.run("k", compute) for _ in range(10)))
+
+        results = run(scenario())
+        assert len(calls) == 1
+        assert all(result == 42 for result, _ in results)
+        assert sum(coalesced for _, coalesced in results) == 9
+
+    def test_single_flight_propagates_errors(self):
+        """Um erro chega a todos os que aguardavam e libera a chave"""
+        async def fail():
+            await asyncio.sleep(0.01)
+            raise RuntimeError("banco indisponível")
+
+        async def scenario():
+            flight = cache.SingleFlight()
+            results = await asyncio.gather(*(flight.run("k", fail) for _ in range(3)), return_exceptions=True)
+            return results, flight.in_flight("k")
+
+        results, in_flight = run(scenario())
+        assert all(isinstance(result, RuntimeError) for result in results)
+        assert in_flight is False
+
+    def test_freshness(self):
+        """Valores são frescos até expires_at e stale depois"""
+        values = {"income": "1", "expense": "0", "expires_at": "100", "compute_time": "0.5"}
+        assert cache.summary_freshness(values, now=50) == "fresh"
+        assert cache.summary_freshness(values, now=100) == "stale"
+        assert cache.summary_freshness({"income": "1", "expense": "0"}, now=1e12) == "fresh"
+
+    def test_early_expiration_near_expiry(self):
+        """Com XFetch, um recálculo caro perto da expiração é antecipado"""
+        values = {"income": "1", "expense": "0", "expires_at": "100", "compute_time": "1000"}
+        with patch('cache.SUMMARY_EARLY_EXPIRATION_BETA', 1.0), patch('cache.random.random', return_value=0.5):
+            assert cache.summary_freshness(values, now=99) == "early"
+            assert cache.summary_freshness({**values, "compute_time": "0"}, now=99) == "fresh"
+
+    def test_stale_value_kept_during_revalidate_window(self, fake_redis):
+        """Com SWR a chave sobrevive ao TTL lógico pela janela configurada"""
+        async def scenario():
+            with patch('cache.SUMMARY_CACHE_TTL', 10), patch('cache.SUMMARY_STALE_WHILE_REVALIDATE', 30):
+                await cache.store_summary({"income": 1.0, "expense": 0.0, "balance": 1.0}, "0")
+            return await fake_redis.ttl(cache.SUMMARY_CACHE_KEY)
+
+        assert 30 < run(scenario()) <= 40
+
+    def test_redis_lock_is_exclusive(self, fake_redis):
+        """Só um worker obtém o lock; ele é liberado ao sair"""
+        async def scenario():
+            async with cache.redis_lock("lock", 5) as first:
+                async with cache.redis_lock("lock", 5) as second:
+                    pass
+            async with cache.redis_lock("lock", 5) as third:
+                pass
+            return first, second, third
+
+        assert run(scenario()) == (True, False, True)
+
+
+class TestLocalCache:
+    """Testes para a camada local (L1) em frente ao Redis"""
+
+    def test_lru_evicts_least_recently_used(self):
+        """Acima do limite a entrada usada há mais tempo é descartada"""
+        local = cache.LocalCache(max_entries=2, ttl=60)
+        local.set("a", 1, local.epoch)
+        local.set("b", 2, local.epoch)
+        local.get("a")
+        local.set("c", 3, local.epoch)
+
+        assert local.get("a") == 1
+        assert local.get("b") is None
+        assert local.get("c") == 3
+
+    def test_entries_expire(self):
+        """Entradas vencidas são tratadas como miss"""
+        local = cache.LocalCache(max_entries=10, ttl=60)
+        local.set("a", 1, local.epoch)
+        with patch('cache.time.monotonic', return_value=time.monotonic() + 61):
+            assert local.get("a") is None
+
+    def test_set_after_invalidation_is_ignored(self):
+        """Um valor lido do Redis antes de uma invalidação não é guardado"""
+        local = cache.LocalCache(max_entries=10, ttl=60)
+        epoch = local.epoch
+        local.invalidate("a")
+        assert local.set("a", 1, epoch) is False
+        assert local.get("a") is None
+
+    def test_reads_are_served_locally(self, fake_redis):
+        """A segunda leitura não vai ao Redis"""
+        async def scenario():
+            await cache.store_summary({"income": 5.0, "expense": 0.0, "balance": 5.0}, "0")
+            await cache.get_cached_summary()
+            await fake_redis.hset(cache.SUMMARY_CACHE_KEY, "income", "999")
+            return await cache.get_cached_summary()
+
+        summary, _ = run(scenario())
+        assert summary["income"] == 5.0
+
+    def test_write_invalidates_both_tiers(self, fake_redis):
+        """Uma escrita descarta a cópia local e publica a invalidação"""
+        async def scenario():
+            pubsub = fake_redis.pubsub()
+            await pubsub.subscribe(cache.CACHE_INVALIDATION_CHANNEL)
+            await cache.store_summary({"income": 5.0, "expense": 0.0, "balance": 5.0}, "0")
+            await cache.get_cached_summary()
+            async with cache.summary_write() as write:
+                write.added([10])
+            summary, _ = await cache.get_cached_summary()
+            messages = []
+            for _ in range(5):
+                message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=0.05)
+                if message is not None:
+                    messages.append(message["data"])
+            return summary, messages
+
+        summary, messages = run(scenario())
+        assert summary["income"] == 15.0
+        assert any(message.endswith(" " + cache.SUMMARY_CACHE_KEY) for message in messages)
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
@@ -0,0 +1,144 @@
+"""
+Testes para os GETs condicionais (ETag / If-None-Match) de transações e resumo
+"""
+import pytest
+import asyncio
+from unittest.mock import patch, AsyncMock, MagicMock
+
+import fakeredis.aioredis
+from fastapi.testclient import TestClient
+
+import sys
+import os
+sys.path.append(os.path.join(os.path.dirname(__file__), '../../src/backend/app'))
+
+import cache
+from main import app, etag_matches
+from cache import summary_write, data_version
+
+client = TestClient(app)
+
+ROWS = [{'id': 1, 'description': 'Mercado', 'amount': -50, 'transaction_date': '2024-06-01'}]
+
+
+@pytest.fixture
+def fake_redis():
+    fake = fakeredis.aioredis.FakeRedis(decode_responses=True)
+    cache.local_cache.clear()
+    with patch('cache.redis_client', fake):
+        yield fake
+
+
+@pytest.fixture
+def mock_db():
+    with patch('main.db') as db:
+        db.fetch_all = AsyncMock(return_value=ROWS)
+        db.fetch_one = AsyncMock(return_value={'income': 0, 'expense': -50, 'transactions_count': 1})
+        yield db
+
+
+def write():
+    async def scenario():
+        async with summary_write() as pending:
+            pending.added([-10])
+    asyncio.run(scenario())
+
+
+class TestTransactionsETag:
+    """Testes para GET /api/transactions condicional"""
+
+    def test_unchanged_poll_returns_304(self, fake_redis, mock_db):
+        """Com a ETag atual a resposta é 304 e o banco não é consultado"""
+        first = client.get("/api/transactions")
+        etag = first.headers["etag"]
+        assert first.headers["cache-control"] == "no-cache"
+
+        second = client.get("/api/transactions", headers={"If-None-Match": etag})
+        assert second.status_code == 304
+        assert second.headers["etag"] == etag
+        assert second.content == b""
+        assert mock_db.fetch_all.await_count == 1
+
+    def test_write_changes_etag(self, fake_redis, mock_db):
+        """Uma escrita em transactions muda a ETag e a próxima leitura vem completa"""
+        etag = client.get("/api/transactions").headers["etag"]
+        write()
+        response = client.get("/api/transactions", headers={"If-None-Match": etag})
+        assert response.status_code == 200
+        assert response.headers["etag"] != etag
+        assert mock_db.fetch_all.await_count == 2
+
+    def test_replica_after_recent_write_is_untagged(self, fake_redis, mock_db):
+        """Logo após uma escrita, leituras servidas por uma réplica saem sem ETag"""
+        replica = MagicMock()
+        replica.fetch_all = AsyncMock(return_value=ROWS)
+        write()
+        with patch('main.read_db', return_value=replica):
+            response = client.get("/api/transactions")
+        assert response.status_code == 200
+        assert "etag" not in response.headers
+        with patch('main.read_db', return_value=replica), patch('main.DB_REPLICA_MAX_LAG', 0):
+            assert "etag" in client.get("/api/transactions").headers
+
+
+class TestSummaryETag:
+    """Testes para GET /api/summary condicional"""
+
+    def test_unchanged_summary_returns_304(self, fake_redis, mock_db):
+        """O 304 dispensa até a leitura do resumo em cache"""
+        first = client.get("/api/summary")
+        assert first.json()["balance"] == -50
+        etag = first.headers["etag"]
+        assert etag != client.get("/api/transactions").headers["etag"]
+
+        with patch('main.get_cached_summary') as cached:
+            response = client.get("/api/summary", headers={"If-None-Match": f'W/{etag}, "outra"'})
+        assert response.status_code == 304
+        cached.assert_not_called()
+
+    def test_lost_generation_does_not_reuse_etag(self, fake_redis):
+        """Se o Redis perde os dados a geração recomeça, mas a época nova muda a versão"""
+        before, _ = asyncio.run(data_version())
+        asyncio.run(fake_redis.flushall())
+        # Sem escrita não há invalidação: a versão antiga vale no L1 até o LOCAL_CACHE_TTL
+        cache.local_cache.clear()
+        after, _ = asyncio.run(data_version())
+        assert before.endswith(".0") and after.endswith(".0")
+        assert before != after
+
+
+    def test_local_hit_skips_redis(self, fake_redis, mock_db):
+        """Com o resumo e a versão no cache local a leitura não vai ao Redis"""
+        client.get("/api/summary")
+        # O recálculo invalida o L1; a segunda leitura o preenche a partir do Redis
+        etag = client.get("/api/summary").headers["etag"]
+        with patch('cache.redis_client') as unavailable:
+            response = client.get("/api/summary")
+            conditional = client.get("/api/summary", headers={"If-None-Match": etag})
+        assert response.status_code == 200 and response.headers["etag"] == etag
+        assert conditional.status_code == 304
+        assert unavailable.method_calls == []
+
+        write()
+        assert client.get("/api/summary", headers={"If-None-Match": etag}).status_code == 200
+
+
+class TestIfNoneMatch:
+    """Testes para a comparação do cabeçalho If-None-Match"""
+
+    @pytest.mark.parametrize("header,matches", [
+        ('"transactions-a.1"', True),
+        ('W/"transactions-a.1"', True),
+        ('"x", "transactions-a.1"', True),
+        ('*', True),
+        ('"transactions-a.2"', False),
+        (None, False),
+    ])
+    def test_etag_matches(self, header, matches):
+        request = MagicMock()
+        request.headers = {"if-none-match": header} if header else {}
+        assert etag_matches(request, '"transactions-a.1"') is matches
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
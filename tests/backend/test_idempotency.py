@@ -0,0 +1,116 @@
+"""
+Testes para o suporte a Idempotency-Key nas rotas de criação de transações
+"""
+import pytest
+import asyncio
+import json
+from unittest.mock import patch, AsyncMock, MagicMock
+
+import fakeredis.aioredis
+import redis
+from fastapi.testclient import TestClient
+
+import sys
+import os
+sys.path.append(os.path.join(os.path.dirname(__file__), '../../src/backend/app'))
+
+from main import app
+from database import PoolTimeout
+from idempotency import IDEMPOTENCY_KEY_PREFIX, request_fingerprint
+
+client = TestClient(app)
+
+TRANSACTION = {"description": "Salário", "amount": 5000.0, "transaction_date": "2024-06-14"}
+
+
+@pytest.fixture
+def fake_redis():
+    fake = fakeredis.aioredis.FakeRedis(decode_responses=True)
+    with patch('cache.redis_client', fake):
+        yield fake
+
+
+@pytest.fixture
+def mock_db():
+    with patch('main.db') as db, patch('main.summary_write') as write:
+        db.fetch_one = AsyncMock(return_value={'id': 1})
+        db.write = write
+        yield db
+
+
+def post(body=TRANSACTION, key="chave-1", path="/api/transactions"):
+    return client.post(path, json=body, headers={"Idempotency-Key": key} if key else {})
+
+
+class TestIdempotencyKey:
+    """Testes para POST /api/transactions com Idempotency-Key"""
+
+    def test_replay_skips_database(self, fake_redis, mock_db):
+        """A repetição devolve a resposta gravada sem inserir de novo nem mexer no resumo"""
+        first = post()
+        replay = post()
+        assert first.status_code == replay.status_code == 201
+        assert replay.json() == first.json() == {**TRANSACTION, "id": 1}
+        assert replay.headers["idempotent-replayed"] == "true"
+        assert "idempotent-replayed" not in first.headers
+        assert mock_db.fetch_one.await_count == 1
+        assert mock_db.write.call_count == 1
+
+    def test_different_keys_are_independent(self, fake_redis, mock_db):
+        """Chaves diferentes (ou nenhuma chave) criam transações distintas"""
+        post(key="a")
+        post(key="b")
+        post(key=None)
+        assert mock_db.fetch_one.await_count == 3
+
+    def test_key_reused_with_other_body(self, fake_redis, mock_db):
+        """A mesma chave com outro corpo é recusada com 422"""
+        post()
+        response = post({**TRANSACTION, "amount": 10.0})
+        assert response.status_code == 422
+        assert mock_db.fetch_one.await_count == 1
+
+    def test_request_in_progress(self, fake_redis, mock_db):
+        """Enquanto a primeira requisição não termina, a repetição recebe 409"""
+        pending = {"state": "pending", "fingerprint": request_fingerprint({**TRANSACTION, "id": None}), "token": "x"}
+        asyncio.run(fake_redis.set(f"{IDEMPOTENCY_KEY_PREFIX}transactions:chave-1", json.dumps(pending)))
+        response = post()
+        assert response.status_code == 409
+        assert response.headers["retry-after"] == "1"
+        mock_db.fetch_one.assert_not_awaited()
+
+    def test_failure_releases_key(self, fake_redis, mock_db):
+        """Uma falha libera a chave: a nova tentativa executa e grava a resposta"""
+        mock_db.fetch_one = AsyncMock(side_effect=[PoolTimeout("esgotado"), {'id': 2}])
+        assert post().status_code == 503
+        retry = post()
+        assert retry.status_code == 201
+        assert retry.json()["id"] == 2
+        assert "idempotent-replayed" not in retry.headers
+
+    def test_redis_unavailable(self, mock_db):
+        """Sem Redis a requisição segue sem proteção"""
+        broken = MagicMock()
+        broken.evalsha = AsyncMock(side_effect=redis.ConnectionError("sem conexão"))
+        with patch('cache.redis_client', broken):
+            response = post()
+        assert response.status_code == 201
+        assert mock_db.fetch_one.await_count == 1
+
+    def test_invalid_key(self, fake_redis, mock_db):
+        """Chave vazia ou longa demais é recusada com 400"""
+        assert post(key="x" * 300).status_code == 400
+        mock_db.fetch_one.assert_not_awaited()
+
+    def test_batch_replay(self, fake_redis, mock_db):
+        """O lote também aceita Idempotency-Key, com escopo próprio"""
+        mock_db.insert_rows = AsyncMock(return_value=[{'id': 7}])
+        first = post([TRANSACTION], path="/api/transactions/batch")
+        replay = post([TRANSACTION], path="/api/transactions/batch")
+        assert replay.json() == first.json()
+        assert replay.headers["idempotent-replayed"] == "true"
+        mock_db.insert_rows.assert_awaited_once()
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
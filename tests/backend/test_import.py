@@ -0,0 +1,196 @@
+"""
+Testes para a importação em massa de transações (CSV/NDJSON via COPY)
+"""
+import pytest
+import datetime
+import json
+from decimal import Decimal
+from contextlib import asynccontextmanager
+from unittest.mock import patch, AsyncMock, MagicMock
+
+from fastapi.testclient import TestClient
+
+import sys
+import os
+sys.path.append(os.path.join(os.path.dirname(__file__), '../../src/backend/app'))
+
+from main import app
+from transaction_import import validate_record, detect_format, ImportFormatError
+from invoice import InvoiceAnalyzer, FakeModel, NullResultCache
+
+client = TestClient(app)
+
+
+class TestValidation:
+    """Testes para a validação linha a linha"""
+
+    def test_valid_record(self):
+        """Registros válidos viram tuplas prontas para o COPY"""
+        row = validate_record({"description": " Mercado ", "amount": "-10.456", "transaction_date": "2024-06-01"})
+        assert row == ("Mercado", Decimal("-10.46"), datetime.date(2024, 6, 1))
+
+    @pytest.mark.parametrize("record, message", [
+        ({"description": "A", "amount": "abc", "transaction_date": "2024-06-01"}, "amount inválido"),
+        ({"description": "A", "amount": 1e9, "transaction_date": "2024-06-01"}, "fora do intervalo"),
+        ({"description": "A", "amount": 1, "transaction_date": "01/06/2024"}, "transaction_date inválida"),
+        ({"description": "x" * 256, "amount": 1, "transaction_date": "2024-06-01"}, "255"),
+        ({"amount": 1, "transaction_date": "2024-06-01"}, "ausentes: description"),
+        ([1, 2, 3], "objeto"),
+    ])
+    def test_invalid_records(self, record, message):
+        """Registros inválidos geram mensagens específicas"""
+        with pytest.raises(ValueError, match=message):
+            validate_record(record)
+
+    def test_detect_format(self):
+        """O formato vem do parâmetro, da extensão ou do content-type"""
+        assert detect_format("dados.csv", None) == "csv"
+        assert detect_format("dados.jsonl", None) == "ndjson"
+        assert detect_format("upload", "application/x-ndjson") == "ndjson"
+        assert detect_format("dados.csv", None, "NDJSON") == "ndjson"
+        with pytest.raises(ImportFormatError):
+            detect_format("dados.bin", "application/octet-stream")
+
+
+class TestImportEndpoint:
+    """Testes para POST /api/transactions/import"""
+
+    def test_csv_import_reports_errors_per_line(self):
+        """Linhas válidas são copiadas em lotes; as inválidas voltam no relatório"""
+        body = (
+            "description,amount,transaction_date\n"
+            "Salário,5000,2024-06-01\n"
+            "Mercado,abc,2024-06-02\n"
+            "Aluguel,-1500,2024-06-05\n"
+            "Cinema,-40,2024-06-07\n"
+        )
+        with patch('main.db') as mock_db, \
+             patch('main.summary_write') as mock_write, \
+             patch('transaction_import.IMPORT_BATCH_SIZE', 2):
+            mock_db.copy_rows = AsyncMock(side_effect=lambda table, columns, rows: len(rows))
+
+            response = client.post("/api/transactions/import?format=csv", files={"file": ("extrato.csv", body)})
+
+        data = response.json()
+        assert response.status_code == 200
+        assert data["imported"] == 3
+        assert data["failed"] == 1
+        assert data["errors"] == [{"line": 3, "error": "amount inválido: 'abc'"}]
+        # Um COPY e uma atualização do cache por lote
+        assert mock_db.copy_rows.await_count == data["batches"]
+        assert mock_write.call_count == data["batches"]
+
+    def test_ndjson_import(self):
+        """NDJSON aceita valores numéricos e ignora linhas em branco"""
+        body = (
+            '{"description": "Freela", "amount": 800.5, "transaction_date": "2024-06-10"}\n'
+            '\n'
+            '{"description": "Luz"\n'
+        )
+        with patch('main.db') as mock_db, patch('main.summary_write'):
+            mock_db.copy_rows = AsyncMock(return_value=1)
+
+            response = client.post("/api/transactions/import", files={"file": ("extrato.ndjson", body)})
+
+        data = response.json()
+        assert data["imported"] == 1
+        assert data["errors"][0]["line"] == 3
+        table, columns, rows = mock_db.copy_rows.call_args.args
+        assert table == "transactions"
+        assert rows == [("Freela", Decimal("800.50"), datetime.date(2024, 6, 10))]
+
+    def test_rejected_batch_is_reported(self):
+        """Um lote recusado pelo banco é reportado sem interromper a importação"""
+        body = "description,amount,transaction_date\nA,1,2024-06-01\n"
+        with patch('main.db') as mock_db, patch('main.summary_write'):
+            mock_db.copy_rows = AsyncMock(side_effect=RuntimeError("disk full"))
+
+            response = client.post("/api/transactions/import", files={"file": ("a.csv", body)})
+
+        data = response.json()
+        assert data["imported"] == 0
+        assert data["failed"] == 1
+        assert "disk full" in data["errors"][0]["error"]
+
+    def test_missing_csv_columns(self):
+        """Um cabeçalho sem as colunas obrigatórias é recusado"""
+        with patch('main.db'), patch('main.summary_write'):
+            response = client.post("/api/transactions/import", files={"file": ("a.csv", "data,valor\n")})
+        assert response.status_code == 400
+
+
+def fake_transaction(mock_db, inserted):
+    """db.transaction() que devolve ``inserted`` como linhas gravadas"""
+    tx = MagicMock()
+    tx.execute = AsyncMock(return_value=1)
+    tx.fetch_all = AsyncMock(return_value=inserted)
+
+    @asynccontextmanager
+    async def transaction():
+        yield tx
+
+    mock_db.transaction = transaction
+    return tx
+
+
+class TestInvoiceImport:
+    """Testes para POST /api/analyze-invoice?import=true"""
+
+    def analyze(self, inserted, analyzer=None):
+        analyzer = analyzer or InvoiceAnalyzer(FakeModel(latency=0), NullResultCache())
+        with patch('main.get_invoice_analyzer', return_value=analyzer), \
+             patch('main.db') as mock_db, \
+             patch('main.summary_write') as mock_write:
+            tx = fake_transaction(mock_db, inserted)
+            response = client.post("/api/analyze-invoice?import=true", files={"file": ("fatura.pdf", b"%PDF-1.4 importar")})
+        return response, tx, mock_write
+
+    def test_lines_written_in_one_statement(self):
+        """Os lançamentos vão num único INSERT deduplicado e o resumo é atualizado uma vez"""
+        inserted = [
+            {"id": 10, "description": "Supermercado", "amount": Decimal("-150.75"), "transaction_date": "2024-06-03"},
+            {"id": 11, "description": "Salário", "amount": Decimal("5000.00"), "transaction_date": "2024-06-05"},
+        ]
+        response, tx, mock_write = self.analyze(inserted)
+
+        data = response.json()
+        assert response.status_code == 200
+        assert len(data["transactions"]) == 3
+        assert data["import"]["imported"] == 2
+        assert data["import"]["duplicates"] == 1
+        assert data["import"]["transactions"][0] == {
+            "id": 10, "description": "Supermercado", "amount": -150.75, "transaction_date": "2024-06-03"
+        }
+        assert tx.fetch_all.await_count == 1
+        descriptions, amounts, dates = tx.fetch_all.call_args.args[1]
+        assert descriptions == ["Lançamento 1", "Lançamento 2", "Lançamento 3"]
+        assert all(isinstance(date, datetime.date) for date in dates)
+        assert mock_write.call_count == 1
+        mock_write.return_value.__aenter__.return_value.added.assert_called_once_with([Decimal("-150.75"), Decimal("5000.00")])
+
+    def test_invalid_lines_are_reported(self):
+        """Linhas da análise que não passam na validação ficam fora do INSERT e voltam como erro"""
+        class PartialModel(FakeModel):
+            async def generate(self, pdf_content):
+                return json.dumps({"transactions": [
+                    {"description": "Farmácia", "amount": -32.4, "transaction_date": "2024-06-08"},
+                    {"description": "Sem data", "amount": -10},
+                ]})
+
+        analyzer = InvoiceAnalyzer(PartialModel(latency=0), NullResultCache())
+        response, tx, _ = self.analyze([], analyzer)
+
+        data = response.json()["import"]
+        assert data["failed"] == 1
+        assert data["errors"] == [{"index": 1, "error": "campos obrigatórios ausentes: transaction_date"}]
+        assert tx.fetch_all.call_args.args[1][0] == ["Farmácia"]
+        assert data["duplicates"] == 1
+
+    def test_import_requires_sync_mode(self):
+        """import=true no modo assíncrono é recusado"""
+        response = client.post("/api/analyze-invoice?mode=async&import=true", files={"file": ("fatura.pdf", b"%PDF")})
+        assert response.status_code == 400
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
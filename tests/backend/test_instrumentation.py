@@ -0,0 +1,88 @@
+"""
+Testes para o pipeline de exportação de traces (fila do BatchSpanProcessor e métricas internas)
+"""
+import threading
+
+import pytest
+
+from opentelemetry.sdk.metrics import MeterProvider
+from opentelemetry.sdk.metrics.export import InMemoryMetricReader
+from opentelemetry.sdk.trace import TracerProvider
+from opentelemetry.sdk.trace.export import SpanExporter, SpanExportResult
+
+import sys
+import os
+sys.path.append(os.path.join(os.path.dirname(__file__), '../../src/backend/app'))
+
+from instrumentation import create_span_processor
+
+
+class BlockedExporter(SpanExporter):
+    """Exportador que só responde depois de liberado, como um Collector travado."""
+
+    def __init__(self):
+        self.release = threading.Event()
+        self.exported = 0
+
+    def export(self, spans):
+        self.release.wait(5)
+        self.exported += len(spans)
+        return SpanExportResult.SUCCESS
+
+
+def points(reader, name):
+    data = reader.get_metrics_data()
+    if data is None:
+        return []
+    return [
+        point
+        for resource in data.resource_metrics for scope in resource.scope_metrics
+        for metric in scope.metrics if metric.name == name
+        for point in metric.data.data_points
+    ]
+
+
+class TestSpanProcessor:
+    """Testes para create_span_processor"""
+
+    def test_queue_settings_and_dropped_spans(self, monkeypatch):
+        """A fila segue OTEL_BSP_* e os descartes por fila cheia viram métrica"""
+        monkeypatch.setenv("OTEL_PYTHON_SDK_INTERNAL_METRICS_ENABLED", "true")
+        monkeypatch.setenv("OTEL_BSP_MAX_QUEUE_SIZE", "4")
+        monkeypatch.setenv("OTEL_BSP_MAX_EXPORT_BATCH_SIZE", "2")
+        reader = InMemoryMetricReader()
+        exporter = BlockedExporter()
+        processor = create_span_processor(exporter, MeterProvider(metric_readers=[reader]))
+        tracer_provider = TracerProvider()
+        tracer_provider.add_span_processor(processor)
+        tracer = tracer_provider.get_tracer("teste")
+
+        for _ in range(20):
+            tracer.start_span("requisição").end()
+
+        processed = points(reader, "otel.sdk.processor.span.processed")
+        dropped = sum(p.value for p in processed if p.attributes.get("error.type") == "queue_full")
+        assert dropped >= 20 - 4 - 2
+        capacity = points(reader, "otel.sdk.processor.span.queue.capacity")
+        assert [p.value for p in capacity] == [4]
+
+        exporter.release.set()
+        tracer_provider.shutdown()
+        assert 0 < exporter.exported <= 4 + 2
+
+    def test_metrics_disabled_by_default(self, monkeypatch):
+        """Sem OTEL_PYTHON_SDK_INTERNAL_METRICS_ENABLED nada é publicado"""
+        monkeypatch.delenv("OTEL_PYTHON_SDK_INTERNAL_METRICS_ENABLED", raising=False)
+        reader = InMemoryMetricReader()
+        exporter = BlockedExporter()
+        exporter.release.set()
+        tracer_provider = TracerProvider()
+        tracer_provider.add_span_processor(create_span_processor(exporter, MeterProvider(metric_readers=[reader])))
+        tracer_provider.get_tracer("teste").start_span("requisição").end()
+        tracer_provider.shutdown()
+        assert points(reader, "otel.sdk.processor.span.processed") == []
+        assert exporter.exported == 1
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
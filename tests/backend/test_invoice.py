@@ -0,0 +1,118 @@
+"""
+Testes para o pipeline de análise de faturas (modelo plugável e cache por hash)
+"""
+import pytest
+import asyncio
+from unittest.mock import patch
+
+from fastapi.testclient import TestClient
+
+import sys
+import os
+sys.path.append(os.path.join(os.path.dirname(__file__), '../../src/backend/app'))
+
+from main import app
+from invoice import (
+    InvoiceAnalyzer, FakeModel, MemoryResultCache, NullResultCache, InvoiceModelNotConfigured,
+    parse_model_response, create_invoice_analyzer
+)
+
+client = TestClient(app)
+
+
+class CountingModel(FakeModel):
+    """Modelo fake que conta chamadas e o pico de chamadas simultâneas"""
+
+    def __init__(self, latency=0.01):
+        super().__init__(latency)
+        self.calls = 0
+        self.running = 0
+        self.peak = 0
+
+    async def generate(self, pdf_content):
+        self.calls += 1
+        self.running += 1
+        self.peak = max(self.peak, self.running)
+        try:
+            return await super().generate(pdf_content)
+        finally:
+            self.running -= 1
+
+
+class TestAnalyzer:
+    """Testes para InvoiceAnalyzer"""
+
+    def test_parse_model_response(self):
+        """Cercas de código em volta do JSON são removidas"""
+        assert parse_model_response('```json\n{"a": 1}\n```') == {"a": 1}
+        with pytest.raises(ValueError):
+            parse_model_response("não é JSON")
+
+    def test_reupload_hits_cache(self):
+        """O mesmo PDF enviado de novo volta do cache, sem chamar o modelo"""
+        model = CountingModel()
+        analyzer = InvoiceAnalyzer(model, MemoryResultCache())
+
+        async def scenario():
+            first = await analyzer.analyze(b"%PDF fatura")
+            second = await analyzer.analyze(b"%PDF fatura")
+            return first, second
+
+        (result, source), (cached, cached_source) = asyncio.run(scenario())
+        assert (source, cached_source) == ("model", "cache")
+        assert cached == result
+        assert len(result["transactions"]) == 3
+        assert model.calls == 1
+
+    def test_concurrent_identical_uploads_are_coalesced(self):
+        """Uploads simultâneos do mesmo PDF geram uma só chamada ao modelo"""
+        model = CountingModel()
+        analyzer = InvoiceAnalyzer(model, NullResultCache())
+
+        async def scenario():
+            return await asyncio.gather(*(analyzer.analyze(b"%PDF igual") for _ in range(5)))
+
+        sources = sorted(source for _, source in asyncio.run(scenario()))
+        assert sources == ["coalesced"] * 4 + ["model"]
+        assert model.calls == 1
+
+    def test_concurrency_limit(self):
+        """No máximo max_concurrency chamadas ao modelo ao mesmo tempo"""
+        model = CountingModel()
+        analyzer = InvoiceAnalyzer(model, NullResultCache(), max_concurrency=2)
+
+        async def scenario():
+            await asyncio.gather(*(analyzer.analyze(f"%PDF {i}".encode()) for i in range(6)))
+
+        asyncio.run(scenario())
+        assert model.calls == 6
+        assert model.peak == 2
+
+    def test_gemini_requires_api_key(self):
+        """Sem GEMINI_API_KEY o backend gemini não é criado"""
+        with patch('invoice.INVOICE_MODEL_BACKEND', 'gemini'), patch.dict(os.environ, {"GEMINI_API_KEY": ""}):
+            with pytest.raises(InvoiceModelNotConfigured):
+                create_invoice_analyzer()
+
+
+class TestAnalyzeInvoiceEndpoint:
+    """Testes para POST /api/analyze-invoice"""
+
+    def test_returns_analysis(self):
+        """O resultado do modelo volta como JSON"""
+        analyzer = InvoiceAnalyzer(FakeModel(latency=0), MemoryResultCache())
+        with patch('main.get_invoice_analyzer', return_value=analyzer):
+            response = client.post("/api/analyze-invoice", files={"file": ("fatura.pdf", b"%PDF-1.4 teste")})
+        assert response.status_code == 200
+        assert len(response.json()["transactions"]) == 3
+
+    def test_model_not_configured(self):
+        """Sem modelo configurado a resposta é 500 com a mensagem de configuração"""
+        with patch('main.get_invoice_analyzer', side_effect=InvoiceModelNotConfigured("Chave da API do Gemini não configurada.")):
+            response = client.post("/api/analyze-invoice", files={"file": ("fatura.pdf", b"%PDF")})
+        assert response.status_code == 500
+        assert "Gemini" in response.json()["detail"]
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
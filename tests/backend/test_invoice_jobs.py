@@ -0,0 +1,232 @@
+"""
+Testes para a fila de análises de faturas (jobs no Redis e worker)
+"""
+import pytest
+import asyncio
+import json
+from unittest.mock import patch
+
+import fakeredis.aioredis
+from fastapi.testclient import TestClient
+
+import sys
+import os
+sys.path.append(os.path.join(os.path.dirname(__file__), '../../src/backend/app'))
+
+import invoice_jobs
+from invoice import InvoiceAnalyzer, FakeModel, NullResultCache
+from invoice_jobs import (
+    InvoiceWorker, InvoiceQueueFull, enqueue_invoice_job, get_invoice_job, invoice_job_events,
+    QUEUE_KEY, PROCESSING_KEY, DELAYED_KEY, payload_key
+)
+from main import app
+
+
+class FlakyModel(FakeModel):
+    """Modelo fake que falha nas primeiras ``failures`` chamadas"""
+
+    def __init__(self, failures):
+        super().__init__(latency=0)
+        self.failures = failures
+        self.calls = 0
+
+    async def generate(self, pdf_content):
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise RuntimeError("modelo indisponível")
+        return await super().generate(pdf_content)
+
+
+@pytest.fixture
+def fake_redis():
+    client = fakeredis.aioredis.FakeRedis(decode_responses=True)
+    with patch('cache.redis_client', client), patch('invoice_jobs.redis_client', client), \
+         patch('invoice_jobs.INVOICE_JOB_RETRY_BACKOFF', 0):
+        yield client
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def worker(failures=0):
+    return InvoiceWorker(InvoiceAnalyzer(FlakyModel(failures), NullResultCache()), concurrency=2)
+
+
+async def claim(client):
+    return await client.lmove(QUEUE_KEY, PROCESSING_KEY, "RIGHT", "LEFT")
+
+
+class TestInvoiceJobs:
+    """Testes para o ciclo de vida dos jobs"""
+
+    def test_job_completes(self, fake_redis):
+        """O job processado fica done com o resultado; PDF e lista de processamento são limpos"""
+        async def scenario():
+            job_id = await enqueue_invoice_job(b"%PDF fatura", "fatura.pdf")
+            queued = await get_invoice_job(job_id)
+            await worker().process(await claim(fake_redis))
+            return queued, await get_invoice_job(job_id), job_id
+
+        queued, job, job_id = run(scenario())
+        assert queued["status"] == "queued"
+        assert job["status"] == "done"
+        assert job["attempts"] == 1
+        assert len(job["result"]["transactions"]) == 3
+        assert run(fake_redis.exists(payload_key(job_id))) == 0
+        assert run(fake_redis.llen(PROCESSING_KEY)) == 0
+
+    def test_failure_is_retried(self, fake_redis):
+        """Uma falha agenda nova tentativa, que volta à fila quando o backoff vence"""
+        job_worker = worker(failures=1)
+
+        async def scenario():
+            job_id = await enqueue_invoice_job(b"%PDF instavel")
+            await job_worker.process(await claim(fake_redis))
+            retrying = await get_invoice_job(job_id)
+            assert await fake_redis.zcard(DELAYED_KEY) == 1
+            await job_worker.maintain()
+            await job_worker.process(await claim(fake_redis))
+            return retrying, await get_invoice_job(job_id)
+
+        retrying, job = run(scenario())
+        assert retrying["status"] == "retrying"
+        assert "modelo indisponível" in retrying["error"]
+        assert job["status"] == "done"
+        assert job["attempts"] == 2
+
+    def test_attempts_exhausted(self, fake_redis):
+        """Depois de INVOICE_JOB_MAX_ATTEMPTS falhas o job fica failed com o erro"""
+        job_worker = worker(failures=5)
+
+        async def scenario():
+            job_id = await enqueue_invoice_job(b"%PDF quebrado")
+            for _ in range(2):
+                await job_worker.process(await claim(fake_redis))
+                await job_worker.maintain()
+            return await get_invoice_job(job_id)
+
+        with patch('invoice_jobs.INVOICE_JOB_MAX_ATTEMPTS', 2):
+            job = run(scenario())
+        assert job["status"] == "failed"
+        assert "modelo indisponível" in job["error"]
+
+    def test_queue_full(self, fake_redis):
+        """Acima de INVOICE_JOB_MAX_QUEUE jobs aguardando o enfileiramento é recusado"""
+        with patch('invoice_jobs.INVOICE_JOB_MAX_QUEUE', 1):
+            run(enqueue_invoice_job(b"%PDF 1"))
+            with pytest.raises(InvoiceQueueFull):
+                run(enqueue_invoice_job(b"%PDF 2"))
+
+    def test_stalled_job_is_reclaimed(self, fake_redis):
+        """Um job cujo worker parou volta à fila; o worker atrasado não sobrescreve o novo estado"""
+        job_worker = worker()
+
+        async def scenario():
+            job_id = await enqueue_invoice_job(b"%PDF orfao")
+            await claim(fake_redis)
+            # Primeiro worker marca a tentativa e "morre" com o prazo vencido
+            with patch('invoice_jobs.INVOICE_JOB_TIMEOUT', -60):
+                await invoice_jobs._start_job(
+                    [PROCESSING_KEY, invoice_jobs.job_key(job_id), payload_key(job_id)],
+                    [job_id, invoice_jobs._now(), invoice_jobs._lease_deadline(), 3, "esgotado"],
+                )
+            _, reclaimed = await job_worker.maintain()
+            requeued = await get_invoice_job(job_id)
+            await job_worker.process(await claim(fake_redis))
+            # Resposta tardia da primeira tentativa é descartada
+            stale = await invoice_jobs._finish_job(
+                [PROCESSING_KEY, invoice_jobs.job_key(job_id), payload_key(job_id)],
+                [job_id, invoice_jobs._now(), "failed", "error", "tarde demais", 60, 1],
+            )
+            return reclaimed, requeued, stale, await get_invoice_job(job_id)
+
+        reclaimed, requeued, stale, job = run(scenario())
+        assert reclaimed == 1
+        assert requeued["status"] == "queued"
+        assert stale == 0
+        assert job["status"] == "done"
+        assert job["attempts"] == 2
+
+    def test_worker_pool_drains_queue(self, fake_redis):
+        """O worker consome a fila com concorrência limitada até todos os jobs terminarem"""
+        async def scenario():
+            job_ids = [await enqueue_invoice_job(f"%PDF {i}".encode()) for i in range(5)]
+            task = asyncio.create_task(worker().run())
+            try:
+                for _ in range(200):
+                    jobs = [await get_invoice_job(job_id) for job_id in job_ids]
+                    if all(job["status"] == "done" for job in jobs):
+                        return jobs
+                    await asyncio.sleep(0.01)
+            finally:
+                task.cancel()
+            return jobs
+
+        assert [job["status"] for job in run(scenario())] == ["done"] * 5
+
+    def test_events_until_done(self, fake_redis):
+        """O stream SSE emite cada mudança de estado e termina no estado final"""
+        async def scenario():
+            job_id = await enqueue_invoice_job(b"%PDF eventos")
+            events = []
+
+            async def consume():
+                async for event in invoice_job_events(job_id, interval=0.01):
+                    events.append(event)
+
+            consumer = asyncio.create_task(consume())
+            await asyncio.sleep(0.05)
+            await worker().process(await claim(fake_redis))
+            await asyncio.wait_for(consumer, 1)
+            return events
+
+        events = run(scenario())
+        assert events[0].startswith("event: queued")
+        assert events[-1].startswith("event: done")
+        assert json.loads(events[-1].split("data: ", 1)[1])["result"]["transactions"]
+
+
+class TestAsyncAnalyzeEndpoint:
+    """Testes para o modo assíncrono de POST /api/analyze-invoice"""
+
+    def test_enqueue_and_poll(self, fake_redis):
+        """O upload responde 202 com o job; após o worker, o status traz o resultado"""
+        client = TestClient(app)
+        response = client.post("/api/analyze-invoice?mode=async", files={"file": ("fatura.pdf", b"%PDF-1.4 async")})
+        assert response.status_code == 202
+        job_id = response.json()["job_id"]
+        assert response.headers["location"] == f"/api/analyze-invoice/jobs/{job_id}"
+        assert client.get(f"/api/analyze-invoice/jobs/{job_id}").json()["status"] == "queued"
+
+        run(worker().process(run(claim(fake_redis))))
+        job = client.get(f"/api/analyze-invoice/jobs/{job_id}").json()
+        assert job["status"] == "done"
+        assert len(job["result"]["transactions"]) == 3
+
+        events = client.get(f"/api/analyze-invoice/jobs/{job_id}/events")
+        assert events.headers["content-type"].startswith("text/event-stream")
+        assert events.text.startswith("event: done")
+
+    def test_unknown_job(self, fake_redis):
+        """Job inexistente ou expirado responde 404"""
+        client = TestClient(app)
+        assert client.get("/api/analyze-invoice/jobs/nao-existe").status_code == 404
+        assert client.get("/api/analyze-invoice/jobs/nao-existe/events").status_code == 404
+
+    def test_queue_full_returns_503(self, fake_redis):
+        """Fila cheia responde 503 com Retry-After"""
+        client = TestClient(app)
+        with patch('invoice_jobs.INVOICE_JOB_MAX_QUEUE', 0):
+            response = client.post("/api/analyze-invoice?mode=async", files={"file": ("fatura.pdf", b"%PDF")})
+        assert response.status_code == 503
+        assert "retry-after" in response.headers
+
+    def test_invalid_mode(self):
+        """Modo desconhecido responde 400"""
+        response = TestClient(app).post("/api/analyze-invoice?mode=batch", files={"file": ("fatura.pdf", b"%PDF")})
+        assert response.status_code == 400
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
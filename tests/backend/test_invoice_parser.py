@@ -0,0 +1,166 @@
+"""
+Testes para a extração local de faturas e extratos (regras antes do modelo)
+"""
+import pytest
+import asyncio
+import datetime
+
+import sys
+import os
+sys.path.append(os.path.join(os.path.dirname(__file__), '../../src/backend/app'))
+
+from invoice import InvoiceAnalyzer, FakeModel, NullResultCache
+from invoice_parser import parse_pdf, parse_statement_text, parse_invoice_locally
+
+
+def text_pdf(lines):
+    """PDF mínimo de uma página com uma linha de texto por item (Helvetica, WinAnsi)"""
+    def escape(text):
+        return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+    content = b"BT /F1 9 Tf 30 810 Td 12 TL " + b"".join(
+        b"(" + escape(line).encode("cp1252") + b") Tj T* " for line in lines
+    ) + b"ET"
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        b"<< /Type /Pages /Kids [3 0 R] /Count 1 >>",
+        b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] /Contents 4 0 R "
+        b"/Resources << /Font << /F1 5 0 R >> >> >>",
+        b"<< /Length %d >>\nstream\n" % len(content) + content + b"\nendstream",
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>",
+    ]
+    pdf = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(pdf))
+        pdf += b"%d 0 obj\n" % number + body + b"\nendobj\n"
+    xref = len(pdf)
+    pdf += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    pdf += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    pdf += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    return bytes(pdf)
+
+
+CARD_INVOICE = [
+    "Banco Exemplo - Fatura do cartão",
+    "Vencimento: 10/01/2025",
+    "Total da fatura R$ 1.234,56",
+    "Data     Descrição                      Valor",
+    "20 DEZ   Supermercado Pão de Açúcar     R$ 350,20",
+    "28/12    UBER *TRIP                     23,90",
+    "02 JAN   Netflix   USD 10,00            R$ 55,90",
+    "03 JAN   Estorno Loja X                 -R$ 40,00",
+    "05 JAN   Pagamento recebido             -R$ 900,00",
+]
+
+BANK_STATEMENT = [
+    "Extrato de conta corrente",
+    "Período: 01/06/2024 a 30/06/2024",
+    "Data        Histórico                Valor       Saldo",
+    "01/06/2024  Saldo anterior                       1.000,00",
+    "03/06/2024  PIX RECEBIDO JOAO        2.500,00    3.500,00",
+    "05/06/2024  PAGTO FATURA CARTAO      -1.234,56   2.265,44",
+    "10/06/2024  TARIFA PACOTE            35,00 D     2.230,44 C",
+]
+
+
+class CountingModel(FakeModel):
+    def __init__(self):
+        super().__init__(latency=0)
+        self.calls = 0
+
+    async def generate(self, pdf_content):
+        self.calls += 1
+        return await super().generate(pdf_content)
+
+
+class TestRules:
+    """Testes para as regras de layout"""
+
+    def test_card_invoice(self):
+        """Compras viram despesas, estornos viram créditos e o ano vem do vencimento"""
+        result, outcome = parse_pdf(text_pdf(CARD_INVOICE))
+        assert outcome == "parsed"
+        assert result["transactions"] == [
+            {"description": "Supermercado Pão de Açúcar", "amount": -350.2, "transaction_date": "2024-12-20"},
+            {"description": "UBER *TRIP", "amount": -23.9, "transaction_date": "2024-12-28"},
+            {"description": "Netflix USD", "amount": -55.9, "transaction_date": "2025-01-02"},
+            {"description": "Estorno Loja X", "amount": 40.0, "transaction_date": "2025-01-03"},
+        ]
+
+    def test_bank_statement(self):
+        """No extrato o sinal vem do valor (ou de D/C) e a coluna de saldo é ignorada"""
+        result, outcome = parse_pdf(text_pdf(BANK_STATEMENT))
+        assert outcome == "parsed"
+        assert [(t["description"], t["amount"]) for t in result["transactions"]] == [
+            ("PIX RECEBIDO JOAO", 2500.0),
+            ("PAGTO FATURA CARTAO", -1234.56),
+            ("TARIFA PACOTE", -35.0),
+        ]
+
+    def test_year_without_reference_uses_today(self):
+        """Sem data completa no documento o ano é inferido a partir de hoje"""
+        transactions, coverage = parse_statement_text("15/11 Padaria 12,50", today=datetime.date(2025, 1, 5))
+        assert transactions[0]["transaction_date"] == "2024-11-15"
+        assert coverage == 1.0
+
+    def test_merchants_named_like_labels(self):
+        """Rótulos só valem no início da descrição: compras com "total" ou "saldo" no nome ficam"""
+        transactions, coverage = parse_statement_text(
+            "12/03 POSTO TOTAL LTDA 150,00\n13/03 TOTALPASS 89,90\n14/03 SALDOS E RETALHOS 45,00\n"
+            "15/03 MERCADO 20,00\n16/03 Pagamento recebido -300,00\nTotal 305,00",
+            today=datetime.date(2025, 4, 1),
+        )
+        assert [t["description"] for t in transactions] == [
+            "POSTO TOTAL LTDA", "TOTALPASS", "SALDOS E RETALHOS", "MERCADO",
+        ]
+        assert coverage == 1.0
+
+    @pytest.mark.parametrize("lines,outcome", [
+        (["Resumo do mês", "Compras diversas 350,20", "Outros lançamentos 23,90"], "no_match"),
+        ([" "], "no_text"),
+    ])
+    def test_unknown_documents_fall_back(self, lines, outcome):
+        """Layout desconhecido ou PDF sem texto não gera lançamentos"""
+        assert parse_pdf(text_pdf(lines)) == (None, outcome)
+
+    def test_reads_upload_buffer_in_place(self):
+        """O memoryview do upload é lido sem cópia e liberado ao fim da extração"""
+        buffer = bytearray(text_pdf(CARD_INVOICE))
+        with memoryview(buffer) as view:
+            result, outcome = parse_pdf(view, today=datetime.date(2025, 1, 15))
+        assert outcome == "parsed"
+        assert len(result["transactions"]) == 4
+        # Um export pendente do buffer impediria redimensioná-lo (BufferError)
+        buffer.extend(b"\n")
+
+    def test_low_coverage_falls_back(self):
+        """Se muitas linhas com valor não são reconhecidas o resultado local é descartado"""
+        lines = CARD_INVOICE + [f"Encargo {i} sem data 1{i},00" for i in range(5)]
+        assert parse_pdf(text_pdf(lines)) == (None, "no_match")
+
+
+class TestAnalyzerWithLocalParser:
+    """Testes para a extração local no InvoiceAnalyzer"""
+
+    def analyze(self, pdf):
+        model = CountingModel()
+        analyzer = InvoiceAnalyzer(model, NullResultCache(), local_parser=parse_invoice_locally)
+        result, source = asyncio.run(analyzer.analyze(pdf))
+        return result, source, model.calls
+
+    def test_local_hit_skips_model(self):
+        """PDF reconhecido pelas regras não chama o modelo"""
+        result, source, calls = self.analyze(text_pdf(BANK_STATEMENT))
+        assert (source, calls) == ("local", 0)
+        assert len(result["transactions"]) == 3
+
+    @pytest.mark.parametrize("pdf", [text_pdf(["Resumo", "Compras diversas 350,20"]), b"%PDF corrompido"])
+    def test_model_fallback(self, pdf):
+        """Layout desconhecido ou PDF ilegível segue para o modelo"""
+        result, source, calls = self.analyze(pdf)
+        assert (source, calls) == ("model", 1)
+        assert len(result["transactions"]) == 3
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
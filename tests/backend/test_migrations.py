@@ -0,0 +1,86 @@
+"""
+Testes para as migrações versionadas do esquema
+"""
+import pytest
+import asyncio
+from contextlib import asynccontextmanager
+from unittest.mock import AsyncMock, MagicMock
+
+import sys
+import os
+sys.path.append(os.path.join(os.path.dirname(__file__), '../../src/backend/app'))
+
+from migrations import MIGRATIONS, run_migrations
+
+
+def fake_database(applied_versions):
+    """Banco em memória que registra as instruções e as versões aplicadas"""
+    applied = set(applied_versions)
+    statements = []
+
+    async def execute(query, params=None):
+        statements.append(query)
+        if query.startswith("INSERT INTO schema_migrations"):
+            applied.add(params[0])
+        return 1
+
+    async def fetch_one(query, params=None):
+        return {"applied": 1} if params[0] in applied else None
+
+    tx = MagicMock()
+    tx.execute = AsyncMock(side_effect=execute)
+    tx.fetch_one = AsyncMock(side_effect=fetch_one)
+
+    @asynccontextmanager
+    async def transaction():
+        yield tx
+
+    db = MagicMock()
+    db.transaction = transaction
+    return db, statements, applied
+
+
+class TestMigrations:
+    """Testes para run_migrations"""
+
+    def test_versions_are_sequential(self):
+        """As versões começam em 1 e não têm lacunas nem repetições"""
+        assert [m.version for m in MIGRATIONS] == list(range(1, len(MIGRATIONS) + 1))
+
+    def test_applies_pending_in_order(self):
+        """Só as migrações pendentes são aplicadas, em ordem"""
+        db, statements, applied = fake_database({1})
+
+        assert asyncio.run(run_migrations(db)) == [m.version for m in MIGRATIONS[1:]]
+        assert applied == {m.version for m in MIGRATIONS}
+        assert not any("CREATE TABLE IF NOT EXISTS transactions " in s for s in statements)
+        assert any("transactions_date_id_idx" in s for s in statements)
+
+    def test_second_run_is_noop(self):
+        """Rodar de novo não reaplica nada"""
+        db, _, _ = fake_database({m.version for m in MIGRATIONS})
+        assert asyncio.run(run_migrations(db)) == []
+
+    def test_target_version(self):
+        """``target`` limita até qual versão aplicar"""
+        db, _, applied = fake_database(set())
+        assert asyncio.run(run_migrations(db, target=2)) == [1, 2]
+        assert applied == {1, 2}
+
+    def test_each_migration_takes_the_lock(self):
+        """Cada transação de migração serializa os workers com advisory lock"""
+        db, statements, _ = fake_database(set())
+        asyncio.run(run_migrations(db))
+        assert sum("pg_advisory_xact_lock" in s for s in statements) == len(MIGRATIONS)
+
+    def test_summary_triggers_are_statement_level(self):
+        """O resumo em tabela é atualizado uma vez por instrução, não por linha"""
+        migration = next(m for m in MIGRATIONS if m.name == "transactions_summary_rollup")
+        triggers = [s for s in migration.statements if "CREATE TRIGGER" in s]
+        assert len(triggers) == 4
+        assert all("FOR EACH STATEMENT" in s for s in triggers)
+        assert not any("FOR EACH ROW" in s for s in migration.statements)
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
@@ -0,0 +1,89 @@
+"""
+Testes para a manutenção das partições mensais de transactions
+"""
+import pytest
+import asyncio
+import datetime
+from contextlib import asynccontextmanager
+from decimal import Decimal
+from unittest.mock import patch, AsyncMock, MagicMock
+
+import sys
+import os
+sys.path.append(os.path.join(os.path.dirname(__file__), '../../src/backend/app'))
+
+from partitions import retention_cutoff, ensure_partitions, archive_partitions, PARTITIONS_LOCK_ID
+
+
+def fake_database(rows):
+    """Banco cuja transação devolve ``rows`` em fetch_all e registra as instruções"""
+    tx = MagicMock()
+    tx.execute = AsyncMock()
+    tx.fetch_all = AsyncMock(return_value=rows)
+
+    @asynccontextmanager
+    async def transaction():
+        yield tx
+
+    db = MagicMock()
+    db.transaction = transaction
+    return db, tx
+
+
+class TestRetention:
+    """Testes para o cálculo do corte de retenção"""
+
+    @pytest.mark.parametrize("today, months, expected", [
+        (datetime.date(2024, 6, 15), 1, datetime.date(2024, 5, 1)),
+        (datetime.date(2024, 6, 1), 6, datetime.date(2023, 12, 1)),
+        (datetime.date(2024, 1, 31), 12, datetime.date(2023, 1, 1)),
+        (datetime.date(2024, 3, 10), 0, datetime.date(2024, 3, 1)),
+    ])
+    def test_cutoff_is_first_day_of_oldest_kept_month(self, today, months, expected):
+        """O corte é o primeiro dia do mês mais antigo mantido"""
+        assert retention_cutoff(today, months) == expected
+
+
+class TestMaintenance:
+    """Testes para ensure_partitions e archive_partitions"""
+
+    def test_ensure_takes_lock_and_returns_created(self):
+        """A criação é serializada por advisory lock e devolve as partições criadas"""
+        db, tx = fake_database([{"name": "transactions_2024_07"}])
+
+        assert asyncio.run(ensure_partitions(db, months_ahead=2)) == ["transactions_2024_07"]
+        assert tx.execute.await_args.args == ("SELECT pg_advisory_xact_lock(%s)", (PARTITIONS_LOCK_ID,))
+        assert tx.fetch_all.await_args.args[1] == (2,)
+
+    def test_archive_disabled_by_default(self):
+        """Sem retenção configurada nada é arquivado nem toca o cache"""
+        db, tx = fake_database([])
+        with patch('partitions.summary_write') as mock_write:
+            assert asyncio.run(archive_partitions(db, retention_months=0)) == []
+        tx.fetch_all.assert_not_awaited()
+        mock_write.assert_not_called()
+
+    def test_archive_removes_totals_from_cache(self):
+        """As linhas arquivadas saem do resumo em cache como uma exclusão"""
+        db, tx = fake_database([
+            {"partition_name": "transactions_2023_01", "income": Decimal("100"), "expense": Decimal("-40"), "transactions_count": 3},
+            {"partition_name": "transactions_2023_02", "income": Decimal("0"), "expense": Decimal("-10"), "transactions_count": 1},
+        ])
+        write = MagicMock()
+
+        @asynccontextmanager
+        async def fake_summary_write():
+            yield write
+
+        with patch('partitions.summary_write', fake_summary_write):
+            archived = asyncio.run(archive_partitions(db, retention_months=12, today=datetime.date(2024, 6, 15)))
+
+        assert archived == ["transactions_2023_01", "transactions_2023_02"]
+        assert tx.fetch_all.await_args.args[1] == (datetime.date(2023, 6, 1),)
+        removed = write.removed.call_args.args[0]
+        assert sum(a for a in removed if a > 0) == 100
+        assert sum(a for a in removed if a < 0) == -50
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
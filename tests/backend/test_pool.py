@@ -0,0 +1,111 @@
+"""
+Testes para o pool de conexões do backend
+"""
+import pytest
+import threading
+import time
+from unittest.mock import MagicMock
+
+import psycopg2
+import psycopg2.extensions
+
+import sys
+import os
+sys.path.append(os.path.join(os.path.dirname(__file__), '../../src/backend/app'))
+
+from database import ConnectionPool, PoolTimeout
+
+
+def make_connection():
+    conn = MagicMock()
+    conn.closed = 0
+    conn.get_transaction_status.return_value = psycopg2.extensions.TRANSACTION_STATUS_IDLE
+    return conn
+
+
+class TestConnectionPool:
+    """Testes para o ConnectionPool"""
+
+    def test_reuses_released_connection(self):
+        """Conexões devolvidas são reaproveitadas sem novo connect"""
+        connect = MagicMock(side_effect=make_connection)
+        pool = ConnectionPool(connect, min_size=1, max_size=2)
+
+        conn = pool.getconn()
+        pool.putconn(conn)
+        assert pool.getconn() is conn
+        assert connect.call_count == 1
+
+    def test_stats_report_pool_state(self):
+        """stats() reflete conexões em uso e ociosas"""
+        pool = ConnectionPool(make_connection, min_size=0, max_size=2)
+        first = pool.getconn()
+        second = pool.getconn()
+        pool.putconn(first)
+
+        assert pool.stats() == {"in_use": 1, "idle": 1, "waiting": 0}
+        pool.putconn(second)
+        assert pool.stats() == {"in_use": 0, "idle": 2, "waiting": 0}
+
+    def test_checkout_timeout(self):
+        """Checkout falha com PoolTimeout quando o pool está esgotado"""
+        pool = ConnectionPool(make_connection, min_size=0, max_size=1, timeout=0.05)
+        pool.getconn()
+
+        start = time.monotonic()
+        with pytest.raises(PoolTimeout):
+            pool.getconn()
+        assert time.monotonic() - start >= 0.05
+
+    def test_waiter_receives_released_connection(self):
+        """Uma requisição em espera recebe a conexão devolvida"""
+        pool = ConnectionPool(make_connection, min_size=0, max_size=1, timeout=2)
+        conn = pool.getconn()
+        result = {}
+
+        waiter = threading.Thread(target=lambda: result.setdefault("conn", pool.getconn()))
+        waiter.start()
+        while pool.stats()["waiting"] == 0:
+            time.sleep(0.001)
+        pool.putconn(conn)
+        waiter.join(timeout=2)
+
+        assert result["conn"] is conn
+
+    def test_unhealthy_connection_is_replaced(self):
+        """Conexões que falham no health check são descartadas"""
+        broken = make_connection()
+        broken.cursor.return_value.__enter__.return_value.execute.side_effect = psycopg2.OperationalError()
+        healthy = make_connection()
+        connect = MagicMock(side_effect=[broken, healthy])
+        pool = ConnectionPool(connect, min_size=0, max_size=1)
+
+        pool.putconn(pool.getconn())
+        assert pool.getconn() is healthy
+        broken.close.assert_called_once()
+
+    def test_idle_connections_are_recycled(self):
+        """Conexões ociosas além de max_idle são fechadas, respeitando min_size"""
+        connect = MagicMock(side_effect=make_connection)
+        pool = ConnectionPool(connect, min_size=0, max_size=2, max_idle=0)
+
+        old = pool.getconn()
+        pool.putconn(old)
+        new = pool.getconn()
+
+        assert new is not old
+        old.close.assert_called_once()
+        assert connect.call_count == 2
+
+    def test_dirty_connection_is_rolled_back(self):
+        """Transações abertas são desfeitas ao devolver a conexão"""
+        pool = ConnectionPool(make_connection, min_size=0, max_size=1)
+        conn = pool.getconn()
+        conn.get_transaction_status.return_value = psycopg2.extensions.TRANSACTION_STATUS_INERROR
+
+        pool.putconn(conn)
+        conn.rollback.assert_called_once()
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
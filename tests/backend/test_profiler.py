@@ -0,0 +1,155 @@
+"""
+Testes para o profiler por amostragem (cabeçalho X-Profile e /api/profiles)
+"""
+import pytest
+import asyncio
+import signal
+import time
+from unittest.mock import patch
+
+import fakeredis.aioredis
+import httpx
+
+import sys
+import os
+sys.path.append(os.path.join(os.path.dirname(__file__), '../../src/backend/app'))
+
+from main import app
+from profiler import Profile, sampler
+
+TOKEN = "segredo"
+ROWS = [{'id': 1, 'description': 'Mercado', 'amount': -50, 'transaction_date': '2024-06-01'}]
+
+
+def burn_transactions(seconds):
+    end = time.process_time() + seconds
+    while time.process_time() < end:
+        pass
+
+
+def burn_summary(seconds):
+    end = time.process_time() + seconds
+    while time.process_time() < end:
+        pass
+
+
+@pytest.fixture
+def fake_redis():
+    fake = fakeredis.aioredis.FakeRedis(decode_responses=True)
+    with patch('cache.redis_client', fake), patch('profiler.redis_client', fake):
+        yield fake
+
+
+@pytest.fixture
+def mock_db():
+    async def fetch_all(*args, **kwargs):
+        burn_transactions(0.2)
+        return ROWS
+
+    async def fetch_one(*args, **kwargs):
+        burn_summary(0.2)
+        return {'income': 0, 'expense': -50, 'transactions_count': 1}
+
+    with patch('main.db') as db:
+        db.fetch_all = fetch_all
+        db.fetch_one = fetch_one
+        yield db
+
+
+@pytest.fixture
+def profiler_on():
+    """Instala o tratador de SIGPROF (a suíte roda na thread principal) e o remove ao final"""
+    previous = signal.getsignal(signal.SIGPROF)
+    with patch('profiler.PROFILER_TOKEN', TOKEN), patch.object(sampler, 'interval', 0.001):
+        sampler.install()
+        yield
+    sampler.installed = False
+    signal.signal(signal.SIGPROF, previous)
+
+
+def run(*calls):
+    """Executa as requisições via ASGI na thread principal, onde o SIGPROF é tratado."""
+    async def scenario():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://teste") as client:
+            return await asyncio.gather(*(client.request(method, path, headers=headers) for method, path, headers in calls))
+    return asyncio.run(scenario())
+
+
+class TestRequestProfile:
+    """Testes para o perfil de uma requisição pelo cabeçalho X-Profile"""
+
+    def test_profile_linked_to_trace(self, fake_redis, mock_db, profiler_on):
+        """O perfil fica com o trace_id como id e só tem as pilhas da própria requisição"""
+        profiled, other = run(
+            ("GET", "/api/transactions", {"X-Profile": TOKEN}),
+            ("GET", "/api/summary", {}),
+        )
+        assert profiled.status_code == other.status_code == 200
+        profile_id = profiled.headers["x-profile-id"]
+        assert len(profile_id) == 32 and int(profile_id, 16)
+        assert "x-profile-id" not in other.headers
+
+        (response,) = run(("GET", f"/api/profiles/{profile_id}", {"X-Profile": TOKEN}))
+        assert response.status_code == 200
+        folded = response.text
+        assert "burn_transactions (test_profiler.py:" in folded
+        assert "burn_summary" not in folded
+        # Formato folded: "raiz;...;folha contagem"
+        stack, count = folded.splitlines()[0].rsplit(" ", 1)
+        assert ";" in stack and int(count) > 0
+
+    def test_invalid_token_is_ignored(self, fake_redis, mock_db, profiler_on):
+        """Com token errado a requisição segue sem perfil"""
+        (response,) = run(("GET", "/api/transactions", {"X-Profile": "errado"}))
+        assert response.status_code == 200
+        assert "x-profile-id" not in response.headers
+
+
+class TestProfilesEndpoint:
+    """Testes para POST /api/profiles e GET /api/profiles/{id}"""
+
+    def test_worker_profile(self, fake_redis, mock_db, profiler_on):
+        """A amostragem do worker pega o que roda durante a janela, de qualquer requisição"""
+        started, _ = run(
+            ("POST", "/api/profiles?seconds=0.3", {"X-Profile": TOKEN}),
+            ("GET", "/api/summary", {}),
+        )
+        assert started.status_code == 200
+        body = started.json()
+        assert body["samples"] > 0
+        (response,) = run(("GET", body["profile_url"], {"X-Profile": TOKEN}))
+        assert "burn_summary" in response.text
+
+    def test_access_control(self, fake_redis, profiler_on):
+        responses = run(
+            ("GET", "/api/profiles/abc", {"X-Profile": "errado"}),
+            ("POST", "/api/profiles?seconds=1", {}),
+            ("GET", "/api/profiles/abc", {"X-Profile": TOKEN}),
+        )
+        assert [r.status_code for r in responses] == [403, 403, 404]
+
+    def test_disabled(self, fake_redis):
+        """Sem PROFILER_TOKEN os endpoints não existem"""
+        (response,) = run(("GET", "/api/profiles/abc", {"X-Profile": ""}))
+        assert response.status_code == 404
+
+
+class TestProfile:
+    """Testes para o formato folded"""
+
+    def test_folded(self):
+        def leaf():
+            return sys._getframe()
+
+        profile = Profile("x")
+        frame = leaf()
+        profile.add(frame)
+        profile.add(frame)
+        line = profile.folded().strip()
+        assert line.endswith(" 2")
+        assert line.split(";")[-1].startswith("leaf (test_profiler.py:")
+        assert Profile("vazio").folded() == ""
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
@@ -0,0 +1,107 @@
+"""
+Testes para a medição das instruções SQL no cursor (impressão digital e log de consultas lentas)
+"""
+import pytest
+from unittest.mock import patch
+
+import psycopg2.extras
+
+import sys
+import os
+sys.path.append(os.path.join(os.path.dirname(__file__), '../../src/backend/app'))
+
+from query_metrics import fingerprint, _cached_fingerprint, redact, record_statement, _timed_cursor_class, _TimedCursorMixin
+
+
+class TestFingerprint:
+    """Testes para a normalização das instruções"""
+
+    def test_parameters_and_literals(self):
+        """Placeholders, strings e números viram "?"; espaços e comentários somem"""
+        query = """
+            SELECT id, amount FROM transactions  -- página
+            WHERE transaction_date < %s AND description = 'Mercado' AND amount > -10.5
+            LIMIT %(limit)s
+        """
+        assert fingerprint(query) == (
+            "SELECT id, amount FROM transactions WHERE transaction_date < ? "
+            "AND description = ? AND amount > ? LIMIT ?"
+        )
+
+    def test_lists_collapse(self):
+        """Listas e VALUES de tamanhos diferentes têm a mesma impressão digital"""
+        assert fingerprint("SELECT * FROM t WHERE id IN (1, 2, 3)") == fingerprint("SELECT * FROM t WHERE id IN (7)")
+        # execute_values do psycopg2 manda os valores embutidos, em bytes
+        batch = b"INSERT INTO transactions (description, amount) VALUES ('a',1),('b',-2) RETURNING id"
+        assert fingerprint(batch) == "INSERT INTO transactions (description, amount) VALUES (?) RETURNING id"
+
+    def test_inlined_batches_are_not_cached(self):
+        """Lotes com valores embutidos (bytes ou longos) não ficam presos no cache"""
+        _cached_fingerprint.cache_clear()
+        values = ",".join(f"('compra {i}',{i})" for i in range(1000))
+        fingerprint(f"INSERT INTO transactions (description, amount) VALUES {values}".encode())
+        fingerprint(f"INSERT INTO transactions (description, amount) VALUES {values}")
+        assert _cached_fingerprint.cache_info().currsize == 0
+        fingerprint("SELECT * FROM transactions WHERE id = %s")
+        assert _cached_fingerprint.cache_info().currsize == 1
+
+    def test_identifiers_are_kept(self):
+        """Números dentro de identificadores (partições) não são literais"""
+        assert fingerprint("SELECT * FROM transactions_2024_06 WHERE id = $1") == "SELECT * FROM transactions_2024_06 WHERE id = ?"
+
+
+class TestSlowQueryLog:
+    """Testes para record_statement e o log de consultas lentas"""
+
+    @pytest.fixture
+    def metrics(self):
+        with patch('query_metrics.database_query_duration') as duration, \
+             patch('query_metrics.database_rows_returned') as rows, \
+             patch('query_metrics.database_bytes_returned'), \
+             patch('query_metrics.database_slow_queries_counter') as slow:
+            yield duration, rows, slow
+
+    def test_records_by_fingerprint(self, metrics, capsys):
+        duration, rows, slow = metrics
+        record_statement("SELECT * FROM fixed_expenses WHERE id = %s", (3,), 2_000_000, rows=1, nbytes=40)
+        value, attributes = duration.record.call_args.args
+        assert value == pytest.approx(0.002)
+        assert attributes == {
+            "db.statement": "SELECT * FROM fixed_expenses WHERE id = ?", "db.operation": "SELECT", "db.target": "primary",
+        }
+        assert rows.record.call_args.args[0] == 1
+        slow.add.assert_not_called()
+        assert capsys.readouterr().out == ""
+
+    def test_slow_query_is_logged_without_values(self, metrics, capsys):
+        """A consulta lenta aparece no log só com os tipos dos parâmetros"""
+        _, _, slow = metrics
+        with patch('query_metrics.DB_SLOW_QUERY_THRESHOLD', 0.5):
+            record_statement(
+                "SELECT * FROM transactions WHERE description = %(description)s",
+                {"description": "CPF 123.456.789-00"}, 800_000_000, rows=2, target="replica:db2:5432",
+            )
+        out = capsys.readouterr().out
+        assert "Consulta lenta (replica:db2:5432, 800.0 ms, 2 linhas)" in out
+        assert "description = ?" in out and "{description: str}" in out
+        assert "123.456" not in out
+        slow.add.assert_called_once()
+
+    def test_redact(self):
+        assert redact(None) == "nenhum"
+        assert redact((1, "x", None)) == "[int, str, NoneType]"
+        assert redact([("a", 1), ("b", 2)]) == "2 x [str, int]"
+
+
+class TestSyncCursor:
+    """Testes para os cursores medidos do psycopg2"""
+
+    def test_keeps_cursor_factory(self):
+        """O cursor medido continua sendo do tipo pedido (ex.: RealDictCursor)"""
+        timed = _timed_cursor_class(psycopg2.extras.RealDictCursor)
+        assert issubclass(timed, psycopg2.extras.RealDictCursor) and issubclass(timed, _TimedCursorMixin)
+        assert _timed_cursor_class(psycopg2.extras.RealDictCursor) is timed
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
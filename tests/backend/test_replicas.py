@@ -0,0 +1,136 @@
+"""
+Testes para o roteamento de leituras entre primário e réplicas
+"""
+import pytest
+import asyncio
+from unittest.mock import patch, AsyncMock, MagicMock
+
+from fastapi.testclient import TestClient
+
+import sys
+import os
+sys.path.append(os.path.join(os.path.dirname(__file__), '../../src/backend/app'))
+
+from main import app
+from replicas import (
+    Replica, ReplicaRouter, parse_hosts, parse_lsn, replication_lag, prefers_primary, READ_YOUR_WRITES_COOKIE
+)
+
+
+def fake_replica(name, healthy=True, latency=0.01):
+    db = MagicMock()
+    db.target = f"replica:{name}:5432"
+    replica = Replica(db)
+    replica.healthy = healthy
+    replica.latency = latency
+    return replica
+
+
+class TestHelpers:
+    """Testes para as funções auxiliares"""
+
+    def test_parse_hosts(self):
+        """Porta opcional por réplica; entradas vazias são ignoradas"""
+        assert parse_hosts("r1:5433, r2,") == [("r1", "5433"), ("r2", None)]
+        assert parse_hosts("") == []
+
+    def test_replication_lag(self):
+        """Sem atraso quando a réplica alcançou o LSN do primário"""
+        assert parse_lsn("1/0") == 1 << 32
+        assert replication_lag("0/3000060", "0/3000060", 120.0) == 0.0
+        assert replication_lag("0/3000060", "0/3000000", 7.5) == 7.5
+
+    def test_prefers_primary(self):
+        """O cookie de leitura após escrita vale até o instante gravado nele"""
+        assert prefers_primary({READ_YOUR_WRITES_COOKIE: "1000.5"}, now=1000.0)
+        assert not prefers_primary({READ_YOUR_WRITES_COOKIE: "999"}, now=1000.0)
+        assert not prefers_primary({READ_YOUR_WRITES_COOKIE: "x"}, now=1000.0)
+        assert not prefers_primary({}, now=1000.0)
+
+
+class TestRouter:
+    """Testes para a escolha do alvo e a verificação das réplicas"""
+
+    def test_round_robin(self):
+        """Alterna entre as réplicas saudáveis"""
+        r1, r2, r3 = fake_replica("r1"), fake_replica("r2", healthy=False), fake_replica("r3")
+        router = ReplicaRouter([r1, r2, r3], selection="round_robin")
+        assert [router.choose() for _ in range(4)] == [r1.db, r3.db, r1.db, r3.db]
+
+    def test_least_latency(self):
+        """Escolhe a réplica saudável de menor latência"""
+        r1, r2 = fake_replica("r1", latency=0.05), fake_replica("r2", latency=0.01)
+        assert ReplicaRouter([r1, r2], selection="least_latency").choose() is r2.db
+
+    def test_primary_when_needed(self):
+        """Sem réplicas, com todas atrasadas ou logo após uma escrita, lê do primário"""
+        assert ReplicaRouter([]).choose() is None
+        assert ReplicaRouter([fake_replica("r1", healthy=False)]).choose() is None
+        assert ReplicaRouter([fake_replica("r1")]).choose(prefer_primary=True) is None
+
+    def test_check_marks_lagging_replica(self):
+        """Réplicas atrasadas além do limite saem do rodízio e voltam ao alcançar o primário"""
+        replica = fake_replica("r1", healthy=False, latency=None)
+        replica.db.fetch_one = AsyncMock(return_value={"in_recovery": True, "replay_lsn": "0/100", "replay_age": 9.0})
+        primary = MagicMock()
+        primary.fetch_one = AsyncMock(return_value={"lsn": "0/200"})
+        router = ReplicaRouter([replica], max_lag=5)
+
+        asyncio.run(router.check(primary))
+        assert not replica.healthy
+        assert replica.lag == 9.0
+
+        primary.fetch_one.return_value = {"lsn": "0/100"}
+        asyncio.run(router.check(primary))
+        assert replica.healthy
+        assert replica.lag == 0.0
+
+    @pytest.mark.parametrize("failure", [
+        AsyncMock(return_value={"in_recovery": False, "replay_lsn": None, "replay_age": None}),
+        AsyncMock(side_effect=OSError("connection refused")),
+    ])
+    def test_check_failures_fall_back(self, failure):
+        """Servidor promovido ou inacessível deixa de receber leituras"""
+        replica = fake_replica("r1")
+        replica.db.fetch_one = failure
+        primary = MagicMock()
+        primary.fetch_one = AsyncMock(return_value={"lsn": "0/200"})
+
+        asyncio.run(ReplicaRouter([replica]).check(primary))
+        assert not replica.healthy
+
+
+class TestRouting:
+    """Testes do roteamento nos endpoints"""
+
+    def test_reads_go_to_replica_and_writes_set_cookie(self):
+        """GET lê da réplica; uma escrita faz o cliente ler do primário em seguida"""
+        replica = fake_replica("r1")
+        replica.db.fetch_all = AsyncMock(return_value=[])
+        client = TestClient(app)
+        with patch('main.replica_router', ReplicaRouter([replica])), \
+             patch('main.db') as mock_db, patch('main.summary_write'):
+            mock_db.fetch_all = AsyncMock(return_value=[])
+            mock_db.execute = AsyncMock(return_value=1)
+
+            client.get("/api/fixed-expenses")
+            assert replica.db.fetch_all.await_count == 1
+
+            client.delete("/api/fixed-expenses/1")
+            assert READ_YOUR_WRITES_COOKIE in client.cookies
+
+            client.get("/api/fixed-expenses")
+            assert replica.db.fetch_all.await_count == 1
+            assert mock_db.fetch_all.await_count == 1
+
+    def test_no_cookie_without_replicas(self):
+        """Sem réplicas configuradas as respostas não ganham cookie"""
+        client = TestClient(app)
+        with patch('main.db') as mock_db:
+            mock_db.execute = AsyncMock(return_value=1)
+            response = client.delete("/api/fixed-expenses/1")
+        assert READ_YOUR_WRITES_COOKIE not in response.cookies
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
@@ -0,0 +1,142 @@
+"""
+Testes para a amostragem de traces (por rota, erros/lentos) e os spans customizados dobrados
+"""
+import pytest
+
+from opentelemetry.sdk.trace import TracerProvider
+from opentelemetry.sdk.trace.export import SimpleSpanProcessor
+from opentelemetry.sdk.trace.export.in_memory_span_exporter import InMemorySpanExporter
+from opentelemetry.sdk.trace.sampling import ParentBased
+from opentelemetry.trace import Status, StatusCode, set_span_in_context
+
+import sys
+import os
+sys.path.append(os.path.join(os.path.dirname(__file__), '../../src/backend/app'))
+
+from sampling import (
+    RouteRatioSampler, KeepErrorsAndSlow, TailSamplingProcessor, FoldedTracer, parse_route_rates
+)
+
+
+def provider(sampler, tail_threshold=None):
+    exporter = InMemorySpanExporter()
+    processor = SimpleSpanProcessor(exporter)
+    if tail_threshold is not None:
+        processor = TailSamplingProcessor(processor, tail_threshold)
+    tracer_provider = TracerProvider(sampler=sampler)
+    tracer_provider.add_span_processor(processor)
+    return tracer_provider.get_tracer("teste"), exporter
+
+
+def request(tracer, route, error=False):
+    """Simula um span de requisição com um filho, como o FastAPI e um span customizado"""
+    with tracer.start_as_current_span(f"GET {route}", attributes={"http.route": route}) as root:
+        with tracer.start_as_current_span("database.query"):
+            pass
+        if error:
+            root.set_status(Status(StatusCode.ERROR))
+
+
+class TestRouteSampling:
+    """Testes para a amostragem por rota"""
+
+    def test_parse_route_rates(self):
+        assert parse_route_rates(" /api/summary=0.01, /api/transactions=1 ") == {
+            "/api/summary": 0.01, "/api/transactions": 1.0,
+        }
+        assert parse_route_rates("") == {}
+
+    @pytest.mark.parametrize("value", ["/api/summary", "=0.5", "/api/summary=2"])
+    def test_invalid_route_rates(self, value):
+        with pytest.raises(ValueError):
+            parse_route_rates(value)
+
+    def test_route_rate_overrides_default(self):
+        """A rota com taxa 0 é descartada inteira; as demais seguem a taxa padrão"""
+        tracer, exporter = provider(ParentBased(RouteRatioSampler(1.0, {"/api/summary": 0.0})))
+        for _ in range(5):
+            request(tracer, "/api/summary")
+        request(tracer, "/api/transactions")
+        assert [span.name for span in exporter.get_finished_spans()] == ["database.query", "GET /api/transactions"]
+
+
+class TestKeepErrorsAndSlow:
+    """Testes para a exportação no fim do trace dos descartados com erro ou lentos"""
+
+    def test_fast_traces_are_dropped_and_errors_kept(self):
+        """Sem amostragem na raiz só o trace com erro é exportado, com todos os spans"""
+        tracer, exporter = provider(KeepErrorsAndSlow(ParentBased(RouteRatioSampler(0.0))), tail_threshold=60)
+        request(tracer, "/api/summary")
+        request(tracer, "/api/transactions", error=True)
+        spans = exporter.get_finished_spans()
+        assert [span.name for span in spans] == ["database.query", "GET /api/transactions"]
+        assert all(span.context.trace_flags.sampled for span in spans)
+        assert spans[0].parent.span_id == spans[1].context.span_id
+
+    def test_slow_traces_are_kept(self):
+        """Traces que passam do limite de duração são exportados"""
+        tracer, exporter = provider(KeepErrorsAndSlow(ParentBased(RouteRatioSampler(0.0))), tail_threshold=0)
+        request(tracer, "/api/summary")
+        assert len(exporter.get_finished_spans()) == 2
+
+    def test_sampled_traces_pass_through(self):
+        """Traces amostrados na raiz seguem direto para a exportação"""
+        tracer, exporter = provider(KeepErrorsAndSlow(ParentBased(RouteRatioSampler(1.0))), tail_threshold=60)
+        request(tracer, "/api/summary")
+        assert len(exporter.get_finished_spans()) == 2
+
+    def test_buffer_is_bounded(self):
+        """Traces sem raiz finalizada são descartados quando o limite é atingido"""
+        tracer_provider = TracerProvider(sampler=KeepErrorsAndSlow(ParentBased(RouteRatioSampler(0.0))))
+        processor = TailSamplingProcessor(SimpleSpanProcessor(InMemorySpanExporter()), 60, max_traces=3)
+        tracer_provider.add_span_processor(processor)
+        tracer = tracer_provider.get_tracer("teste")
+        roots = [tracer.start_span("raiz") for _ in range(10)]
+        for root in roots:
+            tracer.start_span("filho", context=set_span_in_context(root)).end()
+        assert len(processor._traces) == 3
+
+
+class TestFoldedTracer:
+    """Testes para os spans customizados dobrados no span da requisição"""
+
+    def test_attributes_go_to_current_span(self):
+        """Dentro de uma requisição o span customizado não é criado"""
+        tracer, exporter = provider(ParentBased(RouteRatioSampler(1.0)))
+        folded = FoldedTracer(tracer)
+        with tracer.start_as_current_span("GET /api/summary"):
+            with folded.start_as_current_span("cache.get") as span:
+                span.set_attribute("cache.hit", True)
+        spans = exporter.get_finished_spans()
+        assert [span.name for span in spans] == ["GET /api/summary"]
+        assert spans[0].attributes["cache.get.cache.hit"] is True
+
+    def test_repeated_keys_are_not_overwritten(self):
+        """Blocos diferentes, ou o mesmo bloco repetido, mantêm cada um os seus atributos"""
+        tracer, exporter = provider(ParentBased(RouteRatioSampler(1.0)))
+        folded = FoldedTracer(tracer)
+        with tracer.start_as_current_span("GET /api/summary"):
+            with folded.start_as_current_span("cache.get") as span:
+                span.set_attribute("cache.key", "financial_summary")
+            with folded.start_as_current_span("cache.set") as span:
+                span.set_attribute("cache.key", "financial_summary:2024")
+            for rows in (1000, 250):
+                with folded.start_as_current_span("database.copy.transactions") as span:
+                    span.set_attribute("db.rows", rows)
+        attributes = exporter.get_finished_spans()[0].attributes
+        assert attributes["cache.get.cache.key"] == "financial_summary"
+        assert attributes["cache.set.cache.key"] == "financial_summary:2024"
+        assert attributes["database.copy.transactions.db.rows"] == 1000
+        assert attributes["database.copy.transactions[2].db.rows"] == 250
+        assert not any(key.startswith(("cache.key", "db.")) for key in attributes)
+
+    def test_creates_root_span_without_parent(self):
+        """Sem span ativo (ex.: worker de faturas) o span é criado normalmente"""
+        tracer, exporter = provider(ParentBased(RouteRatioSampler(1.0)))
+        with FoldedTracer(tracer).start_as_current_span("invoice.job"):
+            pass
+        assert [span.name for span in exporter.get_finished_spans()] == ["invoice.job"]
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
@@ -0,0 +1,141 @@
+"""
+Testes para o recebimento de uploads em streaming (limite, hash incremental e spool)
+"""
+import pytest
+import asyncio
+import hashlib
+from unittest.mock import patch
+
+from fastapi.testclient import TestClient
+
+import sys
+import os
+sys.path.append(os.path.join(os.path.dirname(__file__), '../../src/backend/app'))
+
+from main import app
+from invoice import InvoiceAnalyzer, FakeModel, NullResultCache
+from uploads import receive_upload, content_copy, UploadError, UploadTooLarge
+
+BOUNDARY = "fronteira"
+
+
+def multipart_body(content, field="file", filename="fatura.pdf"):
+    return (
+        f"--{BOUNDARY}\r\n"
+        f'Content-Disposition: form-data; name="descricao"\r\n\r\n'
+        f"junho\r\n"
+        f"--{BOUNDARY}\r\n"
+        f'Content-Disposition: form-data; name="{field}"; filename="{filename}"\r\n'
+        f"Content-Type: application/pdf\r\n\r\n"
+    ).encode() + content + f"\r\n--{BOUNDARY}--\r\n".encode()
+
+
+class FakeRequest:
+    """Requisição com o corpo entregue em chunks; conta quantos foram lidos"""
+
+    def __init__(self, body, chunk_size=1024, content_type=f"multipart/form-data; boundary={BOUNDARY}"):
+        self.headers = {"content-type": content_type}
+        self.body = body
+        self.chunk_size = chunk_size
+        self.chunks_read = 0
+
+    async def stream(self):
+        for start in range(0, len(self.body), self.chunk_size):
+            self.chunks_read += 1
+            yield self.body[start:start + self.chunk_size]
+
+
+def receive(request, **kwargs):
+    async def scenario():
+        upload = await receive_upload(request, **kwargs)
+        with upload.contents() as view:
+            content = bytes(view)
+        upload.close()
+        return upload, content
+
+    return asyncio.run(scenario())
+
+
+class TestReceiveUpload:
+    """Testes para receive_upload"""
+
+    def test_small_file_stays_in_memory(self):
+        """Arquivo pequeno fica em memória; hash e conteúdo conferem"""
+        pdf = b"%PDF-1.4 pequeno"
+        upload, content = receive(FakeRequest(multipart_body(pdf), chunk_size=7))
+        assert content == pdf
+        assert upload.filename == "fatura.pdf"
+        assert upload.sha256 == hashlib.sha256(pdf).hexdigest()
+        assert not upload.on_disk
+
+    def test_large_file_is_spooled_to_disk(self):
+        """Acima do limite de spool o arquivo vai para disco e o buffer em memória fica limitado"""
+        pdf = os.urandom(300_000)
+        upload, content = receive(FakeRequest(multipart_body(pdf), chunk_size=16 * 1024), spool_bytes=64 * 1024)
+        assert content == pdf
+        assert upload.on_disk
+        assert upload.sha256 == hashlib.sha256(pdf).hexdigest()
+        assert upload.peak_buffered_bytes <= 64 * 1024 + 16 * 1024
+
+    def test_consumer_copies_count_in_peak_memory(self):
+        """Cópias feitas por quem lê o conteúdo entram na memória de pico, não no buffer"""
+        pdf = b"%PDF-1.4 " + b"x" * 1000
+        upload = asyncio.run(receive_upload(FakeRequest(multipart_body(pdf))))
+        with content_copy(len(pdf)):
+            pass
+        assert upload.peak_memory == len(pdf)
+        with upload.contents() as content:
+            with content_copy(len(content)):
+                data = bytes(content)
+        upload.close()
+        assert upload.peak_buffered_bytes == len(data)
+        assert upload.peak_memory == 2 * len(data)
+
+    def test_limit_stops_reading(self):
+        """O upload é interrompido ao passar do limite, sem ler o restante do corpo"""
+        request = FakeRequest(multipart_body(b"x" * 100_000), chunk_size=1024)
+        with pytest.raises(UploadTooLarge):
+            receive(request, max_bytes=10_000)
+        assert request.chunks_read < 20
+
+    @pytest.mark.parametrize("request_", [
+        FakeRequest(b"{}", content_type="application/json"),
+        FakeRequest(multipart_body(b"%PDF", field="outro")),
+    ])
+    def test_invalid_requests(self, request_):
+        """Corpo que não é multipart ou sem o campo do arquivo é recusado"""
+        with pytest.raises(UploadError):
+            receive(request_)
+
+
+class TestAnalyzeInvoiceUpload:
+    """Testes do upload em POST /api/analyze-invoice"""
+
+    def test_digest_from_upload_is_reused(self):
+        """O hash calculado no upload vira a chave do cache, sem novo hash do PDF"""
+        analyzer = InvoiceAnalyzer(FakeModel(latency=0), NullResultCache())
+        pdf = b"%PDF-1.4 hash"
+        with patch('main.get_invoice_analyzer', return_value=analyzer), \
+             patch.object(analyzer, 'cache_key', wraps=analyzer.cache_key) as cache_key:
+            response = TestClient(app).post("/api/analyze-invoice", files={"file": ("fatura.pdf", pdf)})
+        assert response.status_code == 200
+        assert cache_key.call_args.args[1] == hashlib.sha256(pdf).hexdigest()
+
+    def test_too_large_returns_413(self):
+        """Arquivo acima de INVOICE_MAX_UPLOAD_BYTES responde 413"""
+        analyzer = InvoiceAnalyzer(FakeModel(latency=0), NullResultCache())
+        with patch('main.get_invoice_analyzer', return_value=analyzer), \
+             patch('main.INVOICE_MAX_UPLOAD_BYTES', 1000):
+            response = TestClient(app).post("/api/analyze-invoice", files={"file": ("fatura.pdf", b"x" * 5000)})
+        assert response.status_code == 413
+
+    def test_missing_file_returns_400(self):
+        """Requisição sem o campo file responde 400"""
+        analyzer = InvoiceAnalyzer(FakeModel(latency=0), NullResultCache())
+        with patch('main.get_invoice_analyzer', return_value=analyzer):
+            response = TestClient(app).post("/api/analyze-invoice", data={"outro": "x"}, files={"anexo": ("a.pdf", b"%PDF")})
+        assert response.status_code == 400
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
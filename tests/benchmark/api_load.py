@@ -0,0 +1,503 @@
+"""
+Carga reproduzível nas rotas da API com transactions de 1 mil a 1 milhão de linhas
+
+Para cada tamanho, um subprocesso importa main.py, popula transactions e dispara cada
+rota com concorrência fixa via ASGI (sem rede), na ordem em que um cliente faria:
+leituras, criações e, por fim, remoções do que foi criado. Mede latência p50/p95/p99,
+requisições por segundo, comandos enviados ao banco por requisição e o pico de memória
+residente (RSS) do processo. O resultado vai para um JSON, que pode ser comparado com
+o de uma execução anterior (--compare), e opcionalmente para um Markdown em docs/.
+
+Backends:
+- real: PostgreSQL e Redis do docker-compose.yml (ou quaisquer outros pelas variáveis
+  POSTGRES_* / REDIS_*). Cada tamanho usa um schema próprio (PGOPTIONS search_path),
+  removido ao final, e o banco REDIS_DB do --redis-db, esvaziado antes e depois.
+- memory: banco simulado em memória e fakeredis; mede só o custo do código da API.
+
+Não cobertas: /api/analyze-invoice/jobs/{id}/events (SSE que só termina quando o
+worker processa o job) e /api/profiles (administrativa, desativada por padrão).
+
+Uso:
+    docker compose up -d db cache
+    POSTGRES_HOST=localhost POSTGRES_PORT=5433 REDIS_HOST=localhost REDIS_PORT=6380 \
+        python tests/benchmark/api_load.py --backend real --sizes 1000,100000,1000000 \
+        --json api_load.json --output docs/BENCHMARK_API.md
+    python tests/benchmark/api_load.py --backend memory --compare api_load.json
+"""
+import argparse
+import asyncio
+import datetime
+import functools
+import json
+import logging
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import time
+from contextlib import asynccontextmanager
+
+sys.path.append(os.path.dirname(__file__))
+sys.path.append(os.path.join(os.path.dirname(__file__), '../../src/backend/app'))
+
+# Transações de 2019–2023; as datas crescem com o id
+SEED_QUERY = """
+    INSERT INTO transactions (description, amount, transaction_date)
+    SELECT 'Transação ' || g,
+           round((random() * 2000 - 1400)::numeric, 2),
+           DATE '2019-01-01' + (g::bigint * 1825 / %(rows)s)::integer
+    FROM generate_series(1, %(rows)s) AS g
+"""
+# Meses com linhas na partição padrão; transactions_ensure_partition as move para a mensal
+MONTHS_QUERY = "SELECT DISTINCT date_trunc('month', transaction_date)::date FROM transactions_default"
+
+DB_METHODS = ("fetch_all", "fetch_one", "execute", "copy_rows", "insert_rows")
+
+
+class Scenario:
+    """Uma rota: como montar a i-ésima requisição e o que guardar da resposta."""
+
+    def __init__(self, name, request, share=1.0, collect=None):
+        self.name = name
+        self.request = request
+        self.share = share
+        self.collect = collect
+
+    def count(self, requests):
+        return max(2, int(requests * self.share))
+
+
+def transaction(i):
+    return {"description": f"Carga {i}", "amount": round(-10 - i % 500 * 1.37, 2), "transaction_date": "2023-06-14"}
+
+
+def import_csv(i, lines=100):
+    rows = "".join(f"Importada {i}-{n},{-(n % 90) - 1.5},2023-07-{n % 28 + 1:02d}\n" for n in range(lines))
+    return {"files": {"file": (f"extrato-{i}.csv", "description,amount,transaction_date\n" + rows, "text/csv")}}
+
+
+def invoice_pdf(i):
+    return {"files": {"file": ("fatura.pdf", f"%PDF-1.4 fatura de carga {i} {time.time()}".encode(), "application/pdf")}}
+
+
+def keep(field, key="id"):
+    """Guarda ``key`` da resposta (ou de cada item dela) na lista ``field`` do estado."""
+    def collect(response, state):
+        body = response.json()
+        state.setdefault(field, []).extend(item[key] for item in (body if isinstance(body, list) else [body]))
+    return collect
+
+
+def take(state, field, n=1):
+    values = state[field][:n]
+    del state[field][:n]
+    return values
+
+
+SCENARIOS = [
+    Scenario("GET /api/summary", lambda i, st: ("GET", "/api/summary", {})),
+    Scenario("GET /api/summary/period (12 meses)",
+             lambda i, st: ("GET", "/api/summary/period?from=2023-01-01&to=2023-12-31&granularity=month", {})),
+    Scenario("GET /api/transactions", lambda i, st: ("GET", "/api/transactions", {})),
+    Scenario("GET /api/transactions/stream", lambda i, st: ("GET", "/api/transactions/stream", {}), share=0.01),
+    Scenario("GET /api/fixed-expenses", lambda i, st: ("GET", "/api/fixed-expenses", {})),
+    Scenario("POST /api/transactions", lambda i, st: ("POST", "/api/transactions", {"json": transaction(i)}),
+             collect=keep("ids")),
+    Scenario("POST /api/transactions/batch (10 itens)",
+             lambda i, st: ("POST", "/api/transactions/batch", {"json": [transaction(i * 10 + n) for n in range(10)]}),
+             collect=keep("batch_ids")),
+    Scenario("POST /api/transactions/import (CSV, 100 linhas)",
+             lambda i, st: ("POST", "/api/transactions/import", import_csv(i)), share=0.1),
+    Scenario("POST /api/fixed-expenses",
+             lambda i, st: ("POST", "/api/fixed-expenses", {"json": {"description": f"Despesa {i}", "amount": 99.9}}),
+             collect=keep("fixed_ids")),
+    Scenario("POST /api/analyze-invoice (modelo fake)",
+             lambda i, st: ("POST", "/api/analyze-invoice", invoice_pdf(i)), share=0.2),
+    Scenario("POST /api/analyze-invoice?mode=async",
+             lambda i, st: ("POST", "/api/analyze-invoice?mode=async", invoice_pdf(i)), share=0.2,
+             collect=keep("jobs", "job_id")),
+    Scenario("GET /api/analyze-invoice/jobs/{id}",
+             lambda i, st: ("GET", f"/api/analyze-invoice/jobs/{st['jobs'][i % len(st['jobs'])]}", {})),
+    Scenario("POST /api/transactions/batch-delete (10 ids)",
+             lambda i, st: ("POST", "/api/transactions/batch-delete", {"json": {"ids": take(st, "batch_ids", 10)}})),
+    Scenario("DELETE /api/transactions/{id}",
+             lambda i, st: ("DELETE", f"/api/transactions/{take(st, 'ids')[0]}", {})),
+    Scenario("DELETE /api/fixed-expenses/{id}",
+             lambda i, st: ("DELETE", f"/api/fixed-expenses/{take(st, 'fixed_ids')[0]}", {})),
+]
+
+
+class StandInDatabase:
+    """Banco simulado com a interface de database.db e respostas no formato das consultas."""
+
+    mode = "async"
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.statements = 0
+        self._next_id = rows
+
+    def _transactions(self, start, count):
+        return [
+            {"id": i, "description": f"Transação {i}", "amount": -12.5, "transaction_date": "2023-06-01"}
+            for i in range(start, start + count)
+        ]
+
+    def _new_id(self):
+        self._next_id += 1
+        return self._next_id
+
+    async def open(self):
+        pass
+
+    async def close(self):
+        pass
+
+    async def fetch_all(self, query, params=None):
+        self.statements += 1
+        if query.lstrip().startswith("DELETE"):
+            ids = params[0] if isinstance(params[0], list) else [params[0]]
+            return [{"id": i, "amount": -12.5} for i in ids]
+        if "fixed_expenses" in query:
+            return [{"id": i, "description": f"Despesa {i}", "amount": 99.9} for i in range(1, 11)]
+        if "period_start" in query:
+            return []
+        return self._transactions(1, min(self.rows, 101))
+
+    async def fetch_one(self, query, params=None):
+        self.statements += 1
+        if query.lstrip().startswith("INSERT"):
+            return {"id": self._new_id()}
+        return {"income": 1000.0 * self.rows, "expense": -900.0 * self.rows, "transactions_count": self.rows}
+
+    async def execute(self, query, params=None):
+        self.statements += 1
+
+    async def copy_rows(self, table, columns, rows):
+        self.statements += 1
+        return len(rows)
+
+    async def insert_rows(self, table, columns, rows, returning=None):
+        self.statements += 1
+        return [{"id": self._new_id()} for _ in rows] if returning else len(rows)
+
+    async def stream_batches(self, query, params=None, batch_size=1000):
+        for start in range(1, self.rows + 1, batch_size):
+            self.statements += 1
+            yield self._transactions(start, min(batch_size, self.rows - start + 1))
+
+    @asynccontextmanager
+    async def transaction(self):
+        yield self
+
+
+def count_statements():
+    """Conta os comandos enviados pelas transações reais (AsyncTransaction e SyncTransaction)."""
+    import database
+
+    counter = {"statements": 0}
+
+    def counted(method):
+        @functools.wraps(method)
+        async def wrapper(*args, **kwargs):
+            counter["statements"] += 1
+            return await method(*args, **kwargs)
+        return wrapper
+
+    def counted_stream(method):
+        @functools.wraps(method)
+        async def wrapper(*args, **kwargs):
+            async for rows in method(*args, **kwargs):
+                counter["statements"] += 1
+                yield rows
+        return wrapper
+
+    for cls in (database.AsyncTransaction, database.SyncTransaction):
+        for name in DB_METHODS:
+            setattr(cls, name, counted(getattr(cls, name)))
+        cls.stream_batches = counted_stream(cls.stream_batches)
+    return counter
+
+
+async def run_scenario(client, scenario, requests, concurrency, state, statements):
+    count = scenario.count(requests)
+    latencies = []
+    errors = 0
+    next_index = iter(range(count))
+
+    async def user():
+        nonlocal errors
+        for i in next_index:
+            method, path, kwargs = scenario.request(i, state)
+            start = time.perf_counter()
+            response = await client.request(method, path, **kwargs)
+            await response.aread()
+            latencies.append(time.perf_counter() - start)
+            if response.status_code >= 400:
+                errors += 1
+            elif scenario.collect:
+                scenario.collect(response, state)
+
+    before = statements()
+    start = time.perf_counter()
+    await asyncio.gather(*(user() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+
+    def percentile(p):
+        return latencies[min(len(latencies) - 1, int(len(latencies) * p))]
+
+    return {
+        "route": scenario.name,
+        "requests": count,
+        "errors": errors,
+        "rps": count / elapsed,
+        "p50": statistics.median(latencies),
+        "p95": percentile(0.95),
+        "p99": percentile(0.99),
+        "db_statements": (statements() - before) / count,
+    }
+
+
+async def prepare_real(rows, schema):
+    """Cria o schema, aplica as migrações (startup do app) e popula transactions."""
+    import psycopg
+    from explain_migrations import conninfo
+
+    import cache
+    import main
+
+    async with await psycopg.AsyncConnection.connect(conninfo(), autocommit=True) as conn:
+        await conn.execute(f"DROP SCHEMA IF EXISTS {schema} CASCADE")
+        await conn.execute(f"CREATE SCHEMA {schema}")
+    await main.on_startup()
+    async with await psycopg.AsyncConnection.connect(conninfo(), autocommit=True, options=f"-c search_path={schema}") as conn:
+        await conn.execute(SEED_QUERY, {"rows": rows})
+        months = await (await conn.execute(MONTHS_QUERY)).fetchall()
+        for (month,) in months:
+            await conn.execute("SELECT transactions_ensure_partition(%s)", (month,))
+        await conn.execute("VACUUM ANALYZE transactions")
+    await cache.redis_client.flushdb()
+
+
+async def cleanup_real(schema):
+    import psycopg
+    from explain_migrations import conninfo
+
+    import cache
+    import main
+
+    await cache.redis_client.flushdb()
+    await main.on_shutdown()
+    async with await psycopg.AsyncConnection.connect(conninfo(), autocommit=True) as conn:
+        await conn.execute(f"DROP SCHEMA IF EXISTS {schema} CASCADE")
+
+
+def worker(args):
+    """Executa todos os cenários para ``args.rows`` linhas e imprime o resultado em JSON."""
+    import httpx
+    from opentelemetry.sdk.trace.export import SpanExporter, SpanExportResult
+
+    import instrumentation
+
+    # As faturas de carga não são PDFs de verdade; o aviso do pypdf só polui a saída
+    logging.getLogger("pypdf").setLevel(logging.ERROR)
+
+    class NullSpanExporter(SpanExporter):
+        """Descarta os spans: o benchmark mede a API, não o tracing (ver tracing_overhead.py)."""
+
+        def __init__(self, **kwargs):
+            pass
+
+        def export(self, spans):
+            return SpanExportResult.SUCCESS
+
+    instrumentation.OTLPSpanExporter = NullSpanExporter
+
+    async def run():
+        from unittest.mock import patch
+
+        import main
+
+        schema = args.schema
+        if args.backend == "real":
+            counter = count_statements()
+
+            def statements():
+                return counter["statements"]
+
+            await prepare_real(args.rows, schema)
+            patches = []
+        else:
+            import fakeredis.aioredis
+            stand_in = StandInDatabase(args.rows)
+            fake_redis = fakeredis.aioredis.FakeRedis(decode_responses=True)
+
+            def statements():
+                return stand_in.statements
+
+            patches = [patch(target, stand_in) for target in ("main.db", "summary.db")]
+            patches += [patch(target, fake_redis) for target in ("cache.redis_client", "invoice_jobs.redis_client", "profiler.redis_client")]
+        for p in patches:
+            p.start()
+        results = []
+        state = {}
+        try:
+            transport = httpx.ASGITransport(app=main.app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=600) as client:
+                for scenario in SCENARIOS:
+                    results.append(await run_scenario(client, scenario, args.requests, args.concurrency, state, statements))
+        finally:
+            for p in patches:
+                p.stop()
+            if args.backend == "real":
+                await cleanup_real(schema)
+        return results
+
+    results = asyncio.run(run())
+    peak_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(json.dumps({"rows": args.rows, "peak_rss_mb": peak_rss_mb, "routes": results}), flush=True)
+    os._exit(0)
+
+
+def run_size(rows, args):
+    # Schema próprio por execução e tamanho; o app conecta nele pelo PGOPTIONS (libpq)
+    schema = f"bench_api_{os.getpid()}_{rows}"
+    environment = {
+        **os.environ,
+        "OTEL_SDK_DISABLED": os.getenv("OTEL_SDK_DISABLED", "true"),
+        "OTEL_METRIC_EXPORT_INTERVAL": "3600000",
+        "INVOICE_MODEL_BACKEND": "fake",
+        "INVOICE_FAKE_LATENCY": "0",
+        "INVOICE_CACHE_BACKEND": "none",
+        "INVOICE_JOB_MAX_QUEUE": "1000000",
+        "SUMMARY_RECONCILE_INTERVAL": "0",
+        "PARTITION_MAINTENANCE_INTERVAL": "0",
+        "REDIS_DB": str(args.redis_db),
+        "PGOPTIONS": f"-c search_path={schema}",
+    }
+    command = [
+        sys.executable, __file__, "--worker", "--backend", args.backend, "--rows", str(rows),
+        "--requests", str(args.requests), "--concurrency", str(args.concurrency), "--redis-db", str(args.redis_db),
+        "--schema", schema,
+    ]
+    process = subprocess.Popen(command, env=environment, stdout=subprocess.PIPE, text=True)
+    output, _ = process.communicate()
+    if process.returncode != 0:
+        raise SystemExit(f"Falha no tamanho {rows} (código {process.returncode})")
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def render(report):
+    meta = report["meta"]
+    out = [
+        "# Benchmark: carga nas rotas da API",
+        "",
+        f"Gerado por `tests/benchmark/api_load.py` em {meta['date']} (commit {meta['commit']}), "
+        f"Python {meta['python']}, backend `{meta['backend']}`, modo de I/O `{meta['io_mode']}`. "
+        f"{meta['requests']} requisições por rota (menos nas rotas pesadas) com {meta['concurrency']} "
+        "clientes simultâneos via ASGI, sem tracing. Comandos no banco: instruções enviadas "
+        "por requisição (inclui lotes do cursor no stream). Latências em ms.",
+    ]
+    for run in report["runs"]:
+        out += [
+            "",
+            f"## {run['rows']:,} transações (pico de RSS: {run['peak_rss_mb']:.0f} MB)",
+            "",
+            "| Rota | Requisições | Req/s | p50 | p95 | p99 | Comandos no banco/req | Erros |",
+            "|---|---:|---:|---:|---:|---:|---:|---:|",
+        ]
+        for r in run["routes"]:
+            out.append(
+                f"| {r['route']} | {r['requests']} | {r['rps']:.0f} | {r['p50'] * 1000:.1f} | {r['p95'] * 1000:.1f} | "
+                f"{r['p99'] * 1000:.1f} | {r['db_statements']:.2f} | {r['errors']} |"
+            )
+    return "\n".join(out)
+
+
+def compare(baseline, report, threshold):
+    """Variação de p95 e req/s por rota e tamanho em relação a uma execução anterior."""
+    before = {(run["rows"], r["route"]): r for run in baseline["runs"] for r in run["routes"]}
+    out = [
+        f"Comparação com {baseline['meta']['commit']} ({baseline['meta']['date']}); "
+        f"⚠️ marca piora acima de {threshold:.0%}.",
+        "",
+        "| Linhas | Rota | p95 antes | p95 agora | Req/s antes | Req/s agora | |",
+        "|---:|---|---:|---:|---:|---:|---|",
+    ]
+    regressions = 0
+    for run in report["runs"]:
+        for r in run["routes"]:
+            old = before.get((run["rows"], r["route"]))
+            if old is None:
+                continue
+            worse = r["p95"] > old["p95"] * (1 + threshold) or r["rps"] < old["rps"] * (1 - threshold)
+            regressions += worse
+            out.append(
+                f"| {run['rows']:,} | {r['route']} | {old['p95'] * 1000:.1f} | {r['p95'] * 1000:.1f} | "
+                f"{old['rps']:.0f} | {r['rps']:.0f} | {'⚠️' if worse else ''} |"
+            )
+    return "\n".join(out), regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backend", choices=("real", "memory"), default="memory")
+    parser.add_argument("--sizes", default="1000,100000,1000000", help="linhas em transactions, separadas por vírgula")
+    parser.add_argument("--requests", type=int, default=500, help="requisições por rota")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--redis-db", type=int, default=15, help="banco do Redis usado no backend real")
+    parser.add_argument("--json", help="grava o resultado em JSON")
+    parser.add_argument("--compare", help="JSON de uma execução anterior para comparar")
+    parser.add_argument("--threshold", type=float, default=0.1, help="piora relativa que conta como regressão")
+    parser.add_argument("--output", help="arquivo Markdown (padrão: stdout)")
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--rows", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--schema", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        worker(args)
+        return
+
+    report = {
+        "meta": {
+            "date": datetime.datetime.now().isoformat(timespec="seconds"),
+            "commit": git_revision(),
+            "python": platform.python_version(),
+            "backend": args.backend,
+            "io_mode": os.getenv("FINTELLI_IO_MODE", "async"),
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+        },
+        "runs": [run_size(int(rows), args) for rows in args.sizes.split(",")],
+    }
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+    text = render(report)
+    regressions = 0
+    if args.compare:
+        with open(args.compare) as f:
+            comparison, regressions = compare(json.load(f), report, args.threshold)
+        text += "\n\n" + comparison
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+"""
+Relatório EXPLAIN do efeito de cada migração nos planos de consulta
+
+Cria um schema temporário, popula transactions com dados sintéticos e, após
+cada migração, registra o plano (EXPLAIN ANALYZE) e o tempo das consultas
+principais da API. O resultado é um Markdown para docs/.
+
+Uso:
+    POSTGRES_HOST=localhost python tests/benchmark/explain_migrations.py \
+        --rows 500000 --output docs/BENCHMARK_MIGRACOES.md
+"""
+import argparse
+import asyncio
+import datetime
+import os
+import platform
+import sys
+
+import psycopg
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../../src/backend/app'))
+
+from database import AsyncTransaction
+from migrations import MIGRATIONS, apply_migration
+
+# Mesmas consultas de main.py / summary.py, com parâmetros fixos
+QUERIES = [
+    ("Primeira página (GET /api/transactions)",
+     "SELECT id, description, amount, to_char(transaction_date, 'YYYY-MM-DD') as transaction_date "
+     "FROM transactions ORDER BY transactions.transaction_date DESC, id DESC LIMIT 101"),
+    ("Página seguinte (keyset)",
+     "SELECT id, description, amount, to_char(transaction_date, 'YYYY-MM-DD') as transaction_date "
+     "FROM transactions WHERE (transactions.transaction_date, id) < ('2022-06-15', 1000000) "
+     "ORDER BY transactions.transaction_date DESC, id DESC LIMIT 101"),
+    ("Despesas de um mês",
+     "SELECT COALESCE(SUM(amount), 0) FROM transactions "
+     "WHERE amount < 0 AND transaction_date >= '2023-03-01' AND transaction_date < '2023-04-01'"),
+    ("Transações de um ano",
+     "SELECT COUNT(*), SUM(amount) FROM transactions "
+     "WHERE transaction_date >= '2021-01-01' AND transaction_date < '2022-01-01'"),
+    ("Resumo total (/api/summary, modo query)",
+     "SELECT COALESCE(SUM(amount) FILTER (WHERE amount > 0), 0) AS income, "
+     "COALESCE(SUM(amount) FILTER (WHERE amount < 0), 0) AS expense, COUNT(*) AS transactions_count "
+     "FROM transactions"),
+]
+
+# Datas crescem com o id, como num sistema real em que as transações chegam em ordem
+SEED_QUERY = """
+    INSERT INTO transactions (description, amount, transaction_date)
+    SELECT 'Transação ' || g,
+           round((random() * 2000 - 1400)::numeric, 2),
+           DATE '2019-01-01' + (g * 1825 / %(rows)s)
+    FROM generate_series(1, %(rows)s) AS g
+"""
+
+
+def conninfo():
+    return psycopg.conninfo.make_conninfo(
+        dbname=os.getenv("POSTGRES_DB"),
+        user=os.getenv("POSTGRES_USER"),
+        password=os.getenv("POSTGRES_PASSWORD"),
+        host=os.getenv("POSTGRES_HOST", "db"),
+        port=os.getenv("POSTGRES_PORT", "5432"),
+    )
+
+
+async def explain(conn, query):
+    async with conn.cursor() as cur:
+        await cur.execute("EXPLAIN (ANALYZE, BUFFERS) " + query)
+        lines = [row[0] for row in await cur.fetchall()]
+    execution = next((line for line in lines if line.startswith("Execution Time")), "")
+    return lines, float(execution.split(":")[1].split()[0]) if execution else None
+
+
+async def best_of(conn, query, runs):
+    """Menor tempo de ``runs`` execuções (a primeira aquece o cache de páginas)."""
+    results = [await explain(conn, query) for _ in range(runs)]
+    return min(results, key=lambda result: result[1] or 0)
+
+
+async def collect(rows, runs):
+    conn = await psycopg.AsyncConnection.connect(conninfo())
+    schema = f"bench_migrations_{os.getpid()}"
+    report = []
+    try:
+        await conn.execute(f"CREATE SCHEMA {schema}")
+        await conn.execute(f"SET search_path TO {schema}")
+        await conn.commit()
+        tx = AsyncTransaction(conn)
+        for migration in MIGRATIONS:
+            await apply_migration(tx, migration)
+            if migration.version == 1:
+                await conn.execute(SEED_QUERY, {"rows": rows})
+            await conn.commit()
+            # VACUUM atualiza o visibility map, necessário para index-only scans
+            await conn.set_autocommit(True)
+            await conn.execute("VACUUM ANALYZE transactions")
+            await conn.set_autocommit(False)
+            plans = [(title, *(await best_of(conn, query, runs))) for title, query in QUERIES]
+            await conn.rollback()
+            report.append((migration, plans))
+    finally:
+        await conn.rollback()
+        await conn.execute(f"DROP SCHEMA IF EXISTS {schema} CASCADE")
+        await conn.commit()
+        await conn.close()
+    return report
+
+
+def scan_node(lines):
+    """Nó de varredura mais interno do plano (ex.: "Index Only Scan using ...")."""
+    scans = [line.split("  (")[0].strip().lstrip("-> ") for line in lines if "Scan" in line.split("  (")[0]]
+    return scans[-1] if scans else lines[0].split("  (")[0].strip()
+
+
+def render(report, rows, server_version):
+    out = [
+        "# Benchmark: efeito das migrações nos planos de consulta",
+        "",
+        f"Gerado por `tests/benchmark/explain_migrations.py` em {datetime.date.today().isoformat()} "
+        f"com {rows:,} transações sintéticas (2019–2023), PostgreSQL {server_version}, "
+        f"Python {platform.python_version()}. Tempos em ms (melhor de várias execuções, "
+        "`EXPLAIN (ANALYZE, BUFFERS)`), cache quente.",
+        "",
+        "| Consulta | " + " | ".join(f"v{m.version} {m.name}" for m, _ in report) + " |",
+        "|---|" + "---:|" * len(report),
+    ]
+    for index, (title, _) in enumerate(QUERIES):
+        cells = []
+        for _, plans in report:
+            _, lines, elapsed = plans[index]
+            cells.append(f"{elapsed:.2f} ({scan_node(lines)})")
+        out.append(f"| {title} | " + " | ".join(cells) + " |")
+    out.append("")
+    for migration, plans in report:
+        out += [f"## v{migration.version} {migration.name}", ""]
+        for title, lines, _ in plans:
+            out += [f"<details><summary>{title}</summary>", "", "```", *lines, "```", "", "</details>", ""]
+    return "\n".join(out)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=500_000)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--output", help="arquivo Markdown (padrão: stdout)")
+    args = parser.parse_args()
+
+    report = await collect(args.rows, args.runs)
+    async with await psycopg.AsyncConnection.connect(conninfo()) as conn:
+        server_version = (await (await conn.execute("SHOW server_version")).fetchone())[0]
+    text = render(report, args.rows, server_version)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
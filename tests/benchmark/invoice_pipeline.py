@@ -0,0 +1,127 @@
+"""
+Benchmark offline do pipeline de análise de faturas
+
+Envia uploads concorrentes a POST /api/analyze-invoice (via ASGI, sem rede) com
+o modelo fake e compara o comportamento antigo (chamada bloqueante dentro do
+handler, sem cache) com o pipeline assíncrono, com e sem cache de resultados.
+A segunda metade dos uploads reenvia os PDFs da primeira. Mede o tempo total, a latência por
+requisição e o maior atraso do event loop durante a carga.
+
+Uso:
+    python tests/benchmark/invoice_pipeline.py --uploads 40 --clients 20 \
+        --latency 0.2 --output docs/BENCHMARK_FATURAS.md
+    # --redis inclui o cache no Redis (REDIS_HOST/REDIS_PORT)
+"""
+import argparse
+import asyncio
+import datetime
+import os
+import platform
+import statistics
+import sys
+import time
+
+import httpx
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../../src/backend/app'))
+
+import invoice
+from invoice import InvoiceAnalyzer, FakeModel, NullResultCache, MemoryResultCache, RedisResultCache
+from main import app
+
+
+class BlockingFakeModel(FakeModel):
+    """Reproduz o código anterior: generate_content síncrono dentro do handler async."""
+
+    async def generate(self, pdf_content):
+        time.sleep(self.latency)
+        return self.response(pdf_content)
+
+
+async def loop_lag(stop, interval=0.005):
+    """Maior atraso (s) observado entre o agendado e o executado no event loop."""
+    worst = 0.0
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        worst = max(worst, time.perf_counter() - start - interval)
+    return worst
+
+
+async def run_scenario(analyzer, uploads, clients):
+    invoice._analyzer = analyzer
+    # A segunda metade reenvia os PDFs da primeira
+    run = time.time()
+    pdfs = [f"%PDF-1.4 fatura {i % (uploads // 2)} {run}".encode() for i in range(uploads)]
+    slots = asyncio.Semaphore(clients)
+    latencies = []
+
+    async def upload(client, pdf):
+        async with slots:
+            start = time.perf_counter()
+            response = await client.post("/api/analyze-invoice", files={"file": ("fatura.pdf", pdf)})
+            latencies.append(time.perf_counter() - start)
+            response.raise_for_status()
+
+    stop = asyncio.Event()
+    lag = asyncio.create_task(loop_lag(stop))
+    start = time.perf_counter()
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench") as client:
+        await asyncio.gather(*(upload(client, pdf) for pdf in pdfs))
+    total = time.perf_counter() - start
+    stop.set()
+    latencies.sort()
+    return {
+        "total": total,
+        "p50": statistics.median(latencies),
+        "p95": latencies[int(len(latencies) * 0.95) - 1],
+        "lag": await lag,
+    }
+
+
+def render(results, args):
+    out = [
+        "# Benchmark: pipeline de análise de faturas",
+        "",
+        f"Gerado por `tests/benchmark/invoice_pipeline.py` em {datetime.date.today().isoformat()}, "
+        f"Python {platform.python_version()}. {args.uploads} uploads com {args.clients} clientes simultâneos; "
+        f"modelo fake com {args.latency * 1000:.0f} ms por chamada e até {args.concurrency} chamadas "
+        "simultâneas; a segunda metade dos uploads reenvia os PDFs da primeira. Tempos em ms.",
+        "",
+        "| Cenário | Total | p50 | p95 | Maior atraso do event loop |",
+        "|---|---:|---:|---:|---:|",
+    ]
+    for title, r in results:
+        out.append(f"| {title} | {r['total'] * 1000:.0f} | {r['p50'] * 1000:.0f} | {r['p95'] * 1000:.0f} | {r['lag'] * 1000:.0f} |")
+    return "\n".join(out)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--uploads", type=int, default=40)
+    parser.add_argument("--clients", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=0.2, help="latência do modelo fake (s)")
+    parser.add_argument("--concurrency", type=int, default=invoice.INVOICE_MAX_CONCURRENCY)
+    parser.add_argument("--redis", action="store_true", help="inclui o cache no Redis")
+    parser.add_argument("--output", help="arquivo Markdown (padrão: stdout)")
+    args = parser.parse_args()
+
+    scenarios = [
+        ("Antes: chamada bloqueante, sem cache", InvoiceAnalyzer(BlockingFakeModel(args.latency), NullResultCache(), args.concurrency)),
+        ("Assíncrono, sem cache", InvoiceAnalyzer(FakeModel(args.latency), NullResultCache(), args.concurrency)),
+        ("Assíncrono + cache em memória", InvoiceAnalyzer(FakeModel(args.latency), MemoryResultCache(), args.concurrency)),
+    ]
+    if args.redis:
+        scenarios.append(("Assíncrono + cache no Redis", InvoiceAnalyzer(FakeModel(args.latency), RedisResultCache(), args.concurrency)))
+
+    results = [(title, await run_scenario(analyzer, args.uploads, args.clients)) for title, analyzer in scenarios]
+    text = render(results, args)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
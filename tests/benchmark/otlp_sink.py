@@ -0,0 +1,85 @@
+"""
+Receptor OTLP/gRPC local que só conta o que recebe, no lugar do Collector
+
+Aceita traces e métricas (com ou sem gzip), conta spans, pontos de métrica e bytes
+e pode atrasar cada exportação para simular um Collector lento. Ao receber SIGTERM
+ou SIGINT imprime os totais em JSON na saída padrão.
+
+Uso:
+    python tests/benchmark/otlp_sink.py --port 4317 --delay 0.05
+    OTEL_EXPORTER_OTLP_ENDPOINT=http://localhost:4317 uvicorn main:app
+"""
+import argparse
+import json
+import signal
+import threading
+import time
+from concurrent import futures
+
+import grpc
+from opentelemetry.proto.collector.metrics.v1 import metrics_service_pb2, metrics_service_pb2_grpc
+from opentelemetry.proto.collector.trace.v1 import trace_service_pb2, trace_service_pb2_grpc
+
+
+class OTLPSink(trace_service_pb2_grpc.TraceServiceServicer, metrics_service_pb2_grpc.MetricsServiceServicer):
+    """Servidor OTLP/gRPC em memória; ``delay`` segundos de espera por exportação."""
+
+    def __init__(self, port=0, delay=0.0, workers=4):
+        self.delay = delay
+        self.totals = {"span_requests": 0, "spans": 0, "metric_requests": 0, "data_points": 0, "bytes": 0}
+        self._lock = threading.Lock()
+        self.server = grpc.server(futures.ThreadPoolExecutor(max_workers=workers))
+        trace_service_pb2_grpc.add_TraceServiceServicer_to_server(self, self.server)
+        metrics_service_pb2_grpc.add_MetricsServiceServicer_to_server(self, self.server)
+        self.port = self.server.add_insecure_port(f"127.0.0.1:{port}")
+
+    @property
+    def endpoint(self):
+        return f"http://127.0.0.1:{self.port}"
+
+    def start(self):
+        self.server.start()
+        return self
+
+    def stop(self):
+        self.server.stop(grace=None)
+
+    def Export(self, request, context):
+        if self.delay:
+            time.sleep(self.delay)
+        size = request.ByteSize()
+        if isinstance(request, trace_service_pb2.ExportTraceServiceRequest):
+            spans = sum(len(scope.spans) for resource in request.resource_spans for scope in resource.scope_spans)
+            self._add(span_requests=1, spans=spans, bytes=size)
+            return trace_service_pb2.ExportTraceServiceResponse()
+        points = sum(
+            len(getattr(metric, metric.WhichOneof("data")).data_points)
+            for resource in request.resource_metrics for scope in resource.scope_metrics for metric in scope.metrics
+        )
+        self._add(metric_requests=1, data_points=points, bytes=size)
+        return metrics_service_pb2.ExportMetricsServiceResponse()
+
+    def _add(self, **counts):
+        with self._lock:
+            for name, value in counts.items():
+                self.totals[name] += value
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=4317)
+    parser.add_argument("--delay", type=float, default=0.0, help="espera (s) por exportação")
+    args = parser.parse_args()
+
+    sink = OTLPSink(args.port, args.delay).start()
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    signal.signal(signal.SIGINT, lambda *_: stop.set())
+    print(json.dumps({"port": sink.port}), flush=True)
+    stop.wait()
+    sink.stop()
+    print(json.dumps(sink.totals), flush=True)
+
+
+if __name__ == "__main__":
+    main()
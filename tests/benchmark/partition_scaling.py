@@ -0,0 +1,164 @@
+"""
+Curva de escala: transactions em tabela única x particionada por mês
+
+Para cada tamanho, cria um schema temporário, aplica as migrações até a 5
+(tabela única), popula com dados sintéticos e mede as consultas da API e as
+operações de manutenção; depois aplica a migração 6 (particionamento) e mede
+de novo. O resultado é um Markdown para docs/.
+
+Uso:
+    POSTGRES_HOST=localhost python tests/benchmark/partition_scaling.py \
+        --sizes 250000,1000000,4000000 --output docs/BENCHMARK_PARTICIONAMENTO.md
+"""
+import argparse
+import asyncio
+import datetime
+import os
+import platform
+import sys
+import time
+
+import psycopg
+
+sys.path.append(os.path.dirname(__file__))
+sys.path.append(os.path.join(os.path.dirname(__file__), '../../src/backend/app'))
+
+from database import AsyncTransaction
+from migrations import MIGRATIONS, apply_migration
+from explain_migrations import conninfo, best_of
+
+# Cinco anos de dados (2019–2023); as datas crescem com o id
+SEED_QUERY = """
+    INSERT INTO transactions (description, amount, transaction_date)
+    SELECT 'Transação ' || g,
+           round((random() * 2000 - 1400)::numeric, 2),
+           DATE '2019-01-01' + (g::bigint * 1825 / %(rows)s)::integer
+    FROM generate_series(1, %(rows)s) AS g
+"""
+
+QUERIES = [
+    ("Primeira página",
+     "SELECT id, description, amount, transaction_date FROM transactions "
+     "ORDER BY transaction_date DESC, id DESC LIMIT 101"),
+    ("Despesas de um mês",
+     "SELECT COALESCE(SUM(amount), 0) FROM transactions "
+     "WHERE amount < 0 AND transaction_date >= '2023-03-01' AND transaction_date < '2023-04-01'"),
+    ("Transações de um ano",
+     "SELECT COUNT(*), SUM(amount) FROM transactions "
+     "WHERE transaction_date >= '2021-01-01' AND transaction_date < '2022-01-01'"),
+    ("Exclusão por id (DELETE /api/transactions/{id})",
+     "DELETE FROM transactions WHERE id = 12345 RETURNING amount"),
+]
+
+# Remover o mês mais antigo: DELETE na tabela única, DETACH na particionada
+DELETE_MONTH = "DELETE FROM transactions WHERE transaction_date >= '2019-01-01' AND transaction_date < '2019-02-01'"
+ARCHIVE_MONTH = "SELECT * FROM transactions_archive_partitions('2019-02-01')"
+
+
+async def timed(conn, query):
+    """Tempo de parede (ms) de ``query``, desfeita em seguida."""
+    start = time.perf_counter()
+    await conn.execute(query)
+    elapsed = (time.perf_counter() - start) * 1000
+    await conn.rollback()
+    return elapsed
+
+
+async def vacuum(conn):
+    await conn.set_autocommit(True)
+    await conn.execute("VACUUM ANALYZE transactions")
+    await conn.set_autocommit(False)
+
+
+async def measure(conn, runs):
+    results = {}
+    for title, query in QUERIES:
+        _, elapsed = await best_of(conn, query, runs)
+        await conn.rollback()
+        results[title] = elapsed
+    return results
+
+
+async def collect(rows, runs):
+    conn = await psycopg.AsyncConnection.connect(conninfo())
+    schema = f"bench_partitions_{os.getpid()}"
+    try:
+        # O schema archive é compartilhado; as partições arquivadas são desfeitas no rollback
+        await conn.execute(f"CREATE SCHEMA {schema}")
+        await conn.execute(f"SET search_path TO {schema}")
+        await conn.commit()
+        tx = AsyncTransaction(conn)
+        for migration in MIGRATIONS[:5]:
+            await apply_migration(tx, migration)
+            if migration.version == 1:
+                await conn.execute(SEED_QUERY, {"rows": rows})
+            await conn.commit()
+        await vacuum(conn)
+        single = await measure(conn, runs)
+        single["Remover o mês mais antigo"] = await timed(conn, DELETE_MONTH)
+
+        start = time.perf_counter()
+        await apply_migration(tx, MIGRATIONS[5])
+        await conn.commit()
+        migration_ms = (time.perf_counter() - start) * 1000
+        await vacuum(conn)
+        partitioned = await measure(conn, runs)
+        partitioned["Remover o mês mais antigo"] = await timed(conn, ARCHIVE_MONTH)
+    finally:
+        await conn.rollback()
+        await conn.execute(f"DROP SCHEMA IF EXISTS {schema} CASCADE")
+        await conn.commit()
+        await conn.close()
+    return single, partitioned, migration_ms
+
+
+def render(report, server_version):
+    titles = [title for title, _ in QUERIES] + ["Remover o mês mais antigo"]
+    out = [
+        "# Benchmark: particionamento mensal de transactions",
+        "",
+        f"Gerado por `tests/benchmark/partition_scaling.py` em {datetime.date.today().isoformat()} "
+        f"com transações sintéticas de 2019–2023 (60 partições mensais), PostgreSQL {server_version}, "
+        f"Python {platform.python_version()}. Consultas: melhor tempo de várias execuções "
+        "(`EXPLAIN ANALYZE`, cache quente). Remoção do mês mais antigo: tempo de parede de "
+        "`DELETE` na tabela única e de `transactions_archive_partitions` (DETACH) na particionada, "
+        "incluindo a atualização dos agregados. Tempos em ms.",
+        "",
+        "| Operação | " + " | ".join(f"{rows:,} única | {rows:,} particionada" for rows, *_ in report) + " |",
+        "|---|" + "---:|---:|" * len(report),
+    ]
+    for title in titles:
+        cells = [f"{single[title]:.2f} | {partitioned[title]:.2f}" for _, single, partitioned, _ in report]
+        out.append(f"| {title} | " + " | ".join(cells) + " |")
+    out += [
+        "",
+        "| Linhas | Migração 6 (conversão) |",
+        "|---:|---:|",
+        *(f"| {rows:,} | {migration_ms / 1000:.1f} s |" for rows, _, _, migration_ms in report),
+    ]
+    return "\n".join(out)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="250000,1000000,4000000",
+                        help="quantidades de linhas, separadas por vírgula")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--output", help="arquivo Markdown (padrão: stdout)")
+    args = parser.parse_args()
+
+    report = []
+    for rows in (int(size) for size in args.sizes.split(",")):
+        report.append((rows, *(await collect(rows, args.runs))))
+    async with await psycopg.AsyncConnection.connect(conninfo()) as conn:
+        server_version = (await (await conn.execute("SHOW server_version")).fetchone())[0]
+    text = render(report, server_version)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -13,6 +13,7 @@ describe('TransactionForm', () => {
 
     beforeEach(() => {
         jest.clearAllMocks();
+        mockApi.newIdempotencyKey.mockReturnValue('chave-teste');
     });
 
     test('renderiza o formulário corretamente', () => {
@@ -73,7 +74,7 @@ describe('TransactionForm', () => {
                 description: 'Salário',
                 amount: 5000,
                 transaction_date: expect.any(String)
-            });
+            }, 'chave-teste');
         });
 
         expect(mockOnTransactionAdded).toHaveBeenCalled();
@@ -100,7 +101,7 @@ describe('TransactionForm', () => {
                 description: 'Mercado',
                 amount: -300, // Deve ser negativo para despesa
                 transaction_date: expect.any(String)
-            });
+            }, 'chave-teste');
         });
     });
 
@@ -154,4 +155,25 @@ describe('TransactionForm', () => {
             expect(amountInput).toHaveValue(null);
         });
     });
+
+    test('reenvio após falha reutiliza a Idempotency-Key', async () => {
+        const user = userEvent.setup();
+        jest.spyOn(window, 'alert').mockImplementation(() => {});
+        mockApi.newIdempotencyKey.mockReturnValueOnce('chave-1').mockReturnValueOnce('chave-2');
+        mockApi.addTransaction
+            .mockRejectedValueOnce(new Error('timeout'))
+            .mockResolvedValueOnce({ id: 4, description: 'Aluguel', amount: 1500, transaction_date: '2024-06-14' });
+
+        render(<TransactionForm onTransactionAdded={mockOnTransactionAdded} />);
+
+        await user.type(screen.getByLabelText(/descrição/i), 'Aluguel');
+        await user.type(screen.getByLabelText(/valor/i), '1500');
+        const submitButton = screen.getByRole('button', { name: /adicionar lançamento/i });
+        await user.click(submitButton);
+        await waitFor(() => expect(submitButton).not.toBeDisabled());
+        await user.click(submitButton);
+
+        await waitFor(() => expect(mockOnTransactionAdded).toHaveBeenCalled());
+        expect(mockApi.addTransaction.mock.calls.map(call => call[1])).toEqual(['chave-1', 'chave-1']);
+    });
 });